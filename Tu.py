@@ -155,6 +155,6 @@ for sheet_name, sql in queries.items():
 
 # ──── 6) Finalize ────────────────────────────────────────────────────────────────
 
-writer.save()
+writer.close()
 conn.close()
 print(f"\n✅ Comparison report written to:\n   {out_xl}")
@@ -123,6 +123,6 @@ for sheet_name, sql in queries.items():
     if not dd.empty:
         dd.to_excel(writer, sheet_name=f"{sheet_name}_DBDupes", index=False)
 
-writer.save()
+writer.close()
 conn.close()
 print(f"\n✅ Report written to: {out_xl}")
@@ -1,6 +1,124 @@
+import numpy as np
 import pandas as pd
 import oracledb
+import contextlib
 import getpass
+import hashlib
+import heapq
+import importlib.util
+import json
+import os
+import pickle
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from itertools import groupby
+from operator import itemgetter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from pandas.io.parsers import TextParser
+
+# rows per fetchmany() round-trip / oracledb prefetch when streaming query results
+FETCH_ARRAYSIZE    = 50_000
+FETCH_PREFETCHROWS = 50_000
+
+# fetch CLOB/NCLOB as str and BLOB as bytes inline with the rows, instead of LOB
+# locators that need one read() round-trip per value (set True for LOBs > 1 GB);
+# passed to each query's execute(), oracledb's process-wide default is left alone
+FETCH_LOBS = False
+
+# compare keys by 64/128-bit row fingerprints instead of merging the full strings
+# (None = string merge); the second hash of a 128-bit fingerprint uses this key
+FINGERPRINT_BITS = 64
+FINGERPRINT_KEY2 = "tu2-fingerprint2"
+
+# master workbook parser: calamine (Rust, much faster) when installed, else openpyxl
+EXCEL_ENGINE = "calamine" if importlib.util.find_spec("python_calamine") else "openpyxl"
+
+# out-of-core mode: spill both sides to sorted runs on disk and merge-join them
+# (bounded memory for tables that don't fit in RAM); SPILL_DIR None = system temp
+EXTERNAL_DIFF = False
+SPILL_ROWS    = 500_000
+SPILL_BLOCK   = 10_000
+SPILL_DIR     = None
+
+# local snapshot cache of query results, off by default (SNAPSHOT_DIR None). Only
+# queries with a freshness probe in SNAPSHOT_PROBES are cached (also when wrapped by
+# a projection / config filter): a snapshot is reused while the probe's result is
+# unchanged and it is younger than SNAPSHOT_TTL seconds, so use a probe that changes
+# on every committed update (MAX(ORA_ROWSCN), a max last-modified timestamp).
+# Snapshots are written and replayed chunk by chunk, so streaming and out-of-core
+# runs stay bounded; least-recently-used ones are evicted beyond SNAPSHOT_MAX_BYTES.
+SNAPSHOT_DIR       = None    # e.g. os.path.join(os.path.expanduser("~"), ".tu2_snapshots")
+SNAPSHOT_TTL       = 24 * 3600
+SNAPSHOT_MAX_BYTES = 2 * 1024**3
+SNAPSHOT_PROBES    = {
+    # "SELECT * FROM SAM_GLOBAL_CLASS.SAM_ML_RISK_SCORE_MAP":
+    #     "SELECT MAX(ORA_ROWSCN) FROM SAM_GLOBAL_CLASS.SAM_ML_RISK_SCORE_MAP",
+}
+
+# incremental compare: per sheet/environment fingerprint state from the last run is
+# kept here (None disables it), so a re-run only fingerprints the INCREMENTAL_CHUNK-row
+# chunks of each side whose digest changed (needs FINGERPRINT_BITS 64 or 128)
+INCREMENTAL_DIR   = None    # e.g. os.path.join(os.path.expanduser("~"), ".tu2_state")
+INCREMENTAL_CHUNK = 65_536
+
+# mode 2: when both environments resolve to the same host/service *and* use the same
+# login (so both queries resolve names in the same schema), diff in the database
+# with SET_DIFF_OP ("MINUS"; "EXCEPT" on Oracle 21c+ / SQLite) and fetch only the
+# differing rows. Any database error (e.g. ORA-00932 on LOB columns, which MINUS
+# and GROUP BY can't compare) falls back to the client-side diff.
+SERVER_SIDE_DIFF = True
+SET_DIFF_OP      = "MINUS"
+
+# push column selection into the SQL: callable / list concat_map rules are resolved
+# against the query's column names (zero-row describe) and only those columns fetched
+PUSHDOWN = True
+
+# declarative per-sheet config (TOML or YAML, see compare.toml); when the file
+# exists (relative to the working directory), mode 1 takes its SQL, key columns,
+# projections and filters from it
+COMPARE_CONFIG = "compare.toml"
+
+# per-workbook sidecar: each parsed sheet (after usecols / rules) is kept under
+# INDEX_DIR/<sha256 of the workbook + this code>/ with a sorted fingerprint index of
+# its 'Concatenated' keys (SheetIndex), so an unchanged workbook is never re-parsed
+# and key lookups are binary searches. Versions unused for INDEX_TTL seconds are
+# pruned; INDEX_DIR None (the default) parses every run and indexes in memory.
+INDEX_DIR = None            # e.g. os.path.join(os.path.expanduser("~"), ".tu2_index")
+INDEX_TTL = 30 * 24 * 3600
+
+# environment definitions (also used by compare.py, which picks them by label)
+ENVS = {
+    1: {"label":"SIT_STG", "host":"NYKDSR000007912.intranet.barcapint.com", "port":1523, "svc":"TTMUS02P"},
+    2: {"label":"SIT_CDS", "host":"NYKDSR000007912.intranet.barcapint.com", "port":1523, "svc":"TTMUS02P"},
+    3: {"label":"UAT_STG","host":"isamusatdb.barcapint.com",        "port":1523, "svc":"TTMUS01P"},
+    4: {"label":"UAT_CDS","host":"isamusatdb.barcapint.com",        "port":1523, "svc":"TTMUS01P"},
+    5: {"label":"PROD",   "host":"your.prod.host.company.com",      "port":1521, "svc":"PROD_SVC"}
+}
+
+# report rows per tab before rolling over to <tab>_2, <tab>_3, ... (Excel's limit)
+EXCEL_MAX_ROWS = 1_048_576
+
+# concurrent sheet mode: DB fetches + key building on a thread pool (one pooled
+# session each), compare on a process pool (0 = compare in this process; use 0 when
+# running from a notebook on Windows, where spawn can't pickle cells). At most
+# SHEETS_IN_FLIGHT sheets are fetched / compared at once, which bounds memory.
+PARALLEL_SHEETS  = True
+FETCH_WORKERS    = 4
+COMPARE_WORKERS  = 4
+SHEETS_IN_FLIGHT = FETCH_WORKERS + COMPARE_WORKERS
+
+# run instrumentation: wall time, rows/s, RSS growth and fetched bytes per sheet and
+# stage (plus the process's peak RSS so far) go to a <workbook>_RunStats report tab and are appended as one JSON line per
+# run to RUN_LOG (None = no log). With PROFILE_DIR set, each run is also profiled
+# with PROFILER ("cProfile" -> .prof, or "pyinstrument" -> .html when installed);
+# both profile the main thread only, so profile with PARALLEL_SHEETS = False.
+RUN_LOG     = "tu2_runs.jsonl"
+PROFILE_DIR = None
+PROFILER    = "cProfile"
 
 # ─── Helpers ────────────────────────────────────────────────────────────────────
 
@@ -8,21 +126,613 @@ def connect_to_oracle(host, port, service, user, pw):
     dsn = oracledb.makedsn(host, port, service_name=service)
     return oracledb.connect(user=user, password=pw, dsn=dsn)
 
+def create_oracle_pool(host, port, service, user, pw, size=FETCH_WORKERS):
+    """
+    Create an oracledb session pool so concurrent sheet fetches each get
+    their own session.
+    """
+    dsn = oracledb.makedsn(host, port, service_name=service)
+    return oracledb.create_pool(user=user, password=pw, dsn=dsn,
+                                min=1, max=size, increment=1)
+
+def create_wallet_pool(alias, wallet_dir, size=FETCH_WORKERS):
+    """
+    Session pool authenticated from an Oracle wallet (secure external
+    password store) instead of a user/password: `alias` is the wallet's TNS
+    alias, wallet_dir holds the wallet plus sqlnet.ora / tnsnames.ora.
+    Needs thick mode (Oracle Client libraries).
+    """
+    oracledb.init_oracle_client(config_dir=wallet_dir)
+    return oracledb.create_pool(externalauth=True, homogeneous=False, dsn=alias,
+                                min=1, max=size, increment=1)
+
+# Oracle column types (cursor.description type_code names) → converter kind used by
+# to_text_series; other types fall back to inferring the kind from the values
+ORACLE_KINDS = {
+    "DB_TYPE_NUMBER":         "number",
+    "DB_TYPE_BINARY_DOUBLE":  "number",
+    "DB_TYPE_BINARY_FLOAT":   "number",
+    "DB_TYPE_BINARY_INTEGER": "number",
+    "DB_TYPE_DATE":           "datetime",
+    "DB_TYPE_TIMESTAMP":      "datetime",
+    "DB_TYPE_CLOB":           "lob",
+    "DB_TYPE_NCLOB":          "lob",
+    "DB_TYPE_BLOB":           "lob",
+    "DB_TYPE_LONG":           "lob",
+    "DB_TYPE_LONG_NVARCHAR":  "lob",
+    "DB_TYPE_LONG_RAW":       "lob",
+}
+
+def column_kinds(description):
+    """Map each result column to its converter kind from cursor.description (see ORACLE_KINDS)."""
+    return {d[0]: ORACLE_KINDS.get(getattr(d[1], "name", None)) for d in description}
+
+def typed_frame(rows, description):
+    """
+    DataFrame from fetched rows with LOB columns as str (CLOB) or upper-case
+    hex (BLOB), and the column kinds stored in df.attrs["db_kinds"] for
+    build_concat. LOBs arrive inline (FETCH_LOBS); locators, if enabled, are
+    read while the cursor is still open.
+    """
+    kinds = column_kinds(description)
+    df = pd.DataFrame(rows, columns=list(kinds))
+    for c, kind in kinds.items():
+        if kind == "lob":
+            vals = [v.read() if hasattr(v, "read") else v for v in df[c].tolist()]
+            df[c] = pd.Series([v.hex().upper() if isinstance(v, bytes) else v for v in vals],
+                              index=df.index, dtype=object)
+    df.attrs["db_kinds"] = kinds
+    return df
+
+def execute_fetch(cur, sql):
+    """cur.execute(sql), with FETCH_LOBS applied to this statement on oracledb cursors."""
+    if isinstance(cur, oracledb.Cursor):
+        return cur.execute(sql, fetch_lobs=FETCH_LOBS)
+    return cur.execute(sql)
+
 def query_to_df(conn, sql):
     with conn.cursor() as cur:
-        cur.execute(sql)
-        cols = [c[0] for c in cur.description]
-        rows = cur.fetchall()
-    return pd.DataFrame(rows, columns=cols)
-
-def build_concat(df, cols=None):
-    df = df.fillna("").astype(str)
-    if cols is None:
-        cols = df.columns.tolist()
-    df["Concatenated"] = df[cols].apply(lambda r: "".join(r.values), axis=1)
-    return df
+        cur.arraysize = FETCH_ARRAYSIZE
+        execute_fetch(cur, sql)
+        return typed_frame(cur.fetchall(), cur.description)
+
+def query_to_chunks(conn, sql, arraysize=FETCH_ARRAYSIZE, prefetchrows=FETCH_PREFETCHROWS):
+    """
+    Execute sql on conn and yield the result as DataFrame chunks of up to
+    `arraysize` rows (cursor.fetchmany), so rows are processed as they arrive
+    instead of waiting for one big fetchall(). An empty result yields one
+    empty chunk, so consumers still see its columns.
+    """
+    with conn.cursor() as cur:
+        cur.arraysize = arraysize
+        if hasattr(cur, "prefetchrows"):      # oracledb only; must be set before execute
+            cur.prefetchrows = prefetchrows
+        execute_fetch(cur, sql)
+        rows = cur.fetchmany(arraysize)
+        yield typed_frame(rows, cur.description)
+        while rows:
+            rows = cur.fetchmany(arraysize)
+            if rows:
+                yield typed_frame(rows, cur.description)
+
+def snapshot_probe(sql):
+    """SNAPSHOT_PROBES entry for sql or for the query it wraps, e.g. "SELECT ... FROM (<sql>) q"."""
+    for base, probe in SNAPSHOT_PROBES.items():
+        if sql == base or f"({base})" in sql:
+            return probe
+    return None
+
+def freshness_token(conn, sql):
+    """Result of sql's snapshot_probe, which changes when the data behind sql changes."""
+    with conn.cursor() as cur:
+        cur.execute(snapshot_probe(sql))
+        return repr(cur.fetchone())
+
+# each snapshot is <key>.arrow (an Arrow IPC stream, one record batch per chunk, every
+# column stored as its to_text_series text so the schema is the same in every chunk
+# and nothing is unpickled on replay; its mtime is the last use) plus <key>.json
+# (label, sql, token, created, bytes); both are published with
+# os.replace and every reader tolerates files another process has just removed,
+# so concurrent runs (e.g. compare.py batches) can share the directory without a lock
+
+def _write_json(path, obj):
+    fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(path))
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(obj, f, indent=1)
+    os.replace(tmp, path)
+
+def _snapshot_entries(cache_dir):
+    entries = {}
+    for name in os.listdir(cache_dir):
+        if name.endswith(".json"):
+            try:
+                with open(os.path.join(cache_dir, name), encoding="utf-8") as f:
+                    entries[name[:-len(".json")]] = json.load(f)
+            except (OSError, ValueError):
+                continue
+    return entries
+
+def _drop_snapshot(cache_dir, key):
+    for ext in (".json", ".arrow"):
+        with contextlib.suppress(OSError):
+            os.remove(os.path.join(cache_dir, key + ext))
+
+def _evict_snapshots(cache_dir):
+    # drop expired snapshots and stale leftovers (temp files, data without metadata),
+    # then least-recently-used ones beyond SNAPSHOT_MAX_BYTES
+    now, entries, used = time.time(), _snapshot_entries(cache_dir), {}
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        key, ext = os.path.splitext(name)
+        with contextlib.suppress(OSError):
+            age = now - os.path.getmtime(path)
+            if ext == ".arrow" and key in entries:
+                used[key] = now - age
+            elif ext in (".arrow", ".tmp") and age > SNAPSHOT_TTL:
+                os.remove(path)
+    for key, e in list(entries.items()):
+        if key not in used or now - e["created"] > SNAPSHOT_TTL:
+            _drop_snapshot(cache_dir, key)
+            del entries[key]
+    total = sum(e["bytes"] for e in entries.values())
+    for key in sorted(entries, key=used.get):
+        if total <= SNAPSHOT_MAX_BYTES:
+            break
+        total -= entries[key]["bytes"]
+        _drop_snapshot(cache_dir, key)
+
+def _snapshot_batch(chunk, schema=None):
+    # chunk as a record batch of large_string columns: the text build_concat would
+    # make of each value (NULLs kept), so a replayed chunk keys exactly like the original
+    import pyarrow as pa
+    kinds = chunk.attrs.get("db_kinds", {})
+    arrays = []
+    for i, c in enumerate(chunk.columns):
+        col = chunk.iloc[:, i]
+        text = to_text_series(col, kinds.get(c)).to_numpy(dtype=object, copy=True)
+        text[col.isna().to_numpy()] = None
+        arrays.append(pa.array(text, type=pa.large_string()))
+    if schema is None:
+        schema = pa.schema([(str(c), pa.large_string()) for c in chunk.columns],
+                           metadata={"db_kinds": json.dumps(kinds)})
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+def _read_snapshot(path):
+    import pyarrow as pa
+    with pa.ipc.open_stream(pa.OSFile(path, "rb")) as reader:
+        kinds = json.loads(reader.schema.metadata[b"db_kinds"])
+        for batch in reader:
+            df = pd.DataFrame({name: batch.column(i).to_numpy(zero_copy_only=False)
+                               for i, name in enumerate(batch.schema.names)})
+            df.attrs["db_kinds"] = kinds
+            yield df
+
+def _store_snapshot(chunks, cache_dir, key, meta):
+    # pass chunks through while writing them to a temp file; the snapshot is only
+    # published once the whole result has been read (an abandoned read leaves nothing)
+    import pyarrow as pa
+    fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=cache_dir)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            writer = None
+            for chunk in chunks:
+                batch = _snapshot_batch(chunk, writer and batch.schema)
+                if writer is None:
+                    writer = pa.ipc.new_stream(f, batch.schema)
+                writer.write_batch(batch)
+                yield chunk
+            if writer is not None:
+                writer.close()
+        path = os.path.join(cache_dir, f"{key}.arrow")
+        os.replace(tmp, path)
+        _write_json(os.path.join(cache_dir, f"{key}.json"), {**meta, "bytes": os.path.getsize(path)})
+        _evict_snapshots(cache_dir)
+    finally:
+        with contextlib.suppress(OSError):
+            os.remove(tmp)
+
+def cached_query_chunks(conn, sql, label, cache_dir=None):
+    """
+    query_to_chunks through the local snapshot cache, keyed by environment
+    label, SQL text and freshness_token. A hit (within SNAPSHOT_TTL) replays
+    the stored chunks instead of running the query; a miss streams from the
+    cursor while writing the chunks to a new snapshot.
+    """
+    cache_dir = cache_dir or SNAPSHOT_DIR
+    os.makedirs(cache_dir, exist_ok=True)
+    token = freshness_token(conn, sql)
+    key = hashlib.sha256("\0".join([label, sql, token]).encode("utf-8")).hexdigest()
+    path = os.path.join(cache_dir, f"{key}.arrow")
+    entry = _snapshot_entries(cache_dir).get(key)
+    if entry and time.time() - entry["created"] <= SNAPSHOT_TTL:
+        try:
+            os.utime(path)                          # mark as recently used
+            yield from _read_snapshot(path)
+            return
+        except FileNotFoundError:                   # evicted by another run just now
+            pass
+    meta = {"label": label, "sql": sql, "token": token, "created": time.time()}
+    yield from _store_snapshot(query_to_chunks(conn, sql), cache_dir, key, meta)
+
+def invalidate_snapshots(label=None, cache_dir=None):
+    """Drop cached snapshots — all of them, or only those for one environment label."""
+    cache_dir = cache_dir or SNAPSHOT_DIR
+    if not os.path.isdir(cache_dir):
+        return
+    for key, e in _snapshot_entries(cache_dir).items():
+        if label is None or e["label"] == label:
+            _drop_snapshot(cache_dir, key)
+
+def fetch_chunks(conn, sql, label=None):
+    """
+    query_to_chunks, served from the snapshot cache when SNAPSHOT_DIR is set,
+    an environment label is given, sql has a snapshot_probe and pyarrow is installed.
+    """
+    if label and SNAPSHOT_DIR and snapshot_probe(sql) and importlib.util.find_spec("pyarrow"):
+        return cached_query_chunks(conn, sql, label)
+    return query_to_chunks(conn, sql)
+
+def iter_keyed_chunks(chunks, cols=None, extra=()):
+    """
+    Yield each chunk reduced to its key columns (as text) plus 'Concatenated'.
+    `cols` is a concat_map entry: a list, a callable(df) -> list, or None (all).
+    `extra` columns are kept as text without joining the key (see build_concat).
+    """
+    for chunk in chunks:
+        if callable(cols):
+            cols = cols(chunk)
+        use = list(cols) if cols is not None else chunk.columns.tolist()
+        yield build_concat(chunk, use, extra)
+
+def build_concat_chunks(chunks, cols=None, extra=()):
+    """
+    Build the 'Concatenated' key chunk by chunk and keep only the key columns,
+    so the raw fetched rows are dropped as soon as each chunk is processed.
+    """
+    parts = list(iter_keyed_chunks(chunks, cols, extra))
+    if not parts:
+        empty = [] if cols is None or callable(cols) else list(cols)
+        return pd.DataFrame(columns=[c for c in extra if c not in empty] + empty + ["Concatenated"])
+    return pd.concat(parts, ignore_index=True)
+
+def decimal_text(d):
+    """Decimal as plain text without exponent or trailing zeros (1.50 → "1.5", 3.0 → "3")."""
+    if d == d.to_integral_value():
+        return str(int(d))
+    return format(d.normalize(), "f")
+
+def to_text(x):
+    """
+    Per-cell text rule: NaN/None → "", whole floats drop ".0" (3.0 → "3"),
+    Decimals as decimal_text, everything else → str(x).
+    """
+    if pd.isna(x):
+        return ""
+    if isinstance(x, float):
+        return str(int(x)) if x.is_integer() else str(x)
+    if isinstance(x, Decimal):
+        return decimal_text(x)
+    return str(x)
 
-def compare_mismatches(left_df, right_df):
+def _datetime_text(s):
+    # str(Timestamp) for a datetime64 column: strftime, plus the fraction where there is one
+    out = s.dt.strftime("%Y-%m-%d %H:%M:%S").to_numpy(dtype=object)
+    frac = ((s.dt.microsecond.fillna(0) != 0) | (s.dt.nanosecond.fillna(0) != 0)).to_numpy()
+    if frac.any():
+        out[frac] = [str(t) for t in s[frac]]
+    return out
+
+def to_text_series(s, kind=None):
+    """
+    Column-wise to_text: picks one conversion for the whole column and only
+    falls back to the per-cell rule for mixed columns. `kind` comes from the
+    DB column type (column_kinds); a "number" column with a numeric dtype
+    skips value inference, otherwise the type is inferred from the values.
+    """
+    na = s.isna().to_numpy()
+    if pd.api.types.is_datetime64_dtype(s.dtype):      # tz-naive only
+        kind = "naive-datetime"
+    elif kind == "number" and pd.api.types.is_integer_dtype(s.dtype):
+        kind = "integer"
+    elif kind == "number" and pd.api.types.is_float_dtype(s.dtype):
+        kind = "floating"
+    else:
+        kind = pd.api.types.infer_dtype(s, skipna=True)
+    if kind == "naive-datetime":
+        out = _datetime_text(s)
+    elif kind == "decimal":
+        out = np.array([decimal_text(v) if isinstance(v, Decimal) else "" for v in s.tolist()],
+                       dtype=object)
+    elif kind in ("string", "empty"):
+        out = s.to_numpy(dtype=object, copy=True)
+    elif kind in ("integer", "boolean"):
+        out = np.array(list(map(str, s.tolist())), dtype=object)
+    elif kind in ("floating", "mixed-integer-float"):
+        vals = pd.to_numeric(s).to_numpy(dtype="float64", na_value=np.nan)
+        if np.nanmax(np.abs(vals), initial=0.0) >= 2**53:
+            return s.map(to_text).astype(object)        # ints beyond float precision
+        whole = np.isfinite(vals) & (np.floor(vals) == vals)
+        rest  = ~whole & ~na
+        out = np.empty(len(vals), dtype=object)
+        out[whole] = list(map(str, vals[whole].astype(np.int64).tolist()))
+        out[rest]  = list(map(str, vals[rest].tolist()))
+    else:
+        return s.map(to_text).astype(object)
+    out[na] = ""
+    return pd.Series(out, index=s.index, name=s.name, dtype=object)
+
+def build_concat(df, cols=None, extra=()):
+    """
+    Convert the selected columns to text (see to_text) column by column and
+    join them, in order, into a new 'Concatenated' column. Returns only the
+    selected columns (as text) plus 'Concatenated'; `extra` columns (e.g.
+    primary keys outside the rule) are kept in front as text but not joined.
+    """
+    use_cols = list(cols) if cols is not None else df.columns.tolist()
+    extra = [c for c in extra if c not in use_cols]
+    kinds = df.attrs.get("db_kinds", {})
+    texts = [to_text_series(df[c], kinds.get(c)) for c in use_cols]
+    out = [to_text_series(df[c], kinds.get(c)) for c in extra] + texts
+    df2 = pd.concat(out, axis=1) if out else pd.DataFrame(index=df.index)
+    df2.columns = extra + use_cols
+    key = np.full(len(df2), "", dtype=object)
+    for t in texts:
+        key = key + t.to_numpy()                       # element-wise str concat in C
+    df2["Concatenated"] = key
+    return df2
+
+def fingerprint(keys, bits=64):
+    """
+    Fixed-width hash of each key string: a uint64 array for bits=64, or a
+    16-byte array (two independently keyed 64-bit hashes) for bits=128.
+    """
+    h = pd.util.hash_pandas_object(keys, index=False, categorize=False).to_numpy()
+    if bits == 64:
+        return h
+    if bits != 128:
+        raise ValueError(f"fingerprint bits must be 64 or 128, got {bits}")
+    h2 = pd.util.hash_pandas_object(keys, index=False, categorize=False,
+                                    hash_key=FINGERPRINT_KEY2).to_numpy()
+    return np.ascontiguousarray(np.stack([h, h2], axis=1)).view(np.dtype((np.void, 16))).ravel()
+
+def incremental_state(*parts):
+    """State file for one comparison (e.g. label + sheet), or None when INCREMENTAL_DIR is unset."""
+    if not INCREMENTAL_DIR:
+        return None
+    os.makedirs(INCREMENTAL_DIR, exist_ok=True)
+    name = hashlib.sha256("\0".join(map(str, parts)).encode("utf-8")).hexdigest()[:32]
+    return os.path.join(INCREMENTAL_DIR, f"{name}.npz")
+
+def _member(values, sorted_unique):
+    # membership of values in a sorted unique array by binary search
+    if not len(sorted_unique):
+        return np.zeros(len(values), dtype=bool)
+    idx = np.minimum(np.searchsorted(sorted_unique, values), len(sorted_unique) - 1)
+    return sorted_unique[idx] == values
+
+def _chunk_digests(keys, rows):
+    # 16-byte blake2b of each `rows`-row block of a key column (text, lengths, NULLs);
+    # one pass over the bytes, much cheaper than fingerprinting every row
+    if importlib.util.find_spec("pyarrow"):
+        import pyarrow as pa
+        a = pa.array(keys, type=pa.large_string(), from_pandas=True)
+        _, offs, data = a.buffers()
+        off = np.frombuffer(offs, np.int64)[a.offset:a.offset + len(a) + 1]
+        nulls = a.is_null().to_numpy(zero_copy_only=False)
+        data = memoryview(data) if data is not None else memoryview(b"")
+        blocks = ((np.diff(off[i:i + rows + 1]).tobytes() + nulls[i:i + rows].tobytes(),
+                   data[off[i]:off[min(i + rows, len(a))]]) for i in range(0, len(a), rows))
+    else:
+        vals = keys.astype(object).where(keys.notna(), "\1").astype(str).tolist()
+        blocks = ((b"", "\0".join(vals[i:i + rows]).encode("utf-8"))
+                  for i in range(0, len(vals), rows))
+    out = []
+    for head, body in blocks:
+        h = hashlib.blake2b(head, digest_size=16)
+        h.update(body)
+        out.append(h.digest())
+    return np.array(out, dtype="S16")
+
+def _runs(sorted_values):
+    # (unique values, counts) of a sorted array, from its run boundaries
+    if not len(sorted_values):
+        return sorted_values, np.empty(0, dtype=np.int64)
+    start = np.flatnonzero(np.concatenate([[True], sorted_values[1:] != sorted_values[:-1]]))
+    return sorted_values[start], np.diff(np.append(start, len(sorted_values)))
+
+def _add_counts(uniq, counts, keys, delta):
+    # add delta[i] to the count of keys[i] in the sorted (uniq, counts), inserting
+    # new keys and dropping keys whose count reaches 0
+    pos = np.searchsorted(uniq, keys)
+    hit = _member(keys, uniq)
+    counts = counts.copy()
+    counts[pos[hit]] += delta[hit]
+    uniq = np.insert(uniq, pos[~hit], keys[~hit])
+    counts = np.insert(counts, pos[~hit], delta[~hit])
+    keep = counts != 0
+    return (uniq, counts) if keep.all() else (uniq[keep], counts[keep])
+
+def _count_of(uniq, counts, keys):
+    # count of each key in the sorted (uniq, counts), 0 when absent
+    pos = np.minimum(np.searchsorted(uniq, keys), max(len(uniq) - 1, 0))
+    return np.where(_member(keys, uniq), counts[pos] if len(uniq) else 0, 0)
+
+def _patch(prev, affected, now):
+    # sorted key set prev with the affected keys replaced by those of them in now
+    return np.sort(np.concatenate([prev[~_member(prev, affected)], now]))
+
+class _Side:
+    """
+    One side of an incremental compare: the key column's per-chunk digests,
+    its non-NULL fingerprints sorted with the (chunk, offset) of their row, and
+    the unique fingerprints with their counts.
+    """
+    FIELDS = ("digests", "lengths", "fps", "chunk", "off", "uniq", "counts")
+
+    def __init__(self, dtype, **arrays):
+        empty = {"digests": np.empty(0, "S16"), "lengths": np.empty(0, np.int64),
+                 "fps": np.empty(0, dtype), "chunk": np.empty(0, np.int64),
+                 "off": np.empty(0, np.int64), "uniq": np.empty(0, dtype),
+                 "counts": np.empty(0, np.int64)}
+        self.__dict__.update(empty, **arrays)
+
+    def update(self, keys, bits, rows):
+        """
+        Bring the side up to date with `keys`. Chunks whose digest is in the
+        previous state are reused as they are; only the others are
+        fingerprinted. Returns the fingerprints whose count changed.
+        """
+        digests = _chunk_digests(keys, rows)
+        lengths = np.minimum(rows, len(keys) - rows * np.arange(len(digests)))
+        old2new = np.full(len(self.digests), -1, dtype=np.int64)
+        unused = {}
+        for j, d in enumerate(self.digests):
+            unused.setdefault(d, []).append(j)
+        fresh = []
+        for i, d in enumerate(digests):               # same position first, then anywhere
+            if i < len(self.digests) and self.digests[i] == d and old2new[i] < 0:
+                old2new[i] = i
+                unused[d].remove(i)
+        taken = set(old2new[old2new >= 0].tolist())
+        for i, d in enumerate(digests):
+            if i in taken:
+                continue
+            if unused.get(d):
+                old2new[unused[d].pop(0)] = i
+            else:
+                fresh.append(i)
+
+        kept = old2new[self.chunk] >= 0
+        removed = self.fps[~kept]
+        fps, chunk, off = self.fps[kept], old2new[self.chunk[kept]], self.off[kept]
+        added = np.empty(0, self.fps.dtype)
+        if fresh:
+            add_fps, add_chunk, add_off = [], [], []
+            for i in fresh:
+                part = keys.iloc[i * rows:i * rows + lengths[i]]
+                ok = np.flatnonzero(part.notna().to_numpy())
+                add_fps.append(fingerprint(part.iloc[ok].astype(str), bits))
+                add_chunk.append(np.full(len(ok), i, dtype=np.int64))
+                add_off.append(ok.astype(np.int64))
+            added = np.concatenate(add_fps)
+            order = np.argsort(added, kind="stable")
+            added = added[order]
+            at = np.searchsorted(fps, added)
+            fps = np.insert(fps, at, added)
+            chunk = np.insert(chunk, at, np.concatenate(add_chunk)[order])
+            off = np.insert(off, at, np.concatenate(add_off)[order])
+
+        uniq, counts = self.uniq, self.counts
+        for h, sign in ((added, 1), (removed, -1)):             # both sorted
+            if len(h):
+                u, c = _runs(h)
+                uniq, counts = _add_counts(uniq, counts, u, sign * c)
+        self.__dict__.update(digests=digests, lengths=lengths, fps=fps, chunk=chunk, off=off,
+                             uniq=uniq, counts=counts)
+        return _runs(np.sort(np.concatenate([added, removed])))[0]
+
+    def rows(self, keys):
+        """
+        Row positions (in the current key column) of every row whose fingerprint
+        is in the sorted `keys`, and the first such row of each key.
+        """
+        lo, hi = np.searchsorted(self.fps, keys, "left"), np.searchsorted(self.fps, keys, "right")
+        n = hi - lo
+        idx = np.repeat(lo - (np.cumsum(n) - n), n) + np.arange(n.sum())
+        starts = np.concatenate([[0], np.cumsum(self.lengths)[:-1]]).astype(np.int64)
+        pos = starts[self.chunk[idx]] + self.off[idx] if len(idx) else np.empty(0, np.int64)
+        first = np.minimum.reduceat(pos, (np.cumsum(n) - n)[n > 0]) if len(pos) else pos
+        return pos, first
+
+def _load_state(state, bits, rows):
+    # arrays saved by the previous run (per-side _Side fields, key sets), or None
+    if not os.path.exists(state):
+        return None
+    with np.load(state) as z:
+        if ("left_fps" not in z.files or int(z["bits"]) != bits
+                or int(z["chunk_rows"]) != rows):
+            return None
+        return {k: z[k] for k in z.files}
+
+def incremental_reconcile(left_df, right_df, state, labels=("Left", "Right"), col="Concatenated",
+                          fingerprint_bits=FINGERPRINT_BITS):
+    """
+    reconcile against the state saved by the previous run in `state` (.npz).
+    Each side's key column is split into INCREMENTAL_CHUNK-row chunks and
+    only chunks whose digest isn't in the state are fingerprinted; the
+    fingerprint index, the counts and the one-sided / duplicate /
+    count-mismatch key sets are patched for the keys those chunks touch,
+    and rows are found by binary search for the reported keys only. So an
+    unchanged or slightly changed input costs a digest pass plus work
+    proportional to the change and the mismatches, not a full re-hash.
+    Returns the same dict as reconcile and saves the new state.
+    """
+    if fingerprint_bits not in (64, 128):
+        raise ValueError(f"Incremental compare needs fingerprint_bits 64 or 128, got {fingerprint_bits}.")
+    bits, rows = fingerprint_bits, INCREMENTAL_CHUNK
+    dtype = np.uint64 if bits == 64 else np.dtype((np.void, 16))
+    prev = _load_state(state, bits, rows) or {}
+    sides = {s: _Side(dtype, **{f: prev[f"{s}_{f}"] for f in _Side.FIELDS if f"{s}_{f}" in prev})
+             for s in ("left", "right")}
+    sets = {k: prev.get(k, np.empty(0, dtype))
+            for k in ("only_left", "only_right", "dupes_left", "dupes_right", "count_mismatch")}
+
+    L, R = sides["left"], sides["right"]
+    changed = [L.update(left_df[col], bits, rows), R.update(right_df[col], bits, rows)]
+    affected = _runs(np.sort(np.concatenate(changed)))[0]
+    if len(affected):
+        lc = _count_of(L.uniq, L.counts, affected)
+        rc = _count_of(R.uniq, R.counts, affected)
+        now = {"only_left": (lc > 0) & (rc == 0), "only_right": (rc > 0) & (lc == 0),
+               "dupes_left": lc > 1, "dupes_right": rc > 1,
+               "count_mismatch": (lc > 0) & (rc > 0) & (lc != rc)}
+        sets = {k: _patch(sets[k], affected, affected[now[k]]) for k in sets}
+    if len(affected) or not prev or any(not np.array_equal(sides[s].digests, prev[f"{s}_digests"])
+                                        for s in sides):
+        tmp = f"{state}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, bits=bits, chunk_rows=rows, **sets,
+                     **{f"{s}_{f}": getattr(sides[s], f) for s in sides for f in _Side.FIELDS})
+        os.replace(tmp, state)
+
+    def found(df, side, keys):
+        # rows of the sorted fingerprints `keys` on one side: a row mask, and the
+        # key texts (with their fingerprints) in order of first appearance
+        pos, first = side.rows(keys)
+        mask = np.zeros(len(df), dtype=bool)
+        mask[pos] = True
+        order = np.argsort(first, kind="stable")
+        return mask, df[col].iloc[first[order]].astype(str).tolist(), keys[order]
+
+    left_only, only_l, _ = found(left_df, L, sets["only_left"])
+    right_only, only_r, _ = found(right_df, R, sets["only_right"])
+    _, both_text, both = found(left_df, L, sets["count_mismatch"])
+    return {
+        "only_left":  only_l,
+        "only_right": only_r,
+        "left_only":  left_only,
+        "right_only": right_only,
+        "left_dupes":  left_df[found(left_df, L, sets["dupes_left"])[0]].copy(),
+        "right_dupes": right_df[found(right_df, R, sets["dupes_right"])[0]].copy(),
+        "count_mismatch": pd.DataFrame({col: both_text,
+                                        f"{labels[0]}_Count": _count_of(L.uniq, L.counts, both),
+                                        f"{labels[1]}_Count": _count_of(R.uniq, R.counts, both)}),
+    }
+
+def compare_mismatches(left_df, right_df, fingerprint_bits=FINGERPRINT_BITS):
+    """
+    Return (only_right, only_left) lists of 'Concatenated' keys. With
+    fingerprint_bits set, the set difference runs on fixed-width row hashes and
+    key strings are only pulled back for the mismatches; None keeps the
+    original outer merge on the full strings.
+    """
+    if fingerprint_bits:
+        L = left_df["Concatenated"].dropna().astype(str)
+        R = right_df["Concatenated"].dropna().astype(str)
+        lh, rh = fingerprint(L, fingerprint_bits), fingerprint(R, fingerprint_bits)
+        only_right = R[~np.isin(rh, lh)].drop_duplicates().tolist()
+        only_left  = L[~np.isin(lh, rh)].drop_duplicates().tolist()
+        return only_right, only_left
     L = left_df[["Concatenated"]].dropna().drop_duplicates().astype(str)
     R = right_df[["Concatenated"]].dropna().drop_duplicates().astype(str)
     merged = L.merge(R, on="Concatenated", how="outer", indicator=True)
@@ -30,168 +740,1309 @@ def compare_mismatches(left_df, right_df):
     only_left  = merged[merged["_merge"]=="left_only" ]["Concatenated"].tolist()
     return only_right, only_left
 
+def reconcile(left_df, right_df, labels=("Left", "Right"), col="Concatenated",
+              fingerprint_bits=FINGERPRINT_BITS, state=None):
+    """
+    Single-pass reconciliation of two keyed frames: both sides' keys are
+    factorized into one hash table (on 64-bit fingerprints when
+    fingerprint_bits is 64) and counted per side with bincount. Returns a
+    dict with
+      only_left / only_right    distinct keys on one side only (in order of
+                                first appearance, like compare_mismatches)
+      left_only / right_only    row masks of those rows
+      left_dupes / right_dupes  rows whose key repeats on that side
+                                (like find_duplicates)
+      count_mismatch            keys on both sides with different counts:
+                                col, <labels[0]>_Count, <labels[1]>_Count
+    With a `state` file (see incremental_state) the same dict comes from
+    incremental_reconcile instead.
+    """
+    if state:
+        return incremental_reconcile(left_df, right_df, state, labels, col, fingerprint_bits)
+    L, R = left_df[col], right_df[col]
+    ok_l, ok_r = L.notna().to_numpy(), R.notna().to_numpy()
+    keys = pd.concat([L[ok_l], R[ok_r]], ignore_index=True).astype(str)
+    codes, _ = pd.factorize(fingerprint(keys, 64) if fingerprint_bits == 64 else keys)
+    n, split = (codes.max() + 1 if len(codes) else 0), int(ok_l.sum())
+    nl = np.bincount(codes[:split], minlength=n)
+    nr = np.bincount(codes[split:], minlength=n)
+    first = np.empty(n, dtype=np.int64)
+    first[codes[::-1]] = np.arange(len(codes) - 1, -1, -1)    # first row of each key
+    key_text = keys.to_numpy()
+
+    def rows(ok, c, flags):
+        mask = np.zeros(len(ok), dtype=bool)
+        mask[ok] = flags[c]
+        return mask
+
+    only_l, only_r = (nl > 0) & (nr == 0), (nr > 0) & (nl == 0)
+    both = np.flatnonzero((nl > 0) & (nr > 0) & (nl != nr))
+    return {
+        "only_left":  key_text[first[np.flatnonzero(only_l)]].tolist(),
+        "only_right": key_text[first[np.flatnonzero(only_r)]].tolist(),
+        "left_only":  rows(ok_l, codes[:split], only_l),
+        "right_only": rows(ok_r, codes[split:], only_r),
+        "left_dupes":  left_df[rows(ok_l, codes[:split], nl > 1)].copy(),
+        "right_dupes": right_df[rows(ok_r, codes[split:], nr > 1)].copy(),
+        "count_mismatch": pd.DataFrame({col: key_text[first[both]],
+                                        f"{labels[0]}_Count": nl[both],
+                                        f"{labels[1]}_Count": nr[both]}),
+    }
+
 def find_duplicates(df, col="Concatenated"):
     vc = df[col].value_counts()
     keys = vc[vc>1].index.tolist()
     return df[df[col].isin(keys)].copy()
 
-# ─── 1) Select comparison mode ───────────────────────────────────────────────────
+def rss_mb():
+    """Current resident set size of this process, in MB (None where unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:            # Linux
+            return round(int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20, 1)
+    except (OSError, ValueError, AttributeError):
+        pass
+    if importlib.util.find_spec("psutil"):
+        import psutil
+        return round(psutil.Process().memory_info().rss / 2**20, 1)
+    return None
 
-print("Select comparison mode:")
-print("  1: Database vs Datasheet")
-print("  2: Database vs Database")
-mode = input("Enter 1 or 2: ").strip()
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in MB (None where unavailable)."""
+    try:
+        import resource
+    except ImportError:                                 # Windows
+        if importlib.util.find_spec("psutil"):
+            import psutil
+            return round(psutil.Process().memory_info().peak_wset / 2**20, 1)
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (2**20 if sys.platform == "darwin" else 2**10), 1)   # bytes / KB
 
-# ─── Common environment definitions ──────────────────────────────────────────────
+def frame_bytes(df):
+    return int(df.memory_usage(deep=True).sum())
 
-envs = {
-    1: {"label":"SIT_STG", "host":"NYKDSR000007912.intranet.barcapint.com", "port":1523, "svc":"TTMUS02P"},
-    2: {"label":"SIT_CDS", "host":"NYKDSR000007912.intranet.barcapint.com", "port":1523, "svc":"TTMUS02P"},
-    3: {"label":"UAT_STG","host":"isamusatdb.barcapint.com",        "port":1523, "svc":"TTMUS01P"},
-    4: {"label":"UAT_CDS","host":"isamusatdb.barcapint.com",        "port":1523, "svc":"TTMUS01P"},
-    5: {"label":"PROD",   "host":"your.prod.host.company.com",      "port":1521, "svc":"PROD_SVC"}
+class RunStats:
+    """
+    Per-stage instrumentation for one run. `with stats.stage("fetch", sheet) as rec:`
+    times the block and records its wall time, rss_delta_mb (RSS at the end
+    minus RSS at the start: what the stage kept resident, approximate when
+    stages overlap in threads), the process-wide peak RSS so far and, when the
+    block sets rec["rows"] / rec["bytes"], rows/s and bytes. Thread-safe, so the parallel runner's threads share one instance;
+    records made in worker processes are added with extend(). frame() is the
+    RunStats report tab, write_log() appends the run to a JSON-lines log.
+    """
+    COLUMNS = ["stage", "sheet", "seconds", "rows", "rows_per_s", "bytes", "rss_delta_mb",
+               "process_peak_rss_mb", "pid"]
+
+    def __init__(self):
+        self.started = time.time()
+        self.records = []
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name, sheet=None):
+        rec = {"stage": name, "sheet": sheet, "rows": None, "bytes": None}
+        rss0, t0 = rss_mb(), time.perf_counter()
+        try:
+            yield rec
+        finally:
+            seconds, rss1 = time.perf_counter() - t0, rss_mb()
+            rec.update(seconds=round(seconds, 3), pid=os.getpid(), process_peak_rss_mb=peak_rss_mb(),
+                       rss_delta_mb=round(rss1 - rss0, 1) if rss0 is not None else None,
+                       rows_per_s=round(rec["rows"] / seconds) if rec["rows"] and seconds else None)
+            self.extend([rec])
+
+    def extend(self, records):
+        with self._lock:
+            self.records.extend(records)
+
+    def frame(self):
+        df = pd.DataFrame(self.records, columns=self.COLUMNS)
+        return df.astype({c: "Int64" for c in ("rows", "rows_per_s", "bytes", "pid")})
+
+    def write_log(self, path, **meta):
+        entry = {"started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+                 "seconds": round(time.time() - self.started, 3), **meta,
+                 "stages": [{k: r.get(k) for k in self.COLUMNS} for r in self.records]}
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, default=str) + "\n")
+
+def stats_tab(name):
+    """Report tab for RunStats.frame(): <name>_RunStats, name cut to fit Excel's 31 chars."""
+    return f"{name[:31 - len('_RunStats')]}_RunStats"
+
+def _counted(chunks, rec):
+    # pass fetched chunks through, adding their rows / in-memory bytes to a stage record
+    for chunk in chunks:
+        rec["rows"] = (rec["rows"] or 0) + len(chunk)
+        rec["bytes"] = (rec["bytes"] or 0) + frame_bytes(chunk)
+        yield chunk
+
+def start_profiler():
+    """Start PROFILER when PROFILE_DIR is set; returns the profiler (or None) for stop_profiler."""
+    if not PROFILE_DIR:
+        return None
+    if PROFILER == "pyinstrument" and importlib.util.find_spec("pyinstrument"):
+        import pyinstrument
+        prof = pyinstrument.Profiler()
+    else:
+        import cProfile
+        prof = cProfile.Profile()
+    if hasattr(prof, "start"):
+        prof.start()
+    else:
+        prof.enable()
+    return prof
+
+def stop_profiler(prof, name):
+    """Stop prof and write it to PROFILE_DIR/<name>_<timestamp>.prof (or .html); returns the path."""
+    if prof is None:
+        return None
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    base = os.path.join(PROFILE_DIR, f"{name}_{time.strftime('%Y%m%d_%H%M%S')}")
+    if hasattr(prof, "output_html"):
+        prof.stop()
+        with open(base + ".html", "w", encoding="utf-8") as f:
+            f.write(prof.output_html())
+        return base + ".html"
+    prof.disable()
+    prof.dump_stats(base + ".prof")
+    return base + ".prof"
+
+class ReportWriter:
+    """
+    Constant-memory .xlsx report writer: xlsxwriter in constant_memory mode
+    when installed, else openpyxl write-only, so rows go to disk as they are
+    appended instead of building the whole workbook in memory.
+    append(tab, df) adds df's rows under tab (header from the first append);
+    when a tab reaches EXCEL_MAX_ROWS it continues in <tab>_2, <tab>_3, ...
+    Names cut to Excel's 31 characters that clash with an earlier tab get a
+    ~2, ~3, ... suffix.
+    """
+    def __init__(self, path, max_rows=EXCEL_MAX_ROWS):
+        self.path, self.max_rows = path, max_rows
+        self.tabs = {}                     # tab -> {"cols", "part", "ws", "row"}
+        self.names = set()                 # sheet names used so far, lower-case
+        if importlib.util.find_spec("xlsxwriter"):
+            import xlsxwriter
+            self.book = xlsxwriter.Workbook(path, {"constant_memory": True,
+                                                   "strings_to_urls": False})
+        else:
+            import openpyxl
+            self.book = openpyxl.Workbook(write_only=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _sheet(self, tab, part):
+        suffix = "" if part == 1 else f"_{part}"
+        name = tab[:31 - len(suffix)] + suffix          # Excel caps tab names at 31 chars
+        n = 1
+        while name.lower() in self.names:              # names are unique ignoring case
+            n += 1
+            name = tab[:31 - len(suffix) - len(f"~{n}")] + suffix + f"~{n}"
+        self.names.add(name.lower())
+        if hasattr(self.book, "add_worksheet"):
+            return self.book.add_worksheet(name)
+        return self.book.create_sheet(name)
+
+    def _write_row(self, state, values):
+        if hasattr(state["ws"], "write_row"):
+            state["ws"].write_row(state["row"], 0, values)
+        else:
+            state["ws"].append(values)
+        state["row"] += 1
+
+    def append(self, tab, df):
+        state = self.tabs.get(tab)
+        if state is None:
+            state = self.tabs[tab] = {"cols": list(df.columns), "part": 1,
+                                      "ws": self._sheet(tab, 1), "row": 0}
+            self._write_row(state, state["cols"])
+        df = df.reindex(columns=state["cols"])
+        values = df.astype(object).where(df.notna(), None).to_numpy().tolist()
+        for row in values:
+            if state["row"] >= self.max_rows:
+                state["part"] += 1
+                state["ws"], state["row"] = self._sheet(tab, state["part"]), 0
+                self._write_row(state, state["cols"])
+            self._write_row(state, [v if v is None or isinstance(v, (str, int, float, bool))
+                                    else str(v) for v in row])
+
+    def close(self):
+        if hasattr(self.book, "add_worksheet"):
+            self.book.close()
+        else:
+            self.book.save(self.path)
+
+def fetch_keyed(conn, sql, cols=None, label=None, extra=()):
+    """Stream sql from conn and build its 'Concatenated' key (see build_concat_chunks)."""
+    return build_concat_chunks(fetch_chunks(conn, sql, label), cols, extra)
+
+def iter_fetch_pairs(conn1, conn2, jobs, labels=(None, None)):
+    """
+    DB-vs-DB fetch: for each (name, sql1, sql2, cols) in jobs, yield
+    (name, df1, df2) with both environments fetched concurrently, one thread
+    per connection. The next pair is fetched while the caller compares the
+    current one, so at most one pending result per side is held in memory.
+    labels enable the snapshot cache for each side (see fetch_chunks).
+    """
+    jobs = list(jobs)
+    if not jobs:
+        return
+    with ThreadPoolExecutor(2) as ex:
+        def submit(job):
+            name, sql1, sql2, cols = job
+            return (name, ex.submit(fetch_keyed, conn1, sql1, cols, labels[0]),
+                    ex.submit(fetch_keyed, conn2, sql2, cols, labels[1]))
+        pending = submit(jobs[0])
+        for nxt in jobs[1:] + [None]:
+            name, f1, f2 = pending
+            df1, df2 = f1.result(), f2.result()
+            pending = submit(nxt) if nxt is not None else None
+            yield name, df1, df2
+
+def same_database(cfg1, cfg2):
+    """True when two envs entries point at the same host, port and service."""
+    return ((cfg1["host"].lower(), cfg1["port"], cfg1["svc"].upper()) ==
+            (cfg2["host"].lower(), cfg2["port"], cfg2["svc"].upper()))
+
+def query_columns(conn, sql):
+    """Column names of sql's result, without fetching any rows."""
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT * FROM ({sql}) q WHERE 1 = 0")
+        return [c[0] for c in cur.description]
+
+def push_projection(conn, sql, rule, keys=()):
+    """
+    Rewrite sql to select only the columns a concat_map rule uses (plus key
+    columns). Returns (sql, rule) with the rule resolved to a list; callable
+    rules are evaluated on the column names only. No-op for rule None or
+    with PUSHDOWN off.
+    """
+    if not PUSHDOWN or rule is None:
+        return sql, rule
+    cols = query_columns(conn, sql) if callable(rule) or keys else None
+    use = list(rule(pd.DataFrame(columns=cols))) if callable(rule) else list(rule)
+    select = ", ".join(f'q."{c}"' for c in dict.fromkeys([*keys, *use]))
+    return f"SELECT {select} FROM ({sql}) q", use
+
+def server_side_dupes(conn, sql):
+    """
+    Rows of sql that occur more than once, grouped in the database and
+    expanded back to one row per occurrence (the find_duplicates layout).
+    """
+    cols = ", ".join(f'q."{c}"' for c in query_columns(conn, sql))
+    df = query_to_df(conn, f"SELECT {cols}, COUNT(*) AS DUP_COUNT__ FROM ({sql}) q "
+                           f"GROUP BY {cols} HAVING COUNT(*) > 1")
+    return df.loc[df.index.repeat(df.pop("DUP_COUNT__"))].reset_index(drop=True)
+
+def server_side_compare(conn, sql1, sql2, labels=("Left", "Right"), op=SET_DIFF_OP):
+    """
+    DB-vs-DB compare run inside one database: `sql1 op sql2` and back, plus
+    the duplicate groups of each side, so only differing rows cross the
+    network. Returns (only_2, only_1, dup1, dup2, count_mismatch) like
+    reconcile, keyed with build_concat; keys repeated on either side that
+    exist on both with different counts come from the duplicate groups.
+    """
+    only_1 = build_concat(query_to_df(conn, f"SELECT * FROM ({sql1}) {op} SELECT * FROM ({sql2})"))
+    only_2 = build_concat(query_to_df(conn, f"SELECT * FROM ({sql2}) {op} SELECT * FROM ({sql1})"))
+    dup1 = build_concat(server_side_dupes(conn, sql1))
+    dup2 = build_concat(server_side_dupes(conn, sql2))
+    only_1 = only_1["Concatenated"].drop_duplicates().tolist()
+    only_2 = only_2["Concatenated"].drop_duplicates().tolist()
+    n1, n2 = dup1["Concatenated"].value_counts(), dup2["Concatenated"].value_counts()
+    both = n1.index.union(n2.index).difference(pd.Index(only_1 + only_2))
+    n1, n2 = n1.reindex(both, fill_value=1), n2.reindex(both, fill_value=1)
+    differ = n1 != n2
+    count_mismatch = pd.DataFrame({"Concatenated": both[differ.to_numpy()],
+                                   f"{labels[0]}_Count": n1[differ].to_numpy(),
+                                   f"{labels[1]}_Count": n2[differ].to_numpy()})
+    return only_2, only_1, dup1, dup2, count_mismatch
+
+def key_diff(old_df, new_df, keys, labels=("Old", "New")):
+    """
+    Primary-key diff: join old_df and new_df on `keys` and compare the other
+    shared columns as text, column by column. Returns one row per finding —
+    Change "Changed" (one row per differing Column, with both values),
+    "Added" (key only in new_df), "Removed" (key only in old_df), or
+    "Duplicate key" (the key repeats on a side; its first row is compared) —
+    under columns Change, *keys, Column, labels[0], labels[1]. Added /
+    Removed rows carry the side's 'Concatenated' value.
+    """
+    missing = [k for k in keys if k not in old_df.columns or k not in new_df.columns]
+    if missing:
+        raise KeyError(f"Key column '{missing[0]}' missing on one side.")
+    keys = list(keys)
+    value_cols = [c for c in old_df.columns
+                  if c in new_df.columns and c not in keys and c != "Concatenated"]
+    cols = ["Change", *keys, "Column", *labels]
+    old, new, out = {}, {}, []
+
+    for side, df, frame in ((0, old_df, old), (1, new_df, new)):
+        use = keys + value_cols + (["Concatenated"] if "Concatenated" in df.columns else [])
+        d = df[use].fillna("").astype(str)
+        dup = d.duplicated(keys, keep="first")
+        if dup.any():
+            rep = d.loc[dup, keys].drop_duplicates()
+            out.append(rep.assign(Change="Duplicate key", Column="",
+                                  **{labels[side]: "repeated", labels[1 - side]: ""}))
+        frame["df"] = d[~dup]
+
+    sfx = ("\0old", "\0new")     # merge suffixes no real column name ends with
+    m = old["df"].merge(new["df"], on=keys, how="outer", suffixes=sfx, indicator=True)
+    for change, flag, side in (("Removed", "left_only", 0), ("Added", "right_only", 1)):
+        part = m.loc[m["_merge"] == flag, keys]
+        concat = "Concatenated" + sfx[side]
+        text = m.loc[part.index, concat] if concat in m.columns else ""
+        out.append(part.assign(Change=change, Column="",
+                               **{labels[side]: text, labels[1 - side]: ""}))
+
+    both = m[m["_merge"] == "both"]
+    changed = []
+    for c in value_cols:
+        a, b = both[c + sfx[0]].to_numpy(), both[c + sfx[1]].to_numpy()
+        d = a != b
+        if d.any():
+            part = both.loc[d, keys].assign(Change="Changed", Column=c,
+                                            **{labels[0]: a[d], labels[1]: b[d]})
+            changed.append(part)
+    if changed:
+        out.append(pd.concat(changed).sort_index(kind="stable"))
+
+    out = [df for df in out if not df.empty]
+    if not out:
+        return pd.DataFrame(columns=cols)
+    return pd.concat(out, ignore_index=True)[cols]
+
+def key_diff_counts(diff, labels=("Old", "New")):
+    """{labels[1]: keys added, labels[0]: keys removed, "Changed": keys changed} from key_diff."""
+    change = diff["Change"]
+    keys = diff.columns[1:diff.columns.get_loc("Column")].tolist()
+    return {labels[1]: int((change == "Added").sum()),
+            labels[0]: int((change == "Removed").sum()),
+            "Changed": len(diff.loc[change == "Changed", keys].drop_duplicates())}
+
+def has_mismatches(counts):
+    """True when a runner's per-sheet counts report any difference."""
+    return any(counts.get(k) for k in ("DB", "Sheet", "Changed", "Count"))
+
+def compare_sheet(sheet, df_sheet, df_db, state=None, keys=None):
+    """
+    Compare one datasheet tab with its keyed DB result. Returns
+    (tabs, counts) where tabs maps report tab name to DataFrame in write
+    order (<sheet>_Mismatches, then _SheetDupes / _DBDupes / _CountMismatch
+    when there are any) and counts holds the distinct "DB" / "Sheet" only
+    keys and the "Count" of keys whose multiplicity differs. `state` is an
+    optional incremental state file (see incremental_state). With key
+    columns, the mismatch tab is <sheet>_KeyDiff from key_diff instead, and
+    counts also holds the "Changed" keys.
+    """
+    rec = reconcile(df_sheet, df_db, ("Sheet", "DB"), state=state)
+    if keys:
+        diff = key_diff(df_sheet, df_db, keys, ("Sheet", "DB"))
+        tabs = {f"{sheet}_KeyDiff": diff}
+        counts = key_diff_counts(diff, ("Sheet", "DB"))
+    else:
+        tabs, counts = _mismatch_tab(sheet, rec["only_right"], rec["only_left"])
+    if not rec["left_dupes"].empty:
+        tabs[f"{sheet}_SheetDupes"] = rec["left_dupes"]
+    if not rec["right_dupes"].empty:
+        tabs[f"{sheet}_DBDupes"] = rec["right_dupes"]
+    if not rec["count_mismatch"].empty:
+        tabs[f"{sheet}_CountMismatch"] = rec["count_mismatch"]
+    counts["Count"] = len(rec["count_mismatch"])
+    return tabs, counts
+
+def _mismatch_tab(sheet, only_db, only_sheet):
+    if not only_db and not only_sheet:
+        mismatch_df = pd.DataFrame([{"Result":"All rows match"}])
+    else:
+        mismatch_df = pd.DataFrame(
+            [{"Source":"DB only",    "Concatenated":v} for v in only_db] +
+            [{"Source":"Sheet only", "Concatenated":v} for v in only_sheet])
+    return {f"{sheet}_Mismatches": mismatch_df}, {"DB": len(only_db), "Sheet": len(only_sheet)}
+
+def spill_sorted_runs(keyed_chunks, tmpdir, rows_per_run=SPILL_ROWS):
+    """
+    Sort keyed chunks by 'Concatenated' in runs of up to rows_per_run rows and
+    write each run to tmpdir as pickled blocks of (key, row) pairs.
+    Returns (run paths, columns).
+    """
+    paths, columns, buf, n = [], None, [], 0
+
+    def flush():
+        run = pd.concat(buf, ignore_index=True)
+        run = run[run["Concatenated"].notna()].sort_values("Concatenated", kind="stable")
+        pairs = list(zip(run["Concatenated"].astype(str), run.itertuples(index=False, name=None)))
+        fd, path = tempfile.mkstemp(suffix=".run", dir=tmpdir)
+        with os.fdopen(fd, "wb") as f:
+            for i in range(0, len(pairs), SPILL_BLOCK):
+                pickle.dump(pairs[i:i+SPILL_BLOCK], f, protocol=pickle.HIGHEST_PROTOCOL)
+        paths.append(path)
+
+    for chunk in keyed_chunks:
+        if columns is None:
+            columns = chunk.columns.tolist()
+        buf.append(chunk)
+        n += len(chunk)
+        if n >= rows_per_run:
+            flush()
+            buf, n = [], 0
+    if buf:
+        flush()
+    return paths, columns or ["Concatenated"]
+
+def _iter_run(path):
+    with open(path, "rb") as f:
+        while True:
+            try:
+                yield from pickle.load(f)
+            except EOFError:
+                return
+
+def sorted_groups(keyed_chunks, tmpdir):
+    """
+    Spill keyed_chunks to sorted runs and return (columns, groups), where
+    groups yields (key, [row, ...]) in key order from a k-way merge of the
+    runs, so only one block per run is in memory at a time.
+    """
+    paths, columns = spill_sorted_runs(keyed_chunks, tmpdir)
+    merged = heapq.merge(*map(_iter_run, paths), key=itemgetter(0))
+    groups = ((key, [row for _, row in grp]) for key, grp in groupby(merged, key=itemgetter(0)))
+    return columns, groups
+
+def sorted_diff(left_groups, right_groups):
+    """
+    Single merge-join pass over two key-ordered group streams. Yields
+    (side, key, rows, only) for each key found on one side only (only=True)
+    or repeated on a side (len(rows) > 1); side is "left" or "right". A key
+    on both sides with different counts also yields ("both", key,
+    (left count, right count), False).
+    """
+    l, r = next(left_groups, None), next(right_groups, None)
+    while l is not None or r is not None:
+        if r is None or (l is not None and l[0] < r[0]):
+            yield "left", l[0], l[1], True
+            l = next(left_groups, None)
+        elif l is None or r[0] < l[0]:
+            yield "right", r[0], r[1], True
+            r = next(right_groups, None)
+        else:
+            if len(l[1]) > 1:
+                yield "left", l[0], l[1], False
+            if len(r[1]) > 1:
+                yield "right", r[0], r[1], False
+            if len(l[1]) != len(r[1]):
+                yield "both", l[0], (len(l[1]), len(r[1])), False
+            l, r = next(left_groups, None), next(right_groups, None)
+
+def external_compare(left, right, labels, concat_names, counts=None, block_rows=SPILL_BLOCK):
+    """
+    Turn sorted_diff over left/right (columns, groups) pairs into report
+    blocks. Yields (part, DataFrame) with part "details" (MismatchType, the
+    side's key columns, concat_names[0] / concat_names[1] — the
+    MismatchDetails layout), "left_dupes" / "right_dupes" (duplicate rows)
+    or "count_mismatch" (keys on both sides with different counts:
+    Concatenated, <labels[0]>_Count, <labels[1]>_Count). Distinct only-left /
+    only-right key counts are stored in `counts` under the side's label, and
+    the number of count mismatches under "Count".
+    """
+    counts = {} if counts is None else counts
+    counts.update({labels[0]: 0, labels[1]: 0, "Count": 0})
+    sides = {"left": left[0], "right": right[0]}
+    bufs = {}
+
+    def block(part, side, rows):
+        cols = sides[side]
+        if part == "details":
+            df = pd.DataFrame([row[:-1] for row in rows], columns=cols[:-1])
+            df.insert(0, "MismatchType", f"{labels[side == 'right']} only")
+            df[concat_names[0]] = [row[-1] for row in rows] if side == "left" else ""
+            df[concat_names[1]] = [row[-1] for row in rows] if side == "right" else ""
+            return df
+        if part == "count_mismatch":
+            return pd.DataFrame(rows, columns=["Concatenated", *(f"{lb}_Count" for lb in labels)])
+        return pd.DataFrame(rows, columns=cols)
+
+    for side, key, rows, only in sorted_diff(left[1], right[1]):
+        if side == "both":
+            counts["Count"] += 1
+            side, rows, parts = "left", [(key, *rows)], ["count_mismatch"]
+        else:
+            if only:
+                counts[labels[side == "right"]] += 1
+            parts = (["details"] if only else []) + ([f"{side}_dupes"] if len(rows) > 1 else [])
+        for part in parts:
+            buf = bufs.setdefault((part, side), [])
+            buf.extend(rows)
+            if len(buf) >= block_rows:
+                yield part, block(part, side, buf)
+                bufs[(part, side)] = []
+    for (part, side), buf in bufs.items():
+        if buf:
+            yield part, block(part, side, buf)
+
+def external_blocks(left_chunks, right_chunks, labels, concat_names, tab_names,
+                    counts, right_cols=None):
+    """
+    Out-of-core compare of two keyed chunk streams (see iter_keyed_chunks):
+    both sides are spilled to sorted runs under SPILL_DIR and merge-joined
+    once. Yields (tab, DataFrame) blocks for a ReportWriter, starting with an
+    empty details block so that tab always exists; tab_names maps details /
+    left_dupes / right_dupes / count_mismatch to tab names. right_cols(left_columns) may pick
+    the right side's columns from the left's (e.g. the sheet columns that
+    match the DB key). `counts` is filled as the blocks are consumed.
+    """
+    with tempfile.TemporaryDirectory(dir=SPILL_DIR) as tmp:
+        left = sorted_groups(left_chunks, tmp)
+        if right_cols is not None:
+            right_chunks = (chunk[right_cols(left[0])] for chunk in right_chunks)
+        right = sorted_groups(right_chunks, tmp)
+        yield tab_names["details"], pd.DataFrame(columns=["MismatchType", *left[0][:-1], *concat_names])
+        for part, df in external_compare(left, right, labels, concat_names, counts):
+            yield tab_names[part], df
+
+def frame_chunks(df, rows=SPILL_ROWS):
+    for i in range(0, len(df), rows):
+        yield df.iloc[i:i+rows]
+
+def run_sheets_external(conn, xls, sheets, queries, concat_map, label=None,
+                        sheet_rules=None, usecols=None, stats=None):
+    """
+    Out-of-core mode 1: yield (sheet, blocks, counts) where blocks streams the
+    <sheet>_MismatchDetails / _DBDupes / _SheetDupes / _CountMismatch rows from
+    external_blocks, so the DB result is never held in memory as a whole.
+    The fetch, key build and diff all happen while blocks is consumed, so
+    they are recorded as one "fetch+diff" stage that includes the writing.
+    """
+    stats = stats or RunStats()
+    frames = timed_read_sheets(stats, xls, sheets, sheet_usecols(sheets, concat_map, None, usecols),
+                               sheet_rules)
+    for sheet in sheets:
+        sql, rule = push_projection(conn, queries[sheet], concat_map.get(sheet))
+        fetched = {"rows": None, "bytes": None}
+        db_chunks = iter_keyed_chunks(_counted(fetch_chunks(conn, sql, label), fetched), rule)
+        counts = {}
+        blocks = external_blocks(
+            db_chunks, frame_chunks(frames[sheet]), ("DB", "Sheet"),
+            ("DB_Concatenation", "Sheet_Concatenation"),
+            {"details": f"{sheet}_MismatchDetails",
+             "left_dupes": f"{sheet}_DBDupes", "right_dupes": f"{sheet}_SheetDupes",
+             "count_mismatch": f"{sheet}_CountMismatch"},
+            counts, right_cols=lambda db_cols: db_cols)
+        yield sheet, _staged(blocks, stats, sheet, fetched), counts
+
+def _staged(blocks, stats, sheet, fetched):
+    # consume blocks inside a "fetch+diff" stage with the rows / bytes _counted saw
+    with stats.stage("fetch+diff", sheet) as rec:
+        yield from blocks
+        rec.update(rows=fetched["rows"], bytes=fetched["bytes"])
+
+# value normalizers a config may name: SQL expression for the DB side, str method for the sheet
+NORMALIZERS = {
+    "strip": ("TRIM({})",  "strip"),
+    "upper": ("UPPER({})", "upper"),
+    "lower": ("LOWER({})", "lower"),
 }
+_SHEET_KEYS = {"sql", "columns", "skip_columns", "keys", "where", "start_at", "drop", "normalize"}
+_PLAN_CACHE = {}
+
+def _str_list(sheet, name, v, what="column names"):
+    if not isinstance(v, list) or not all(isinstance(x, str) for x in v):
+        raise ValueError(f"compare config: sheet '{sheet}': '{name}' must be a list of {what}")
+    return v
+
+def compile_sheet(sheet, spec):
+    """
+    Validate one sheet's config table and compile it into its plan entry:
+    the SQL to run (projection, normalizers and WHERE pushed into it), the
+    concat rule, key columns, sheet columns to parse, and the sheet-side
+    rules (start_at slice, drop filters, normalizers).
+    """
+    if not isinstance(spec, dict):
+        raise ValueError(f"compare config: sheet '{sheet}' must be a table")
+    unknown = set(spec) - _SHEET_KEYS
+    if unknown:
+        raise ValueError(f"compare config: sheet '{sheet}': unknown setting '{sorted(unknown)[0]}'")
+    if not isinstance(spec.get("sql"), str) or not spec["sql"].strip():
+        raise ValueError(f"compare config: sheet '{sheet}': 'sql' is required")
+    columns = _str_list(sheet, "columns", spec["columns"]) if "columns" in spec else None
+    keys    = _str_list(sheet, "keys", spec.get("keys", []))
+    skip    = spec.get("skip_columns", 0)
+    if not isinstance(skip, int) or skip < 0:
+        raise ValueError(f"compare config: sheet '{sheet}': 'skip_columns' must be a non-negative integer")
+    if columns is not None and skip:
+        raise ValueError(f"compare config: sheet '{sheet}': use 'columns' or 'skip_columns', not both")
+    for name in ("where", "start_at"):
+        if name in spec and not isinstance(spec[name], str):
+            raise ValueError(f"compare config: sheet '{sheet}': '{name}' must be a string")
+    drop = spec.get("drop", [])
+    if not isinstance(drop, list):
+        raise ValueError(f"compare config: sheet '{sheet}': 'drop' must be a list of filters")
+    for f in drop:
+        if not isinstance(f, dict) or set(f) - {"column", "endswith", "equals"} \
+                or "column" not in f or len(f) != 2:
+            raise ValueError(f"compare config: sheet '{sheet}': each 'drop' filter needs "
+                             "'column' and one of 'endswith' / 'equals'")
+    if not isinstance(spec.get("normalize", {}), dict):
+        raise ValueError(f"compare config: sheet '{sheet}': 'normalize' must be a table "
+                         "of column = normalizer name(s)")
+    normalize = {c: [ops] if isinstance(ops, str) else _str_list(sheet, f"normalize.{c}", ops,
+                                                                "normalizer names")
+                 for c, ops in spec.get("normalize", {}).items()}
+    for c, ops in normalize.items():
+        bad = [op for op in ops if op not in NORMALIZERS]
+        if bad:
+            raise ValueError(f"compare config: sheet '{sheet}': unknown normalizer '{bad[0]}' "
+                             f"(choose from {', '.join(NORMALIZERS)})")
+    if normalize and columns is None:
+        raise ValueError(f"compare config: sheet '{sheet}': 'normalize' needs 'columns'")
+
+    sql = spec["sql"].strip()
+    if columns is not None or spec.get("where"):
+        select = "*"
+        if columns is not None:
+            exprs = []
+            for c in columns + [k for k in keys if k not in columns]:
+                e = f'q."{c}"'
+                for op in normalize.get(c, []):
+                    e = NORMALIZERS[op][0].format(e)
+                exprs.append(f'{e} AS "{c}"')
+            select = ", ".join(exprs)
+        sql = f"SELECT {select} FROM ({sql}) q" + (f" WHERE {spec['where']}" if spec.get("where") else "")
 
-# ─── Mode 1: DB vs Datasheet ─────────────────────────────────────────────────────
-
-if mode == "1":
-    # 1a) pick environment
-    print("\nSelect database environment:")
-    for i,e in envs.items():
-        print(f"  {i}: {e['label']}")
-    cfg = envs[int(input("Enter 1–5: ").strip())]
-    usr = input(f"{cfg['label']} username: ")
-    pw  = getpass.getpass(f"{cfg['label']} password: ")
-
-    # 1b) load datasheet and pick sheets
-    master_xl = input("\nPath to master datasheet (.xlsx): ").strip()
-    xls = pd.ExcelFile(master_xl, engine="openpyxl")
-    # prompt user which sheets, 0=all
-    print("\nWhich sheets to compare?")
-    print("  0: All sheets")
-    for idx,name in enumerate(xls.sheet_names, start=1):
-        print(f"  {idx}: {name}")
-    sel = input("Enter 0 or comma-separated numbers: ").strip()
-    if sel == "0":
-        sheets = xls.sheet_names
+    concat = columns if columns is not None else None
+    usecols = None
+    if columns is not None:
+        usecols = ["Concatenated", *keys, *columns, *(f["column"] for f in drop)]
+        if spec.get("start_at"):
+            usecols.append(spec["start_at"])
+    return {"sql": sql, "concat": concat, "skip_columns": skip, "keys": keys or None,
+            "usecols": usecols,
+            "rules": {"start_at": spec.get("start_at"), "drop": drop, "normalize": normalize,
+                      "columns": columns if normalize else None}}
+
+def load_plan(path):
+    """
+    Read a TOML (.toml) or YAML (.yaml/.yml) comparison config with a
+    [sheets.<name>] table per sheet and compile it (compile_sheet). Plans
+    are cached per file and rebuilt only when the file changes.
+    """
+    st = os.stat(path)
+    cached = _PLAN_CACHE.get(os.path.abspath(path))
+    if cached and cached[0] == (st.st_mtime_ns, st.st_size):
+        return cached[1]
+    if path.endswith((".yaml", ".yml")):
+        import yaml
+        with open(path, encoding="utf-8") as f:
+            raw = yaml.safe_load(f) or {}
     else:
-        nums = [int(x) for x in sel.split(",") if x.strip().isdigit()]
-        sheets = [xls.sheet_names[n-1] for n in nums]
-
-    # 1c) hard-coded SQL per sheet
-    SQL_QUERIES = {
-        "Scales":     "SELECT * FROM SAM_GLOBAL_CLASS.SAM_ML_RISK_SCORE_MAP",
-        "Thresholds": "SELECT * FROM SAM_GLOBAL_CLASS.SAM_TRANSACTION_SYSTEM_CD_MAP",
-        # add more sheets & their SQL here...
-    }
+        try:
+            import tomllib
+        except ImportError:                      # Python < 3.11
+            import tomli as tomllib
+        with open(path, "rb") as f:
+            raw = tomllib.load(f)
+    if not isinstance(raw.get("sheets"), dict) or not raw["sheets"]:
+        raise ValueError(f"compare config {path}: no [sheets.<name>] tables")
+    plan = {sheet: compile_sheet(sheet, spec) for sheet, spec in raw["sheets"].items()}
+    _PLAN_CACHE[os.path.abspath(path)] = ((st.st_mtime_ns, st.st_size), plan)
+    return plan
 
-    # 1d) concatenation rules per sheet
-    concat_map = {
-        # skip first two DB cols for Thresholds
-        "Thresholds": lambda df: df.columns[2:].tolist(),
-        # define for others or leave out to use all cols
-    }
+def plan_maps(plan):
+    """
+    Split a compiled plan into the engine's per-sheet dicts: (queries,
+    concat_map, key_columns, sheet_rules, usecols).
+    """
+    queries, concat_map, key_columns, sheet_rules, usecols = {}, {}, {}, {}, {}
+    for sheet, p in plan.items():
+        queries[sheet] = p["sql"]
+        if p["concat"] is not None:
+            concat_map[sheet] = p["concat"]
+        elif p["skip_columns"]:
+            concat_map[sheet] = lambda df, n=p["skip_columns"]: df.columns[n:].tolist()
+        if p["keys"]:
+            key_columns[sheet] = p["keys"]
+        sheet_rules[sheet] = p["rules"]
+        if p["usecols"]:
+            usecols[sheet] = p["usecols"]
+    return queries, concat_map, key_columns, sheet_rules, usecols
+
+def prepare_sheet(df_sheet, rules):
+    """
+    Apply a sheet's config rules to its parsed frame: keep columns from
+    start_at onward, drop rows matching the drop filters, then normalize.
+    Normalizing also rebuilds 'Concatenated' from the normalized `columns`
+    (build_concat), as the DB side's key is built from normalized values.
+    """
+    if not rules:
+        return df_sheet
+    if rules.get("start_at") in df_sheet.columns:
+        df_sheet = df_sheet.iloc[:, df_sheet.columns.get_loc(rules["start_at"]):]
+    for f in rules.get("drop", []):
+        if f["column"] in df_sheet.columns:
+            col = df_sheet[f["column"]]
+            hit = col.str.endswith(f["endswith"], na=False) if "endswith" in f else col.eq(f["equals"])
+            df_sheet = df_sheet[~hit]
+    normalize = {c: ops for c, ops in rules.get("normalize", {}).items() if c in df_sheet.columns}
+    if normalize:
+        df_sheet = df_sheet.copy()
+        for c, ops in normalize.items():
+            for op in ops:
+                df_sheet[c] = getattr(df_sheet[c].str, NORMALIZERS[op][1])()
+    if rules.get("normalize") and rules.get("columns"):
+        missing = [c for c in rules["columns"] if c not in df_sheet.columns]
+        if missing:
+            raise KeyError(f"Column '{missing[0]}' (needed to rebuild 'Concatenated') not in the sheet.")
+        df_sheet = df_sheet.copy()
+        df_sheet["Concatenated"] = build_concat(df_sheet, rules["columns"])["Concatenated"]
+    return df_sheet
+
+def open_master(master_xl):
+    """
+    Open the master workbook once (EXCEL_ENGINE; openpyxl opens it read-only)
+    so listing and parsing the sheets share one parse of the .xlsx zip.
+    """
+    return pd.ExcelFile(master_xl, engine=EXCEL_ENGINE)
+
+_DIGESTS = {}
+
+def workbook_digest(path):
+    """sha256 of a workbook's bytes, memoised per (path, size, mtime) for this process."""
+    st = os.stat(path)
+    memo = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    if memo not in _DIGESTS:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        _DIGESTS[memo] = h.hexdigest()
+    return _DIGESTS[memo]
+
+class SheetIndex:
+    """
+    Sorted 64-bit fingerprints of a sheet's 'Concatenated' keys with the row
+    position of each, for O(log n) "is this key present?" checks and row
+    lookups instead of isin scans over the sheet. rows() checks the key text
+    of every hit, so a fingerprint collision can't return a wrong row.
+    """
+    def __init__(self, fps, pos):
+        self.fps, self.pos = fps, pos
+
+    @classmethod
+    def build(cls, keys):
+        valid = keys.notna().to_numpy()
+        h = fingerprint(keys[valid].astype(str))
+        order = np.argsort(h, kind="stable")
+        return cls(h[order], np.flatnonzero(valid)[order])
 
-    # 1e) run comparisons
-    conn = connect_to_oracle(cfg["host"], cfg["port"], cfg["svc"], usr, pw)
-    out_xl = master_xl.replace(".xlsx", "_db_vs_sheet.xlsx")
-    writer = pd.ExcelWriter(out_xl, engine="openpyxl")
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as z:
+            return cls(z["fps"], z["pos"])
 
+    def save(self, path):
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, fps=self.fps, pos=self.pos)
+        os.replace(tmp, path)
+
+    def _ranges(self, keys):
+        h = fingerprint(pd.Series(list(keys), dtype=object).astype(str))
+        return np.searchsorted(self.fps, h, "left"), np.searchsorted(self.fps, h, "right")
+
+    def contains(self, keys):
+        """Boolean array: whether each key occurs in the sheet."""
+        lo, hi = self._ranges(keys)
+        return hi > lo
+
+    def positions(self, keys):
+        """Sorted row positions of every row (all copies) whose fingerprint matches a key."""
+        lo, hi = self._ranges(keys)
+        n = hi - lo
+        starts = np.repeat(lo - (np.cumsum(n) - n), n) + np.arange(n.sum())
+        return np.unique(self.pos[starts])
+
+    def rows(self, df, keys, col="Concatenated"):
+        """The rows of df (the indexed sheet) whose key is in keys, in sheet order."""
+        keys = list(keys)
+        hits = df.iloc[self.positions(keys)]
+        return hits[hits[col].isin(keys)]
+
+def code_digest():
+    """
+    sha256 of this module's source and the pandas / numpy versions (memoised):
+    part of the sidecar key, so frames parsed by other code are never reused.
+    """
+    memo = ("code", pd.__version__, np.__version__)
+    if memo not in _DIGESTS:
+        h = hashlib.sha256("\0".join(memo).encode("utf-8"))
+        with open(__file__, "rb") as f:
+            h.update(f.read())
+        _DIGESTS[memo] = h.hexdigest()
+    return _DIGESTS[memo]
+
+def _workbook_path(xls):
+    # the path an ExcelFile was opened from (None for file-like objects)
+    io = getattr(xls, "io", None) or getattr(xls, "_io", None)
+    return os.fspath(io) if isinstance(io, (str, os.PathLike)) else None
+
+def _sidecar(xls, sheet, want, rules):
+    # sidecar file stem for one parsed sheet, or None when INDEX_DIR is off / no path
+    path = _workbook_path(xls) if INDEX_DIR else None
+    if not path or not os.path.exists(path):
+        return None
+    version = os.path.join(INDEX_DIR, f"{workbook_digest(path)[:32]}-{code_digest()[:16]}")
+    spec = json.dumps([sheet, sorted(want) if want else None, rules or {}, EXCEL_ENGINE],
+                      sort_keys=True, default=str)
+    return os.path.join(version, hashlib.sha256(spec.encode("utf-8")).hexdigest()[:32])
+
+def _prune_sidecars(keep):
+    now = time.time()
+    for name in os.listdir(INDEX_DIR):
+        d = os.path.join(INDEX_DIR, name)
+        if d != keep and os.path.isdir(d) and now - os.path.getmtime(d) > INDEX_TTL:
+            for f in os.listdir(d):
+                os.remove(os.path.join(d, f))
+            os.rmdir(d)
+
+def sheet_index(xls, sheet, usecols=None, sheet_rules=None):
+    """
+    (DataFrame, SheetIndex) for one sheet, from the workbook's sidecar
+    (parsed and indexed on first use, see read_master_sheets). Without a
+    sidecar (INDEX_DIR None) the index is built in memory.
+    """
+    df_sheet = read_master_sheets(xls, [sheet], usecols, sheet_rules)[sheet]
+    stem = _sidecar(xls, sheet, (usecols or {}).get(sheet), (sheet_rules or {}).get(sheet))
+    if stem and os.path.exists(f"{stem}.npz"):
+        return df_sheet, SheetIndex.load(f"{stem}.npz")
+    return df_sheet, SheetIndex.build(df_sheet["Concatenated"])
+
+def sheet_usecols(sheets, concat_map, key_columns=None, planned=None):
+    """
+    Sheet columns the compare needs: 'Concatenated', 'Version', the key
+    columns and the columns of a list-valued concat_map rule. Sheets with a
+    callable or no rule map to None (all columns), since their key columns
+    come from the DB. `planned` (usecols from plan_maps) takes precedence.
+    """
+    usecols = {}
     for sheet in sheets:
-        if sheet not in SQL_QUERIES:
-            raise KeyError(f"No SQL defined for '{sheet}'.")
-        sql = SQL_QUERIES[sheet]
+        if sheet in (planned or {}):
+            usecols[sheet] = planned[sheet]
+            continue
+        rule = concat_map.get(sheet)
+        if isinstance(rule, (list, tuple)):
+            usecols[sheet] = ["Concatenated", "Version", *(key_columns or {}).get(sheet, ()), *rule]
+    return usecols
+
+def _excel_cell(v):
+    # the cell conversion pandas' Excel readers apply before parsing as dtype=str
+    if v is None:
+        return ""
+    if isinstance(v, float) and v.is_integer():
+        return int(v)
+    if isinstance(v, date):
+        return pd.Timestamp(v)
+    if isinstance(v, timedelta):
+        return pd.Timedelta(v)
+    return v
+
+def _dropped(v, f):
+    text = "" if v == "" else str(v)
+    return text.endswith(f["endswith"]) if "endswith" in f else text == f["equals"]
+
+def read_sheet_filtered(xls, sheet, usecols=None, drop=(), start_at=None):
+    """
+    pd.read_excel(dtype=str) for one sheet with the `drop` row filters
+    applied while the rows stream out of the workbook, so filtered rows
+    (e.g. '-deleted' versions) are never parsed into the frame. Filters on
+    columns left of start_at are ignored, as prepare_sheet slices first.
+    """
+    if xls.engine == "calamine":
+        rows = iter(xls.book.get_sheet_by_name(sheet).iter_rows())
+    else:
+        rows = xls.book[sheet].iter_rows(values_only=True)
+    header = [_excel_cell(v) for v in next(rows, [])]
+    names = [str(h) for h in header]
+    first = names.index(start_at) if start_at in names else 0
+    tests = [(names.index(f["column"]), f) for f in drop
+             if f["column"] in names[first:]]
+    kept = [header]
+    for row in rows:
+        row = [_excel_cell(v) for v in row]
+        if not any(i < len(row) and _dropped(row[i], f) for i, f in tests):
+            kept.append(row)
+    while len(kept) > 1 and all(v == "" for v in kept[-1]):
+        kept.pop()                                      # pandas trims trailing blank rows
+    want = set(usecols) if usecols else None
+    return TextParser(kept, header=0, dtype=str, skip_blank_lines=False,
+                      usecols=(lambda c: c in want) if want else None).read()
 
-        print(f"\n▶ Comparing DB → Sheet '{sheet}'")
-        df_sheet = pd.read_excel(master_xl, sheet_name=sheet, engine="openpyxl", dtype=str)
+def read_master_sheets(xls, sheets, usecols=None, sheet_rules=None):
+    """
+    Parse the selected sheets from an open workbook (see open_master) as
+    dtype=str, returning {sheet: DataFrame}. Columns outside usecols[sheet]
+    are skipped while parsing; sheet_rules[sheet] is applied with prepare_sheet,
+    its drop filters while streaming the rows (read_sheet_filtered). With
+    INDEX_DIR set, sheets of an unchanged workbook come from its sidecar, and
+    newly parsed ones are stored there with their SheetIndex.
+    """
+    frames = {}
+    for sheet in sheets:
+        want = (usecols or {}).get(sheet)
+        rules = (sheet_rules or {}).get(sheet) or {}
+        stem = _sidecar(xls, sheet, want, rules)
+        if stem and os.path.exists(f"{stem}.pkl") and os.path.exists(f"{stem}.npz"):
+            os.utime(os.path.dirname(stem))                 # mark this version as in use
+            frames[sheet] = pd.read_pickle(f"{stem}.pkl")
+            continue
+        if rules.get("drop"):
+            df_sheet = read_sheet_filtered(xls, sheet, want, rules["drop"], rules.get("start_at"))
+        else:
+            df_sheet = pd.read_excel(xls, sheet_name=sheet, dtype=str,
+                                     usecols=(lambda c, want=set(want): c in want) if want else None)
+        df_sheet = prepare_sheet(df_sheet, (sheet_rules or {}).get(sheet))
         if "Concatenated" not in df_sheet.columns:
             raise KeyError(f"'{sheet}' missing 'Concatenated' column.")
+        if stem:
+            os.makedirs(os.path.dirname(stem), exist_ok=True)
+            df_sheet.to_pickle(f"{stem}.pkl.tmp")
+            os.replace(f"{stem}.pkl.tmp", f"{stem}.pkl")
+            SheetIndex.build(df_sheet["Concatenated"]).save(f"{stem}.npz")
+            _prune_sidecars(os.path.dirname(stem))
+        frames[sheet] = df_sheet
+    return frames
+
+def timed_read_sheets(stats, xls, sheets, usecols=None, sheet_rules=None):
+    """read_master_sheets recorded as the "read_sheets" stage of stats."""
+    with stats.stage("read_sheets") as rec:
+        frames = read_master_sheets(xls, sheets, usecols, sheet_rules)
+        rec["rows"] = sum(len(df) for df in frames.values())
+    return frames
+
+def run_sheets(conn, xls, sheets, queries, concat_map, label=None, key_columns=None,
+               sheet_rules=None, usecols=None, stats=None):
+    """
+    Sequential mode: yield (sheet, blocks, counts) one sheet at a time over
+    a single connection; blocks are (tab, DataFrame) pairs for a ReportWriter.
+    key_columns maps sheets to primary-key columns for a key-aware diff;
+    sheet_rules / usecols come from a compiled config (plan_maps). Stage
+    timings are recorded in stats (a RunStats) when given.
+    """
+    key_columns, stats = key_columns or {}, stats or RunStats()
+    frames = timed_read_sheets(stats, xls, sheets,
+                               sheet_usecols(sheets, concat_map, key_columns, usecols), sheet_rules)
+    for sheet in sheets:
+        df_sheet = frames[sheet]
+        # stream the result and build the key per chunk (concat_map rule or all cols)
+        keys = key_columns.get(sheet)
+        with stats.stage("fetch+key", sheet) as rec:
+            sql, rule = push_projection(conn, queries[sheet], concat_map.get(sheet), keys or ())
+            df_db = build_concat_chunks(_counted(fetch_chunks(conn, sql, label), rec),
+                                        rule, keys or ())
+        with stats.stage("compare", sheet) as rec:
+            tabs, counts = compare_sheet(sheet, df_sheet, df_db, incremental_state(label, sheet), keys)
+            rec["rows"] = len(df_sheet) + len(df_db)
+        yield sheet, tabs.items(), counts
+
+def _compare_keyed(sheet, df_sheet, df_db, state=None, keys=None):
+    # process-pool side of run_sheets_parallel: compare the keyed frames; the
+    # stage record travels back with the result
+    stats = RunStats()
+    with stats.stage("compare", sheet) as rec:
+        tabs, counts = compare_sheet(sheet, df_sheet, df_db, state, keys)
+        rec["rows"] = len(df_sheet) + len(df_db)
+    return tabs, counts, stats.records
+
+def run_sheets_parallel(pool, xls, sheets, queries, concat_map, label=None, key_columns=None,
+                        sheet_rules=None, usecols=None, stats=None,
+                        fetch_workers=FETCH_WORKERS, compare_workers=COMPARE_WORKERS,
+                        in_flight=SHEETS_IN_FLIGHT):
+    """
+    Concurrent mode: the workbook is parsed once on one thread while each
+    sheet's SQL fetch runs on the others (sessions from `pool`), building the
+    DB key chunk by chunk as the rows arrive; the compare runs on a process
+    pool as soon as a sheet's inputs are ready. At most `in_flight` sheets are
+    fetched or compared at once, so only their keyed DB frames are held.
+    Results are yielded in `sheets` order, so a single writer emits the tabs
+    deterministically. Stages overlap, so their times in stats add up to more
+    than the run's wall time.
+    """
+    def load(sheet):
+        keys = key_columns.get(sheet)
+        with stats.stage("fetch+key", sheet) as rec:
+            with pool.acquire() as conn:
+                sql, rule = push_projection(conn, queries[sheet], concat_map.get(sheet), keys or ())
+                df_db = build_concat_chunks(_counted(fetch_chunks(conn, sql, label), rec),
+                                            rule, keys or ())
+        return sheet, book.result()[sheet], df_db, incremental_state(label, sheet), keys
+
+    key_columns, stats = key_columns or {}, stats or RunStats()
+    in_flight = max(1, in_flight)
+    with contextlib.ExitStack() as stack:
+        threads = stack.enter_context(ThreadPoolExecutor(fetch_workers + 1))
+        procs = stack.enter_context(ProcessPoolExecutor(compare_workers)) if compare_workers else None
+        book = threads.submit(timed_read_sheets, stats, xls, sheets,
+                              sheet_usecols(sheets, concat_map, key_columns, usecols), sheet_rules)
+        waiting, loads, ready = list(sheets), {}, {}
+        for sheet in sheets:
+            # sheets start in order, so this one is always loading or ready
+            while waiting and len(loads) + len(ready) < in_flight:
+                nxt = waiting.pop(0)
+                loads[threads.submit(load, nxt)] = nxt
+            while sheet not in ready:
+                done, _ = wait(loads, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    del loads[fut]
+                    name, *args = fut.result()
+                    ready[name] = procs.submit(_compare_keyed, name, *args) if procs else args
+            result = ready.pop(sheet)
+            tabs, counts, records = result.result() if procs else _compare_keyed(sheet, *result)
+            stats.extend(records)
+            yield sheet, tabs.items(), counts
+
+if __name__ == "__main__":
+
+    # ─── 1) Select comparison mode ───────────────────────────────────────────────────
+
+    print("Select comparison mode:")
+    print("  1: Database vs Datasheet")
+    print("  2: Database vs Database")
+    mode = input("Enter 1 or 2: ").strip()
+
+    # ─── Common environment definitions ──────────────────────────────────────────────
 
-        df_db = query_to_df(conn, sql)
-        # pick cols for concat
-        cols = (concat_map[sheet](df_db) if sheet in concat_map else None)
-        df_db = build_concat(df_db, cols)
-
-        only_db, only_sheet = compare_mismatches(df_sheet, df_db)
-        # write mismatches
-        if not only_db and not only_sheet:
-            pd.DataFrame([{"Result":"All rows match"}]).to_excel(
-                writer, sheet_name=f"{sheet}_Mismatches", index=False)
-            print("  ✔️ No mismatches")
+    envs = ENVS
+
+    # ─── Mode 1: DB vs Datasheet ─────────────────────────────────────────────────────
+
+    if mode == "1":
+        # 1a) pick environment
+        print("\nSelect database environment:")
+        for i,e in envs.items():
+            print(f"  {i}: {e['label']}")
+        cfg = envs[int(input("Enter 1–5: ").strip())]
+        usr = input(f"{cfg['label']} username: ")
+        pw  = getpass.getpass(f"{cfg['label']} password: ")
+
+        # 1b) load datasheet and pick sheets
+        master_xl = input("\nPath to master datasheet (.xlsx): ").strip()
+        xls = open_master(master_xl)
+        # prompt user which sheets, 0=all
+        print("\nWhich sheets to compare?")
+        print("  0: All sheets")
+        for idx,name in enumerate(xls.sheet_names, start=1):
+            print(f"  {idx}: {name}")
+        sel = input("Enter 0 or comma-separated numbers: ").strip()
+        if sel == "0":
+            sheets = xls.sheet_names
         else:
-            rows = ([{"Source":"DB only",    "Concatenated":v} for v in only_db] +
-                    [{"Source":"Sheet only", "Concatenated":v} for v in only_sheet])
-            pd.DataFrame(rows).to_excel(writer, sheet_name=f"{sheet}_Mismatches", index=False)
-            print(f"  ⚠️ {len(only_db)} only in DB, {len(only_sheet)} only in Sheet")
-
-        # duplicates
-        ds = find_duplicates(df_sheet)
-        if not ds.empty:
-            ds.to_excel(writer, sheet_name=f"{sheet}_SheetDupes", index=False)
-        dd = find_duplicates(df_db)
-        if not dd.empty:
-            dd.to_excel(writer, sheet_name=f"{sheet}_DBDupes", index=False)
-
-    writer.save()
-    conn.close()
-    print(f"\n✅ Report: {out_xl}")
-
-# ─── Mode 2: DB vs DB ─────────────────────────────────────────────────────────────
-
-elif mode == "2":
-    # 2a) first DB
-    print("\n--- First database ---")
-    for i,e in envs.items():
-        print(f"  {i}: {e['label']}")
-    cfg1 = envs[int(input("Enter 1–5: ").strip())]
-    usr1 = input(f"{cfg1['label']} username: ")
-    pw1  = getpass.getpass(f"{cfg1['label']} password: ")
-    sql1 = input("\nEnter SQL query for first DB:\n").strip()
-
-    # 2b) second DB
-    print("\n--- Second database ---")
-    for i,e in envs.items():
-        print(f"  {i}: {e['label']}")
-    cfg2 = envs[int(input("Enter 1–5: ").strip())]
-    usr2 = input(f"{cfg2['label']} username: ")
-    pw2  = getpass.getpass(f"{cfg2['label']} password: ")
-    sql2 = input("\nEnter SQL query for second DB:\n").strip()
-
-    # 2c) connect & fetch
-    conn1 = connect_to_oracle(cfg1["host"], cfg1["port"], cfg1["svc"], usr1, pw1)
-    conn2 = connect_to_oracle(cfg2["host"], cfg2["port"], cfg2["svc"], usr2, pw2)
-    df1 = build_concat(query_to_df(conn1, sql1))
-    df2 = build_concat(query_to_df(conn2, sql2))
-    conn1.close()
-    conn2.close()
-
-    # 2d) compare
-    only_2, only_1 = compare_mismatches(df1, df2)
-
-    # 2e) output
-    out_xl = "db_vs_db_comparison.xlsx"
-    writer = pd.ExcelWriter(out_xl, engine="openpyxl")
-
-    if not only_2 and not only_1:
-        pd.DataFrame([{"Result":"All rows match"}]).to_excel(
-            writer, sheet_name="Mismatches", index=False)
-        print("\n✔️ No mismatches between DBs")
+            nums = [int(x) for x in sel.split(",") if x.strip().isdigit()]
+            sheets = [xls.sheet_names[n-1] for n in nums]
+
+        # 1c) hard-coded SQL per sheet
+        SQL_QUERIES = {
+            "Scales":     "SELECT * FROM SAM_GLOBAL_CLASS.SAM_ML_RISK_SCORE_MAP",
+            "Thresholds": "SELECT * FROM SAM_GLOBAL_CLASS.SAM_TRANSACTION_SYSTEM_CD_MAP",
+            # add more sheets & their SQL here...
+        }
+
+        # 1d) concatenation rules per sheet
+        concat_map = {
+            # skip first two DB cols for Thresholds
+            "Thresholds": lambda df: df.columns[2:].tolist(),
+            # define for others or leave out to use all cols
+        }
+
+        # 1d') primary-key columns per sheet: these sheets get a <sheet>_KeyDiff tab
+        #      listing Changed / Added / Removed records instead of <sheet>_Mismatches
+        KEY_COLUMNS = {
+            # "Scales": ["RISK_SCORE"],
+        }
+
+        # 1d'') a compare.toml (COMPARE_CONFIG) replaces the dicts above
+        SHEET_RULES, USECOLS = {}, {}
+        if os.path.exists(COMPARE_CONFIG):
+            SQL_QUERIES, concat_map, KEY_COLUMNS, SHEET_RULES, USECOLS = \
+                plan_maps(load_plan(COMPARE_CONFIG))
+            print(f"Using comparison config {COMPARE_CONFIG}")
+
+        # 1e) run comparisons (concurrently if PARALLEL_SHEETS), one writer in sheet order
+        missing = [sheet for sheet in sheets if sheet not in SQL_QUERIES]
+        if missing:
+            raise KeyError(f"No SQL defined for '{missing[0]}'.")
+        out_xl = master_xl.replace(".xlsx", "_db_vs_sheet.xlsx")
+        book_name = os.path.splitext(os.path.basename(master_xl))[0]
+        writer = ReportWriter(out_xl)
+        stats, prof = RunStats(), start_profiler()
+
+        if EXTERNAL_DIFF:
+            conn = connect_to_oracle(cfg["host"], cfg["port"], cfg["svc"], usr, pw)
+            results = run_sheets_external(conn, xls, sheets, SQL_QUERIES, concat_map, cfg["label"],
+                                          SHEET_RULES, USECOLS, stats)
+        elif PARALLEL_SHEETS:
+            conn = create_oracle_pool(cfg["host"], cfg["port"], cfg["svc"], usr, pw)
+            results = run_sheets_parallel(conn, xls, sheets, SQL_QUERIES, concat_map, cfg["label"],
+                                          KEY_COLUMNS, SHEET_RULES, USECOLS, stats)
+        else:
+            conn = connect_to_oracle(cfg["host"], cfg["port"], cfg["svc"], usr, pw)
+            results = run_sheets(conn, xls, sheets, SQL_QUERIES, concat_map, cfg["label"],
+                                 KEY_COLUMNS, SHEET_RULES, USECOLS, stats)
+
+        for sheet, blocks, counts in results:
+            print(f"\n▶ Comparing DB → Sheet '{sheet}'")
+            with stats.stage("write", sheet) as rec:
+                rec["rows"] = 0
+                for tab, df in blocks:
+                    writer.append(tab, df)
+                    rec["rows"] += len(df)
+            if not has_mismatches(counts):
+                print("  ✔️ No mismatches")
+            else:
+                extra = "".join(f", {counts[k]} {what}" for k, what in
+                                (("Changed", "changed"), ("Count", "with differing counts"))
+                                if k in counts)
+                print(f"  ⚠️ {counts['DB']} only in DB, {counts['Sheet']} only in Sheet{extra}")
+
+        writer.append(stats_tab(book_name), stats.frame())
+        writer.close()
+        conn.close()
+        xls.close()
+        if RUN_LOG:
+            stats.write_log(RUN_LOG, mode="db_vs_sheet", workbook=master_xl, env=cfg["label"],
+                            sheets=sheets, report=out_xl)
+        profile = stop_profiler(prof, book_name)
+        print(f"\n✅ Report: {out_xl}")
+        if profile:
+            print(f"Profile: {profile}")
+
+    # ─── Mode 2: DB vs DB ─────────────────────────────────────────────────────────────
+
+    elif mode == "2":
+        # 2a) first DB
+        print("\n--- First database ---")
+        for i,e in envs.items():
+            print(f"  {i}: {e['label']}")
+        cfg1 = envs[int(input("Enter 1–5: ").strip())]
+        usr1 = input(f"{cfg1['label']} username: ")
+        pw1  = getpass.getpass(f"{cfg1['label']} password: ")
+        sql1 = input("\nEnter SQL query for first DB:\n").strip()
+
+        # 2b) second DB
+        print("\n--- Second database ---")
+        for i,e in envs.items():
+            print(f"  {i}: {e['label']}")
+        cfg2 = envs[int(input("Enter 1–5: ").strip())]
+        usr2 = input(f"{cfg2['label']} username: ")
+        pw2  = getpass.getpass(f"{cfg2['label']} password: ")
+        sql2 = input("\nEnter SQL query for second DB:\n").strip()
+        keys = [k.strip() for k in input("\nKey columns for a key-aware diff "
+                                         "(comma-separated, blank for none): ").split(",") if k.strip()]
+
+        # 2c) connect & fetch
+        conn1 = connect_to_oracle(cfg1["host"], cfg1["port"], cfg1["svc"], usr1, pw1)
+        conn2 = connect_to_oracle(cfg2["host"], cfg2["port"], cfg2["svc"], usr2, pw2)
+        out_xl = "db_vs_db_comparison.xlsx"
+        stats, prof = RunStats(), start_profiler()
+
+        if EXTERNAL_DIFF:
+            # out-of-core: stream both sides to sorted runs and merge-join them once
+            counts = {}
+            blocks = external_blocks(
+                iter_keyed_chunks(fetch_chunks(conn1, sql1, cfg1["label"])),
+                iter_keyed_chunks(fetch_chunks(conn2, sql2, cfg2["label"])),
+                (cfg1["label"], cfg2["label"]), ("DB1_Concat", "DB2_Concat"),
+                {"details": "MismatchDetails", "left_dupes": f"{cfg1['label']}_Dupes",
+                 "right_dupes": f"{cfg2['label']}_Dupes", "count_mismatch": "CountMismatch"},
+                counts)
+            with ReportWriter(out_xl) as writer:
+                with stats.stage("fetch+diff") as rec:      # the blocks are computed as written
+                    rec["rows"] = 0
+                    for tab, df in blocks:
+                        writer.append(tab, df)
+                        rec["rows"] += len(df)
+                writer.append("RunStats", stats.frame())
+            conn1.close()
+            conn2.close()
+            print(f"\n⚠️ {counts[cfg2['label']]} rows only in {cfg2['label']}, "
+                  f"{counts[cfg1['label']]} only in {cfg1['label']}")
+            if counts["Count"]:
+                print(f"⚠️ {counts['Count']} keys with differing counts")
+            print(f"\n✅ DB vs DB report: {out_xl}")
+
+        else:
+            # 2d) compare
+            server = (SERVER_SIDE_DIFF and same_database(cfg1, cfg2)
+                      and usr1.strip().upper() == usr2.strip().upper() and not keys)
+            if server:
+                # same instance and schema: diff in the database, fetch only the differing rows
+                try:
+                    with stats.stage("server_diff") as st:
+                        only_2, only_1, dup1, dup2, counts = server_side_compare(
+                            conn1, sql1, sql2, (cfg1["label"], cfg2["label"]))
+                        st["rows"] = len(only_2) + len(only_1) + len(dup1) + len(dup2)
+                except oracledb.Error as e:
+                    print(f"Server-side diff failed ({e}); comparing client-side instead.")
+                    server = False
+            if not server:
+                # both environments are fetched at the same time
+                with stats.stage("fetch+key") as st:
+                    [(_, df1, df2)] = iter_fetch_pairs(conn1, conn2, [("", sql1, sql2, None)],
+                                                       (cfg1["label"], cfg2["label"]))
+                    st["rows"], st["bytes"] = len(df1) + len(df2), frame_bytes(df1) + frame_bytes(df2)
+                with stats.stage("compare") as st:
+                    state = incremental_state(cfg1["label"], sql1, cfg2["label"], sql2)
+                    rec = reconcile(df1, df2, (cfg1["label"], cfg2["label"]), state=state)
+                    if keys:
+                        diff = key_diff(df1, df2, keys, (cfg1["label"], cfg2["label"]))
+                    else:
+                        only_2, only_1 = rec["only_right"], rec["only_left"]
+                    dup1, dup2, counts = rec["left_dupes"], rec["right_dupes"], rec["count_mismatch"]
+                    st["rows"] = len(df1) + len(df2)
+            conn1.close()
+            conn2.close()
+
+            # 2e) output
+            writer = ReportWriter(out_xl)
+
+            with stats.stage("write"):
+                if keys:
+                    writer.append("KeyDiff", diff)
+                    n = key_diff_counts(diff, (cfg1["label"], cfg2["label"]))
+                    print(f"\n⚠️ {n[cfg2['label']]} keys only in {cfg2['label']}, "
+                          f"{n[cfg1['label']]} only in {cfg1['label']}, {n['Changed']} changed")
+                elif not only_2 and not only_1:
+                    writer.append("Mismatches", pd.DataFrame([{"Result":"All rows match"}]))
+                    print("\n✔️ No mismatches between DBs")
+                else:
+                    rows = ([{"Source":f"{cfg2['label']} only", "Concatenated":v} for v in only_2] +
+                            [{"Source":f"{cfg1['label']} only", "Concatenated":v} for v in only_1])
+                    writer.append("Mismatches", pd.DataFrame(rows))
+                    print(f"\n⚠️ {len(only_2)} rows only in {cfg2['label']}, {len(only_1)} only in {cfg1['label']}")
+
+                # duplicates in each DB
+                if not dup1.empty:
+                    writer.append(f"{cfg1['label']}_Dupes", dup1)
+                if not dup2.empty:
+                    writer.append(f"{cfg2['label']}_Dupes", dup2)
+                if not counts.empty:
+                    writer.append("CountMismatch", counts)
+                    print(f"⚠️ {len(counts)} keys with differing counts")
+
+            writer.append("RunStats", stats.frame())
+            writer.close()
+            print(f"\n✅ DB vs DB report: {out_xl}")
+
+        if RUN_LOG:
+            stats.write_log(RUN_LOG, mode="db_vs_db", envs=[cfg1["label"], cfg2["label"]],
+                            sql=[sql1, sql2], report=out_xl)
+        profile = stop_profiler(prof, "db_vs_db")
+        if profile:
+            print(f"Profile: {profile}")
+
     else:
-        rows = ([{"Source":f"{cfg2['label']} only", "Concatenated":v} for v in only_2] +
-                [{"Source":f"{cfg1['label']} only", "Concatenated":v} for v in only_1])
-        pd.DataFrame(rows).to_excel(writer, sheet_name="Mismatches", index=False)
-        print(f"\n⚠️ {len(only_2)} rows only in {cfg2['label']}, {len(only_1)} only in {cfg1['label']}")
-
-    # duplicates in each DB
-    dup1 = find_duplicates(df1)
-    if not dup1.empty:
-        dup1.to_excel(writer, sheet_name=f"{cfg1['label']}_Dupes", index=False)
-    dup2 = find_duplicates(df2)
-    if not dup2.empty:
-        dup2.to_excel(writer, sheet_name=f"{cfg2['label']}_Dupes", index=False)
-
-    writer.save()
-    print(f"\n✅ DB vs DB report: {out_xl}")
-
-else:
-    print("Invalid mode selected. Exiting.")
+        print("Invalid mode selected. Exiting.")
@@ -0,0 +1,218 @@
+"""
+Benchmark harness for the comparison pipeline (Tu2.py): builds a deterministic
+synthetic SQLite table plus a matching master .xlsx, then times and
+memory-profiles each stage — query_to_df, build_concat, the sheet read,
+compare_mismatches, find_duplicates, reconcile and the report writer — and
+saves the results as JSON so runs can be compared across changes.
+
+    python bench.py                                  # 10K, 1M and 10M rows x 20 columns
+    python bench.py --sizes 10000,100000 --cols 10 --out before.json
+    python bench.py --rows 200000 --rowwise          # also time the row-wise key builder
+
+The .xlsx (and the sheet-read stage) is skipped for sizes above Excel's row
+limit. Generated datasets are kept in --workdir and reused by later runs.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import Tu2
+from Tu2 import (EXCEL_MAX_ROWS, ReportWriter, build_concat, compare_mismatches, find_duplicates,
+                 open_master, query_to_df, read_master_sheets, reconcile, to_text)
+
+# time the real sheet parse even if INDEX_DIR is turned on: a sidecar hit would skew it
+Tu2.INDEX_DIR = None
+
+def build_concat_rowwise(df, cols=None):
+    """
+    The previous implementation, kept here as the baseline: to_text on every
+    cell, then a row-wise "".join into 'Concatenated'.
+    """
+    use_cols = cols if cols is not None else df.columns.tolist()
+    df2 = df[use_cols].copy()
+    df2 = df2.map(to_text) if hasattr(df2, "map") else df2.applymap(to_text)
+    df2["Concatenated"] = df2.agg("".join, axis=1)
+    return df2
+
+def synthetic_frame(rows, cols, seed=0, nan_rate=0.05):
+    """
+    Deterministic frame cycling through the column shapes a DB result has:
+    floats with NaN, whole floats (3.0), ints, and short codes with blanks.
+    """
+    rng = np.random.default_rng(seed)
+    data = {}
+    for c in range(cols):
+        kind = c % 4
+        if kind == 0:
+            v = rng.normal(size=rows).round(3)
+            v[rng.random(rows) < nan_rate] = np.nan
+        elif kind == 1:
+            v = rng.integers(0, 1000, rows).astype(float)
+        elif kind == 2:
+            v = rng.integers(0, 10**6, rows)
+        else:
+            v = rng.choice(np.array(["A", "BB", "CCC", None], dtype=object), rows)
+        data[f"COL_{c:02d}"] = v
+    return pd.DataFrame(data)
+
+class SQLiteConn:
+    """sqlite3 connection with the `with conn.cursor() as cur` protocol oracledb has."""
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+
+    @contextlib.contextmanager
+    def cursor(self):
+        cur = self.conn.cursor()
+        try:
+            yield cur
+        finally:
+            cur.close()
+
+    def close(self):
+        self.conn.close()
+
+def make_dataset(workdir, rows, cols, mismatch_rate=0.01, dup_rate=0.005, seed=0):
+    """
+    Write the synthetic DB table to SQLite (table T, with dup_rate extra
+    copies of existing rows) and the matching master sheet to .xlsx (sheet
+    'Data': key columns as text, 'Concatenated', 'Version'), where
+    mismatch_rate of the keys are altered so they only exist on one side.
+    Returns (db_path, xlsx_path or None); existing files are reused.
+    """
+    tag = f"{rows}x{cols}_m{mismatch_rate}_d{dup_rate}_s{seed}"
+    db_path = os.path.join(workdir, f"bench_{tag}.sqlite")
+    xl_path = os.path.join(workdir, f"bench_{tag}.xlsx")
+    fits = rows < EXCEL_MAX_ROWS
+    if os.path.exists(db_path) and (os.path.exists(xl_path) or not fits):
+        return db_path, xl_path if fits else None
+
+    rng = np.random.default_rng(seed + 1)
+    df = synthetic_frame(rows, cols, seed)
+    dups = df.iloc[rng.choice(rows, int(rows * dup_rate), replace=False)]
+    db = pd.concat([df, dups], ignore_index=True)
+    with contextlib.closing(sqlite3.connect(db_path)) as conn:
+        db.to_sql("T", conn, index=False, if_exists="replace", chunksize=100_000)
+
+    if fits:
+        sheet = build_concat(df)
+        changed = rng.choice(rows, int(rows * mismatch_rate), replace=False)
+        sheet.loc[changed, "Concatenated"] = sheet.loc[changed, "Concatenated"] + "~"
+        sheet["Version"] = "1"
+        with ReportWriter(xl_path) as writer:
+            for i in range(0, rows, 100_000):
+                writer.append("Data", sheet.iloc[i:i+100_000])
+    return db_path, xl_path if fits else None
+
+def measure(stage, fn, *args, memory=True):
+    """
+    Time fn(*args), then (with memory) run it again under tracemalloc for
+    its peak allocation — tracing slows the stage down too much to time it
+    in the same run. Returns (result, record).
+    """
+    t0 = time.perf_counter()
+    out = fn(*args)
+    seconds = time.perf_counter() - t0
+    peak = None
+    if memory:
+        tracemalloc.start()
+        fn(*args)
+        peak = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+    print(f"    {stage:<22} {seconds:9.3f}s" + (f"  peak {peak:9.1f} MB" if memory else ""))
+    return out, {"stage": stage, "seconds": round(seconds, 4),
+                 "peak_mb": round(peak, 2) if memory else None}
+
+def write_report(path, df_db, only):
+    with ReportWriter(path) as writer:
+        writer.append("Details", df_db[df_db["Concatenated"].isin(only)])
+        writer.append("Keys", df_db)
+
+def run_size(workdir, rows, cols, args):
+    """Generate (or reuse) one dataset and measure every pipeline stage on it."""
+    print(f"\n{rows:,} rows x {cols} columns")
+    t0 = time.perf_counter()
+    db_path, xl_path = make_dataset(workdir, rows, cols, args.mismatch_rate, args.dup_rate, args.seed)
+    print(f"    dataset ready in {time.perf_counter() - t0:.1f}s")
+
+    records, mem = [], not args.no_memory
+    conn = SQLiteConn(db_path)
+    df_raw, rec = measure("query_to_df", query_to_df, conn, "SELECT * FROM T", memory=mem)
+    records.append(rec)
+    conn.close()
+    df_db, rec = measure("build_concat", build_concat, df_raw, memory=mem)
+    records.append(rec)
+    if args.rowwise:
+        _, rec = measure("build_concat_rowwise", build_concat_rowwise, df_raw, memory=mem)
+        records.append(rec)
+    del df_raw
+
+    if xl_path:
+        xls = open_master(xl_path)
+        frames, rec = measure("read_master_sheets", read_master_sheets, xls, ["Data"], memory=mem)
+        records.append(rec)
+        xls.close()
+        df_sheet = frames["Data"]
+    else:
+        print(f"    {'read_master_sheets':<22} skipped (over Excel's row limit)")
+        df_sheet = df_db.iloc[::-1].reset_index(drop=True)
+
+    (only_db, only_sheet), rec = measure("compare_mismatches", compare_mismatches, df_sheet, df_db,
+                                         memory=mem)
+    records.append(rec)
+    _, rec = measure("find_duplicates", lambda: (find_duplicates(df_sheet), find_duplicates(df_db)),
+                     memory=mem)
+    records.append(rec)
+    _, rec = measure("reconcile", reconcile, df_sheet, df_db, memory=mem)
+    records.append(rec)
+    if not args.no_report:
+        with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+            _, rec = measure("report_writer", write_report, os.path.join(tmp, "report.xlsx"),
+                             df_db, only_db, memory=mem)
+        records.append(rec)
+
+    for r in records:
+        r.update(rows=rows, cols=cols, db_only=len(only_db), sheet_only=len(only_sheet))
+    return records
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--sizes", default="10000,1000000,10000000",
+                    help="comma-separated row counts (default: %(default)s)")
+    ap.add_argument("--rows", type=int, help="a single row count (overrides --sizes)")
+    ap.add_argument("--cols", type=int, default=20)
+    ap.add_argument("--mismatch-rate", type=float, default=0.01)
+    ap.add_argument("--dup-rate", type=float, default=0.005)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--rowwise", action="store_true", help="also time the row-wise key builder")
+    ap.add_argument("--no-report", action="store_true", help="skip the report writer stage")
+    ap.add_argument("--no-memory", action="store_true",
+                    help="skip the tracemalloc pass (halves the run time)")
+    ap.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "tu2_bench"))
+    ap.add_argument("--out", default=f"bench_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    args = ap.parse_args()
+
+    sizes = [args.rows] if args.rows else [int(x) for x in args.sizes.split(",") if x.strip()]
+    os.makedirs(args.workdir, exist_ok=True)
+    results = {
+        "meta": {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+                 "pandas": pd.__version__, "numpy": np.__version__, "machine": platform.platform(),
+                 "args": vars(args)},
+        "runs": [],
+    }
+    for rows in sizes:
+        results["runs"].extend(run_size(args.workdir, rows, args.cols, args))
+        with open(args.out, "w", encoding="utf-8") as f:     # keep partial results if a size fails
+            json.dump(results, f, indent=1)
+    print(f"\nResults: {args.out}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+Batch DB-vs-datasheet comparison: runs Tu2.py's mode 1 for one or more
+workbooks without prompts, for scheduled / unattended runs.
+
+    python compare.py --env UAT_STG --config compare.toml book1.xlsx book2.xlsx
+    python compare.py --env PROD --wallet /opt/wallet --out-dir reports *.xlsx
+
+Credentials come from TU_<LABEL>_USER / TU_<LABEL>_PASSWORD (e.g.
+TU_UAT_STG_USER), or from an Oracle wallet with --wallet (the TNS alias
+defaults to the environment label). One session pool, the compiled config
+and the snapshot cache are shared by every workbook in the run. Each report
+gets a <workbook>_RunStats tab and each workbook a line in the run log.
+
+Exit status: 0 no mismatches, 1 mismatches found, 2 error (bad arguments or
+config, missing credentials, a workbook or query that failed).
+"""
+import argparse
+import os
+import sys
+import traceback
+
+import oracledb
+
+import Tu2
+from Tu2 import (ENVS, ReportWriter, RunStats, create_oracle_pool, create_wallet_pool,
+                 has_mismatches, load_plan, open_master, plan_maps, run_sheets,
+                 run_sheets_external, run_sheets_parallel, start_profiler, stats_tab,
+                 stop_profiler)
+
+EXIT_OK, EXIT_MISMATCH, EXIT_ERROR = 0, 1, 2
+
+def env_by_label(label):
+    for cfg in ENVS.values():
+        if cfg["label"].upper() == label.upper():
+            return cfg
+    raise KeyError(f"Unknown environment '{label}' "
+                   f"(choose from {', '.join(e['label'] for e in ENVS.values())}).")
+
+def open_pool(cfg, wallet=None, alias=None, size=Tu2.FETCH_WORKERS):
+    """Session pool for cfg from a wallet, or from TU_<LABEL>_USER / _PASSWORD."""
+    if wallet:
+        return create_wallet_pool(alias or cfg["label"], wallet, size)
+    prefix = f"TU_{cfg['label'].upper()}"
+    user, pw = os.environ.get(f"{prefix}_USER"), os.environ.get(f"{prefix}_PASSWORD")
+    if not user or not pw:
+        raise KeyError(f"Set {prefix}_USER and {prefix}_PASSWORD, or pass --wallet.")
+    return create_oracle_pool(cfg["host"], cfg["port"], cfg["svc"], user, pw, size)
+
+def compare_workbook(pool, label, path, maps, sheets=None, out_dir=None, mode="parallel",
+                     stats=None, workers=Tu2.FETCH_WORKERS):
+    """
+    Compare one workbook against the DB and write its report, with the stage
+    timings from stats (a RunStats) as its last tab. `workers` caps the
+    parallel runner's concurrent fetches. Returns (out_xl, mismatched sheet
+    names).
+    """
+    stats = stats or RunStats()
+    queries, concat_map, key_columns, sheet_rules, usecols = maps
+    xls = open_master(path)
+    try:
+        if sheets:
+            missing = [s for s in sheets if s not in xls.sheet_names]
+            if missing:
+                raise KeyError(f"'{path}' has no sheet '{missing[0]}'.")
+        else:
+            sheets = [s for s in xls.sheet_names if s in queries]
+        undefined = [s for s in sheets if s not in queries]
+        if undefined:
+            raise KeyError(f"No SQL defined for '{undefined[0]}'.")
+
+        base = os.path.splitext(os.path.basename(path))[0]
+        out_xl = os.path.join(out_dir or os.path.dirname(os.path.abspath(path)),
+                              f"{base}_db_vs_sheet.xlsx")
+        mismatched = []
+
+        def write(results, writer):
+            for sheet, blocks, counts in results:
+                with stats.stage("write", sheet) as rec:
+                    rec["rows"] = 0
+                    for tab, df in blocks:
+                        writer.append(tab, df)
+                        rec["rows"] += len(df)
+                status = "⚠️" if has_mismatches(counts) else "✔️"
+                print(f"  {status} {sheet}: " + ", ".join(f"{k} {v}" for k, v in counts.items()))
+                if has_mismatches(counts):
+                    mismatched.append(sheet)
+
+        with ReportWriter(out_xl) as writer:
+            if mode == "parallel":
+                write(run_sheets_parallel(pool, xls, sheets, queries, concat_map, label,
+                                          key_columns, sheet_rules, usecols, stats,
+                                          fetch_workers=workers), writer)
+            else:
+                with pool.acquire() as conn:
+                    if mode == "external":
+                        results = run_sheets_external(conn, xls, sheets, queries, concat_map,
+                                                      label, sheet_rules, usecols, stats)
+                    else:
+                        results = run_sheets(conn, xls, sheets, queries, concat_map, label,
+                                             key_columns, sheet_rules, usecols, stats)
+                    write(results, writer)
+            writer.append(stats_tab(base), stats.frame())
+        return out_xl, mismatched
+    finally:
+        xls.close()
+
+def message(e):
+    # KeyError's str() is the repr of its argument; show the plain message
+    return e.args[0] if isinstance(e, KeyError) and e.args else e
+
+def main(argv=None):
+    """Run the comparison; an unexpected crash prints its traceback and exits with EXIT_ERROR."""
+    try:
+        return run(argv)
+    except Exception:
+        traceback.print_exc()
+        return EXIT_ERROR
+
+def run(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0],
+                                 epilog="Exit status: 0 no mismatches, 1 mismatches, 2 error.")
+    ap.add_argument("workbooks", nargs="+", help="master datasheets (.xlsx) to compare")
+    ap.add_argument("--env", required=True, help="environment label, e.g. UAT_STG")
+    ap.add_argument("--config", default=Tu2.COMPARE_CONFIG,
+                    help="per-sheet comparison config, TOML or YAML (default: %(default)s)")
+    ap.add_argument("--sheets", help="comma-separated sheet names (default: every sheet in the config)")
+    ap.add_argument("--out-dir", help="report folder (default: next to each workbook)")
+    ap.add_argument("--mode", choices=("parallel", "sequential", "external"), default="parallel",
+                    help="runner: concurrent sheets, one at a time, or out-of-core")
+    ap.add_argument("--wallet", help="Oracle wallet directory (external authentication)")
+    ap.add_argument("--alias", help="wallet TNS alias (default: the environment label)")
+    ap.add_argument("--workers", type=int, default=Tu2.FETCH_WORKERS,
+                    help="pooled sessions / concurrent fetches (default: %(default)s)")
+    ap.add_argument("--log", default=Tu2.RUN_LOG,
+                    help="JSON-lines run log, one line per workbook (default: %(default)s)")
+    ap.add_argument("--profile", metavar="DIR",
+                    help=f"write a {Tu2.PROFILER} profile per workbook to DIR")
+    args = ap.parse_args(argv)
+    if args.profile:
+        Tu2.PROFILE_DIR = args.profile
+
+    try:
+        cfg = env_by_label(args.env)
+        maps = plan_maps(load_plan(args.config))
+        if args.out_dir:
+            os.makedirs(args.out_dir, exist_ok=True)
+        pool = open_pool(cfg, args.wallet, args.alias, args.workers)
+    except (KeyError, ValueError, OSError, oracledb.Error) as e:
+        print(f"❌ {message(e)}", file=sys.stderr)
+        return EXIT_ERROR
+
+    sheets = [s.strip() for s in args.sheets.split(",") if s.strip()] if args.sheets else None
+    status = EXIT_OK
+    try:
+        for path in args.workbooks:
+            print(f"\n▶ {path}")
+            stats, prof = RunStats(), start_profiler()
+            try:
+                out_xl, mismatched = compare_workbook(pool, cfg["label"], path, maps, sheets,
+                                                      args.out_dir, args.mode, stats, args.workers)
+            except (KeyError, ValueError, OSError, oracledb.Error) as e:
+                print(f"❌ {path}: {message(e)}", file=sys.stderr)
+                status = EXIT_ERROR
+                continue
+            except Exception:
+                # an unexpected failure in one workbook doesn't stop the others
+                print(f"❌ {path}: unexpected error", file=sys.stderr)
+                traceback.print_exc()
+                status = EXIT_ERROR
+                continue
+            finally:
+                profile = stop_profiler(prof, os.path.splitext(os.path.basename(path))[0])
+            if args.log:
+                stats.write_log(args.log, mode=args.mode, workbook=path, env=cfg["label"],
+                                report=out_xl, mismatched=mismatched)
+            print(f"✅ Report: {out_xl}")
+            if profile:
+                print(f"   Profile: {profile}")
+            if mismatched and status == EXIT_OK:
+                status = EXIT_MISMATCH
+    finally:
+        pool.close()
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main())
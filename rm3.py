@@ -9,7 +9,13 @@ WHAT YOU GET PER SLIDE (per year, paginated):
 - Thin navy line through the middle of every body row
 - (Same-year) a green dotted "today" vertical line placed by day-of-month
 - Milestones (T0 -> star, T1 -> circle), placed fractionally within month by day
-- Smart labels: avoid overlap; for last 4 months wrap to 3 words/line and prefer above
+- Smart labels: placed slide-wide without overlapping other labels, milestones, the
+  header or the legend (right/left of the marker, wrapped, or further out with a
+  leader line); for last 4 months wrap to 3 words/line and prefer above
+
+RENDERER "xml" writes each slide's shape tree as one XML string and inserts it in
+a single parse; "pptx" draws shape by shape through python-pptx. Both produce the
+same slide XML.
 """
 
 from pptx import Presentation
@@ -18,10 +24,18 @@ from pptx.enum.text import PP_ALIGN, MSO_ANCHOR
 from pptx.enum.shapes import MSO_SHAPE, MSO_CONNECTOR
 from pptx.dml.color import RGBColor
 from pptx.enum.dml import MSO_LINE_DASH_STYLE
+from pptx.oxml import parse_xml
+from pptx.oxml.ns import nsdecls
+from xml.sax.saxutils import escape
+from concurrent.futures import ProcessPoolExecutor
 
 import pandas as pd
 import numpy as np
+import hashlib
+import json
+import os
 import re
+import time
 from datetime import datetime, date
 from calendar import monthrange
 
@@ -30,6 +44,16 @@ from calendar import monthrange
 # ------------------------------------------------------------
 IN_XLSX    = r"C:\path\to\Roadmap_Input.xlsx"          # <-- change
 OUT_PPTX   = r"C:\path\to\Roadmap.pptx"                # <-- change
+RENDERER   = "xml"       # "xml" (direct OOXML, fast) or "pptx" (python-pptx shape API)
+# xml renderer: pages are laid out on this many processes (0 = in this process;
+# use 0 when running from a notebook on Windows, where spawn can't pickle cells)
+RENDER_WORKERS = 4
+# incremental mode (xml renderer): each page's shapes are cached in CACHE_DIR under
+# a fingerprint of its groups, milestone rows and the layout config (plus the date
+# on current-year pages, for the today line), and reused while it is unchanged.
+# Entries unused for CACHE_TTL seconds are pruned; CACHE_DIR None disables it.
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".rm3_cache")
+CACHE_TTL = 30 * 24 * 3600
 
 SLIDE_W_IN = 20.0
 SLIDE_H_IN = 9.0
@@ -48,8 +72,21 @@ MAX_ROWS_PER_SLIDE = 20
 # shape sizes
 CIRCLE_D_IN = 0.30
 STAR_D_IN   = 0.40
-LABEL_W_IN  = 2.4         # default label width
-LABEL_H_IN  = 0.45
+
+# label placement: collision boxes are estimated from the text; candidates step
+# LABEL_STEP_IN above/below the marker, and beyond LABEL_NEAR_STEPS steps (up to
+# LABEL_MAX_STEPS) or when shifted sideways by LABEL_SHIFT_IN steps (up to
+# LABEL_MAX_SHIFTS) a label gets a leader line back to its marker
+LABEL_FONT_PT    = 12
+LABEL_CHAR_W_IN  = 0.08      # average glyph width at LABEL_FONT_PT
+LABEL_LINE_H_IN  = 0.2
+LABEL_PAD_IN     = (0.1, 0.05)   # textbox insets (x, y)
+LABEL_STEP_IN    = 0.18
+LABEL_NEAR_STEPS = 2
+LABEL_MAX_STEPS  = 6
+LABEL_SHIFT_IN   = 0.5
+LABEL_MAX_SHIFTS = 3
+GRID_CELL_IN     = 0.5       # spatial index cell size
 
 # colors
 BLUE_HDR   = RGBColor(91,155,213)
@@ -59,6 +96,7 @@ MONTH_ODD  = RGBColor(224,242,255)
 MONTH_EVEN = RGBColor(190,220,240)
 NAVY       = RGBColor(0,0,128)
 GREEN_TOD  = RGBColor(0,176,80)
+LEADER_GREY = RGBColor(128,128,128)
 
 STATUS_COLORS = {
     "on track":   RGBColor(0,176,80),
@@ -80,30 +118,38 @@ def type_bucket(s):
     m = re.match(r"([a-z0-9]+)", s)
     return m.group(1) if m else s
 
+def group_key(df):
+    """
+    Display label "Type\nWorkstream" (original case) for every row at once;
+    str() per value, so blanks read "nan" exactly as the f-string did.
+    """
+    return df["Type"].map(str) + "\n" + df["Workstream"].map(str)
+
 def build_groups_for_year(df_year_sorted):
     """
     Return an ordered list of unique "Type\nWorkstream" pairs following
     the stable sorted order of df_year_sorted.
     """
-    # make display label exactly "Type\nWorkstream" (original case)
-    grp_series = df_year_sorted.apply(lambda r: f"{r['Type']}\n{r['Workstream']}", axis=1)
-    groups = pd.Series(grp_series).drop_duplicates().tolist()
-    return groups
+    grp = df_year_sorted["group"] if "group" in df_year_sorted else group_key(df_year_sorted)
+    return grp.drop_duplicates().tolist()
 
 def slice_pages(groups, max_rows=MAX_ROWS_PER_SLIDE):
     for i in range(0, len(groups), max_rows):
         yield i//max_rows + 1, groups[i:i+max_rows]
 
+def page_numbers(groups, max_rows=MAX_ROWS_PER_SLIDE):
+    """group -> page number (1-based), matching slice_pages."""
+    return {g: i//max_rows + 1 for i, g in enumerate(groups)}
+
 # ------------------------------------------------------------
 # 2) TABLE BUILDER (full editable grid)
 # ------------------------------------------------------------
-def build_full_table(slide, groups, year):
+def table_geometry(n_groups):
     """
-    Creates one editable table (2 + 12 columns) that fills the available
-    vertical space down to BOTTOM_PAD_IN and returns geometry for drawing.
+    Geometry of the page table for n_groups body rows: it fills the available
+    vertical space down to BOTTOM_PAD_IN. Shared by both renderers.
     """
-    rows = int(len(groups) + 1)  # header + body
-    cols = int(14)               # Type, Workstream, 12 months
+    rows = int(n_groups + 1)  # header + body
 
     left_in  = LEFT_PAD_IN
     right_in = SLIDE_W_IN - RIGHT_PAD_IN
@@ -123,6 +169,40 @@ def build_full_table(slide, groups, year):
     body_rows = max(1, rows-1)
     row_h = body_h / body_rows
 
+    # ----- geometry we’ll need for drawing shapes -----
+    left_months  = left_in + type_w + work_w
+    right_months = left_months + months_w
+    y_tops   = [ (top_in + header_h + row_h*(r-1)) for r in range(1, rows) ]
+    y_centers = [ y + row_h/2.0 for y in y_tops ]  # one per body row
+
+    return {
+        "rows": rows,
+        "left_in": left_in,
+        "right_in": right_in,
+        "total_w_in": total_w,
+        "type_w_in": type_w,
+        "work_w_in": work_w,
+        "top_in": top_in,
+        "header_h": header_h,
+        "row_h": row_h,
+        "left_months_in": left_months,
+        "right_months_in": right_months,
+        "month_w_in": month_w,
+        "y_centers_in": y_centers,  # aligned with groups order
+    }
+
+def build_full_table(slide, groups, year):
+    """
+    Creates one editable table (2 + 12 columns) laid out by table_geometry
+    and returns it with the geometry for drawing.
+    """
+    geom = table_geometry(len(groups))
+    rows = geom["rows"]
+    cols = int(14)               # Type, Workstream, 12 months
+    left_in, top_in, total_w = geom["left_in"], geom["top_in"], geom["total_w_in"]
+    type_w, work_w, month_w = geom["type_w_in"], geom["work_w_in"], geom["month_w_in"]
+    header_h, row_h = geom["header_h"], geom["row_h"]
+
     # create
     tbl_shape = slide.shapes.add_table(
         rows, cols,
@@ -184,23 +264,6 @@ def build_full_table(slide, groups, year):
         tbl.rows[r].cells[0].text = t
         tbl.rows[r].cells[1].text = w
 
-    # ----- geometry we’ll need for drawing shapes -----
-    left_months  = left_in + type_w + work_w
-    right_months = left_months + months_w
-    y_tops   = [ (top_in + header_h + row_h*(r-1)) for r in range(1, rows) ]
-    y_centers = [ y + row_h/2.0 for y in y_tops ]  # one per body row
-
-    geom = {
-        "left_in": left_in,
-        "right_in": right_in,
-        "top_in": top_in,
-        "header_h": header_h,
-        "row_h": row_h,
-        "left_months_in": left_months,
-        "right_months_in": right_months,
-        "month_w_in": month_w,
-        "y_centers_in": y_centers,  # aligned with groups order
-    }
     return tbl_shape, tbl, geom
 
 # ------------------------------------------------------------
@@ -218,15 +281,21 @@ def draw_row_center_lines(slide, geom, row_count):
         ln.line.fill.fore_color.rgb = NAVY
         ln.line.width = Pt(0.5)
 
-def add_today_line_if_same_year(slide, year, geom):
+def today_x_in(year, geom):
+    """x of the "today" line on a slide for `year`, or None in other years."""
     today = date.today()
     if today.year != year:
-        return
+        return None
     days_in = monthrange(today.year, today.month)[1]
     month_idx = today.month - 1
     # spread by real day (no mid-month centering)
     day_frac = (today.day - 1) / days_in
-    xpos_in = geom["left_months_in"] + (month_idx + day_frac) * geom["month_w_in"]
+    return geom["left_months_in"] + (month_idx + day_frac) * geom["month_w_in"]
+
+def add_today_line_if_same_year(slide, year, geom):
+    xpos_in = today_x_in(year, geom)
+    if xpos_in is None:
+        return
 
     ln = slide.shapes.add_connector(
         MSO_CONNECTOR.STRAIGHT,
@@ -253,68 +322,162 @@ def three_word_wrap(text):
         out.append(" ".join(line))
     return "\n".join(out)
 
-def place_labels_nonoverlap(slide, base_x_in, base_y_in, text, prefer_above,
-                            months_right_in, existing_rects, max_try=8):
+def overlap_area(a, b):
+    w = min(a[2], b[2]) - max(a[0], b[0])
+    h = min(a[3], b[3]) - max(a[1], b[1])
+    return w*h if w > 0 and h > 0 else 0.0
+
+class LabelGrid:
     """
-    Try to place a small textbox near (base_x_in, base_y_in) without
-    overlapping previously placed labels in the same row.
+    Uniform-grid spatial index of the rectangles (x1, y1, x2, y2 in inches)
+    already on a slide: each rect is filed under every GRID_CELL_IN cell it
+    touches, so an overlap query only tests the rects sharing its cells.
     """
-    width_in = LABEL_W_IN
-    height_in = LABEL_H_IN
-    # if too near right edge, prefer above
-    if base_x_in + width_in > months_right_in:
-        prefer_above = True
-
-    for i in range(max_try):
-        dy_in = (0.18 + 0.18*i) * ( -1 if prefer_above or (i%2==0) else 1 )
-        top_in = base_y_in + dy_in - height_in/2.0
-        left_in = min(base_x_in + 0.1, months_right_in - width_in)  # keep within months area
-
-        rect = (left_in, top_in, left_in+width_in, top_in+height_in)
-        # overlap check
-        overlaps = False
-        for (x1,y1,x2,y2) in existing_rects:
-            if not (rect[2] <= x1 or rect[0] >= x2 or rect[3] <= y1 or rect[1] >= y2):
-                overlaps = True
-                break
-        if not overlaps:
-            tb = slide.shapes.add_textbox(Inches(left_in), Inches(top_in),
-                                          Inches(width_in), Inches(height_in))
-            tf = tb.text_frame
-            tf.clear()
-            p = tf.paragraphs[0]
-            p.text = text
-            p.alignment = PP_ALIGN.LEFT
-            tf.vertical_anchor = MSO_ANCHOR.MIDDLE
-            p.font.size = Pt(12)
-            p.font.color.rgb = TEXT_DARK
-            existing_rects.append(rect)
-            return
-
-    # fallback: just drop a minimal offset above
-    tb = slide.shapes.add_textbox(Inches(base_x_in+0.1), Inches(base_y_in-0.25),
-                                  Inches(width_in), Inches(height_in))
+    def __init__(self, cell=GRID_CELL_IN):
+        self.cell = cell
+        self.rects = []
+        self.cells = {}
+
+    def _keys(self, rect):
+        c = self.cell
+        for gx in range(int(rect[0] // c), int(rect[2] // c) + 1):
+            for gy in range(int(rect[1] // c), int(rect[3] // c) + 1):
+                yield gx, gy
+
+    def _near(self, rect):
+        seen = set()
+        for k in self._keys(rect):
+            seen.update(self.cells.get(k, ()))
+        return [self.rects[i] for i in seen]
+
+    def add(self, rect):
+        self.rects.append(rect)
+        for k in self._keys(rect):
+            self.cells.setdefault(k, []).append(len(self.rects) - 1)
+
+    def hits(self, rect):
+        rects, cells = self.rects, self.cells
+        for k in self._keys(rect):
+            for i in cells.get(k, ()):
+                if overlap_area(rect, rects[i]):
+                    return True
+        return False
+
+    def overlap(self, rect):
+        return sum(overlap_area(rect, r) for r in self._near(rect))
+
+def label_size(text):
+    lines = text.split("\n")
+    return (max(len(l) for l in lines) * LABEL_CHAR_W_IN + 2*LABEL_PAD_IN[0],
+            len(lines) * LABEL_LINE_H_IN + 2*LABEL_PAD_IN[1])
+
+def label_candidates(req, bounds):
+    """
+    Candidate boxes for one label, best first: the text (then its 3-word
+    wrap) right, then left of the marker, LABEL_STEP_IN steps above/below
+    (above first; all above steps first when prefer_above); then the
+    leader-line ones, further out or shifted sideways, nearest first.
+    Candidates leaving bounds are dropped.
+    """
+    x, y, r = req["x"], req["y"], req["r"]
+    bx1, by1, bx2, by2 = bounds
+    steps = range(1, LABEL_MAX_STEPS + 1)
+    if req["prefer_above"]:
+        order = [-k for k in steps] + list(steps)
+    else:
+        order = [d for k in steps for d in (-k, k)]
+    texts = list(dict.fromkeys([req["text"], three_word_wrap(req["text"])]))
+
+    shifts = [0] + [j*k for k in range(1, LABEL_MAX_SHIFTS + 1) for j in (1, -1)]
+
+    near, far = [], []
+    for text in texts:
+        w, h = label_size(text)
+        for side in ("right", "left"):
+            if side == "right":
+                anchor = min(x + r + 0.05, bx2 - w)      # keep within the months area
+            else:
+                anchor = x - r - 0.05 - w
+            for shift in shifts:
+                left = anchor + shift*LABEL_SHIFT_IN
+                for d in order:
+                    top = y + d*LABEL_STEP_IN - h/2.0
+                    rect = (left, top, left + w, top + h)
+                    if rect[0] < bx1 or rect[2] > bx2 or rect[1] < by1 or rect[3] > by2:
+                        continue
+                    cand = {"rect": rect, "text": text, "side": side,
+                            "leader": shift != 0 or abs(d) > LABEL_NEAR_STEPS,
+                            "dist": abs(d)*LABEL_STEP_IN + abs(shift)*LABEL_SHIFT_IN}
+                    (far if cand["leader"] else near).append(cand)
+    return near + sorted(far, key=lambda c: c["dist"])
+
+def solve_labels(requests, grid, bounds):
+    """
+    Greedy placement over the slide-wide grid: major milestones first, then
+    the labels with the fewest free positions next to their marker. Each
+    takes its best free candidate or, when every candidate collides, the
+    least-overlapping one next to its marker. Returns the chosen candidate
+    per request.
+    """
+    cands = [label_candidates(req, bounds) for req in requests]
+    free = [sum(not c["leader"] and not grid.hits(c["rect"]) for c in cs) for cs in cands]
+    order = sorted(range(len(requests)), key=lambda i: (not requests[i]["major"], free[i], i))
+    chosen = [None] * len(requests)
+    for i in order:
+        if not cands[i]:
+            continue
+        best = next((c for c in cands[i] if not grid.hits(c["rect"])), None)
+        if best is None:        # no free spot: least-overlapping one next to the marker
+            best = min([c for c in cands[i] if not c["leader"]] or cands[i],
+                       key=lambda c: grid.overlap(c["rect"]))
+        grid.add(best["rect"])
+        chosen[i] = best
+    return chosen
+
+def leader_line(req, cand):
+    """(x1, y1, x2, y2) from the marker's top/bottom to the nearest edge of its label."""
+    x1, y1, x2, y2 = cand["rect"]
+    above = y2 <= req["y"]
+    sy = req["y"] - req["r"] if above else req["y"] + req["r"]
+    return req["x"], sy, min(max(req["x"], x1), x2), (y2 if above else y1)
+
+def draw_label(slide, req, cand):
+    x1, y1, x2, y2 = cand["rect"]
+    tb = slide.shapes.add_textbox(Inches(x1), Inches(y1), Inches(x2 - x1), Inches(y2 - y1))
     tf = tb.text_frame
-    tf.paragraphs[0].text = text
-    tf.paragraphs[0].font.size = Pt(12)
-    tf.paragraphs[0].font.color.rgb = TEXT_DARK
+    tf.clear()
+    p = tf.paragraphs[0]
+    p.text = cand["text"]
+    p.alignment = PP_ALIGN.LEFT if cand["side"] == "right" else PP_ALIGN.RIGHT
     tf.vertical_anchor = MSO_ANCHOR.MIDDLE
+    p.font.size = Pt(LABEL_FONT_PT)
+    p.font.color.rgb = TEXT_DARK
+    if cand["leader"]:
+        ln = slide.shapes.add_connector(MSO_CONNECTOR.STRAIGHT,
+                                        *[Inches(v) for v in leader_line(req, cand)])
+        ln.line.fill.solid()
+        ln.line.fill.fore_color.rgb = LEADER_GREY
+        ln.line.width = Pt(0.75)
 
-def plot_milestones(slide, df_page, groups, geom, year):
+def milestone_marks(df_page, groups, geom):
+    """
+    Marker and label request per milestone on the page: marks are
+    {"kind", "x", "y", "size", "fill"} (inches; x/y the centre) and requests
+    the label_candidates inputs, in the same order.
+    """
     left_m = geom["left_months_in"]
     month_w = geom["month_w_in"]
     months_right = geom["right_months_in"]
     y_centers = geom["y_centers_in"]
+    marks, requests = [], []
 
-    # per-row placed label rects
-    row_label_rects = {i: [] for i in range(len(groups))}
+    row_of = {g: i for i, g in enumerate(groups)}
+    grp_col = df_page["group"] if "group" in df_page else group_key(df_page)
 
-    for _, row in df_page.iterrows():
+    for grp, (_, row) in zip(grp_col, df_page.iterrows()):
         # row index on this page
-        grp = f"{row['Type']}\n{row['Workstream']}"
-        try:
-            ri = groups.index(grp)
-        except ValueError:
+        ri = row_of.get(grp)
+        if ri is None:
             continue
 
         dt: pd.Timestamp = row["Milestone Date"]
@@ -329,36 +492,61 @@ def plot_milestones(slide, df_page, groups, geom, year):
         mt = clean(row.get("Milestone Type", ""))
         shp_size = STAR_D_IN if mt in ("t0","major") else CIRCLE_D_IN
         shp_kind = MSO_SHAPE.STAR_5_POINT if mt in ("t0","major") else MSO_SHAPE.OVAL
-
-        shp = slide.shapes.add_shape(shp_kind,
-                                     Inches(x_in - shp_size/2.0),
-                                     Inches(y_in - shp_size/2.0),
-                                     Inches(shp_size), Inches(shp_size))
-        shp.fill.solid()
         status = clean(row.get("Milestone Status",""))
-        shp.fill.fore_color.rgb = STATUS_COLORS.get(status, RGBColor(0,176,80))
-        shp.line.color.rgb = RGBColor(0,0,0)
+        marks.append({"kind": shp_kind, "x": x_in, "y": y_in, "size": shp_size,
+                      "fill": STATUS_COLORS.get(status, RGBColor(0,176,80))})
 
         # label text rules
         title = str(row.get("Milestone Title","")).strip()
         prefer_above = (m_idx >= 8)  # last 4 months bias above
         if m_idx >= 8:   # also wrap to 3 words per line in last 4 months
             title = three_word_wrap(title)
+        # if too near right edge, prefer above
+        if x_in + shp_size/2.0 + label_size(title)[0] > months_right:
+            prefer_above = True
 
-        place_labels_nonoverlap(
-            slide,
-            base_x_in = x_in + shp_size/2.0,
-            base_y_in = y_in,
-            text = title,
-            prefer_above = prefer_above,
-            months_right_in = months_right,
-            existing_rects = row_label_rects[ri]
-        )
+        requests.append({"x": x_in, "y": y_in, "r": shp_size/2.0, "text": title,
+                         "prefer_above": prefer_above, "major": mt in ("t0","major")})
+    return marks, requests
+
+def layout_labels(marks, requests, geom, obstacles=()):
+    """
+    Place all of a page's labels at once (solve_labels) against a slide-wide
+    index of the markers, the header row and `obstacles` (e.g. the legend).
+    """
+    grid = LabelGrid()
+    for rect in obstacles:
+        grid.add(rect)
+    grid.add((geom["left_in"], geom["top_in"], geom["right_in"], geom["top_in"] + geom["header_h"]))
+    for m in marks:
+        half = m["size"]/2.0
+        grid.add((m["x"] - half, m["y"] - half, m["x"] + half, m["y"] + half))
+    bounds = (geom["left_months_in"], TOP_PAD_IN, geom["right_months_in"],
+              SLIDE_H_IN - BOTTOM_PAD_IN)
+    return solve_labels(requests, grid, bounds)
+
+def plot_milestones(slide, df_page, groups, geom, year, obstacles=()):
+    """Draw the page's milestone markers, then their labels (layout_labels)."""
+    marks, requests = milestone_marks(df_page, groups, geom)
+    for m in marks:
+        half = m["size"]/2.0
+        shp = slide.shapes.add_shape(m["kind"],
+                                     Inches(m["x"] - half),
+                                     Inches(m["y"] - half),
+                                     Inches(m["size"]), Inches(m["size"]))
+        shp.fill.solid()
+        shp.fill.fore_color.rgb = m["fill"]
+        shp.line.color.rgb = RGBColor(0,0,0)
+
+    for req, cand in zip(requests, layout_labels(marks, requests, geom, obstacles)):
+        if cand is not None:
+            draw_label(slide, req, cand)
 
 # ------------------------------------------------------------
 # 5) Legend (compact)
 # ------------------------------------------------------------
-def add_legend(slide, left_in=LEFT_PAD_IN, top_in=TOP_PAD_IN, height_in=LEGEND_H_IN):
+def legend_items(left_in=LEFT_PAD_IN, top_in=TOP_PAD_IN, height_in=LEGEND_H_IN):
+    """(label, shape, color, cx, cy) per legend entry, centred in equal slots."""
     items = [
         ("T0", MSO_SHAPE.STAR_5_POINT, STATUS_COLORS["on track"]),
         ("T1", MSO_SHAPE.OVAL, STATUS_COLORS["on track"]),
@@ -370,8 +558,21 @@ def add_legend(slide, left_in=LEFT_PAD_IN, top_in=TOP_PAD_IN, height_in=LEGEND_H
     ]
     slot_w = (SLIDE_W_IN - LEFT_PAD_IN - RIGHT_PAD_IN) / len(items)
     cy = top_in + height_in/2.0
-    for i,(lbl, shp_kind, col) in enumerate(items):
-        cx = left_in + (i+0.5)*slot_w
+    return [(lbl, shp_kind, col, left_in + (i+0.5)*slot_w, cy)
+            for i,(lbl, shp_kind, col) in enumerate(items)]
+
+def legend_rects(items):
+    """Rects (inches) the legend covers, for label placement."""
+    rects = []
+    for _, _, _, cx, cy in items:
+        rects += [(cx - 0.12, cy - 0.12, cx + 0.12, cy + 0.12),
+                  (cx + 0.18, cy - 0.14, cx + 1.38, cy + 0.14)]
+    return rects
+
+def add_legend(slide, left_in=LEFT_PAD_IN, top_in=TOP_PAD_IN, height_in=LEGEND_H_IN):
+    """Draw the legend; returns the rects (inches) it covers (legend_rects)."""
+    items = legend_items(left_in, top_in, height_in)
+    for lbl, shp_kind, col, cx, cy in items:
         # shape
         s = slide.shapes.add_shape(
             shp_kind,
@@ -384,14 +585,276 @@ def add_legend(slide, left_in=LEFT_PAD_IN, top_in=TOP_PAD_IN, height_in=LEGEND_H
                                       Inches(1.2), Inches(0.28))
         tf = tb.text_frame; tf.clear()
         p = tf.paragraphs[0]; p.text = lbl; p.font.size = Pt(12)
+    return legend_rects(items)
+
+# ------------------------------------------------------------
+# 6) Direct OOXML renderer (same XML python-pptx writes, built in one pass)
+# ------------------------------------------------------------
+PRST_GEOM = {MSO_SHAPE.STAR_5_POINT: ("star5", "5-Point Star"), MSO_SHAPE.OVAL: ("ellipse", "Oval")}
+
+SHAPE_STYLE = ('<p:style><a:lnRef idx="1"><a:schemeClr val="accent1"/></a:lnRef>'
+               '<a:fillRef idx="3"><a:schemeClr val="accent1"/></a:fillRef>'
+               '<a:effectRef idx="2"><a:schemeClr val="accent1"/></a:effectRef>'
+               '<a:fontRef idx="minor"><a:schemeClr val="lt1"/></a:fontRef></p:style>'
+               '<p:txBody><a:bodyPr rtlCol="0" anchor="ctr"/><a:lstStyle/>'
+               '<a:p><a:pPr algn="ctr"/></a:p></p:txBody>')
+CXN_STYLE = ('<p:style><a:lnRef idx="2"><a:schemeClr val="accent1"/></a:lnRef>'
+             '<a:fillRef idx="0"><a:schemeClr val="accent1"/></a:fillRef>'
+             '<a:effectRef idx="1"><a:schemeClr val="accent1"/></a:effectRef>'
+             '<a:fontRef idx="minor"><a:schemeClr val="tx1"/></a:fontRef></p:style>')
+TABLE_STYLE_ID = "{5C22544A-7EE6-4342-B048-85BDC9FD1C3A}"   # python-pptx's default
+
+def solid(rgb):
+    return f'<a:solidFill><a:srgbClr val="{rgb}"/></a:solidFill>'
+
+def xml_text(s):
+    """Escape like python-pptx: control chars (bar tab/LF) as _xHHHH_, then &, <, >."""
+    return escape(re.sub(r"([\x00-\x08\x0B-\x1F])", lambda m: "_x%04X_" % ord(m.group(1)), s))
+
+def runs_xml(text):
+    """Runs with <a:br/> at each \\n or \\v, empty runs dropped (python-pptx's append_text)."""
+    return "<a:br/>".join(f"<a:r><a:t>{xml_text(t)}</a:t></a:r>" if t else ""
+                          for t in re.split("\n|\v", text))
+
+def paragraphs_xml(text):
+    """One <a:p> per line of text (TextFrame.text)."""
+    return "".join(f"<a:p>{r}</a:p>" if r else "<a:p/>"
+                   for r in map(runs_xml, text.split("\n")))
+
+class SlideXml:
+    """
+    Collects a slide's shapes as XML strings, with the ids and names
+    python-pptx would give them from first_id on (see next_shape_id), for
+    insert_shapes. Positions are in inches and converted with Inches/Pt as
+    the python-pptx renderer does, so both produce the same XML.
+    """
+    def __init__(self, first_id=2):
+        self.next_id = first_id
+        self.parts = []
+
+    def _cNvPr(self, base):
+        sid, self.next_id = self.next_id, self.next_id + 1
+        return f'<p:cNvPr id="{sid}" name="{base} {sid - 1}"/>'
+
+    @staticmethod
+    def _xfrm(x, y, cx, cy, flip=""):
+        return f'<a:xfrm{flip}><a:off x="{x}" y="{y}"/><a:ext cx="{cx}" cy="{cy}"/></a:xfrm>'
+
+    def shape(self, kind, x_in, y_in, w_in, h_in, fill, line=None):
+        prst, base = PRST_GEOM[kind]
+        ln = f"<a:ln>{solid(line)}</a:ln>" if line is not None else ""
+        self.parts.append(
+            f"<p:sp><p:nvSpPr>{self._cNvPr(base)}<p:cNvSpPr/><p:nvPr/></p:nvSpPr><p:spPr>"
+            + self._xfrm(Inches(x_in), Inches(y_in), Inches(w_in), Inches(h_in))
+            + f'<a:prstGeom prst="{prst}"><a:avLst/></a:prstGeom>{solid(fill)}{ln}</p:spPr>'
+            + SHAPE_STYLE + "</p:sp>")
+
+    def textbox(self, x_in, y_in, w_in, h_in, pPr, text, anchor=""):
+        self.parts.append(
+            f'<p:sp><p:nvSpPr>{self._cNvPr("TextBox")}<p:cNvSpPr txBox="1"/><p:nvPr/></p:nvSpPr>'
+            + "<p:spPr>" + self._xfrm(Inches(x_in), Inches(y_in), Inches(w_in), Inches(h_in))
+            + '<a:prstGeom prst="rect"><a:avLst/></a:prstGeom><a:noFill/></p:spPr>'
+            + f'<p:txBody><a:bodyPr wrap="none"{anchor}><a:spAutoFit/></a:bodyPr><a:lstStyle/>'
+            + f"<a:p>{pPr}{runs_xml(text)}</a:p></p:txBody></p:sp>")
+
+    def connector(self, bx_in, by_in, ex_in, ey_in, color, width, dash=False):
+        bx, by, ex, ey = Inches(bx_in), Inches(by_in), Inches(ex_in), Inches(ey_in)
+        flip = (' flipH="1"' if bx > ex else "") + (' flipV="1"' if by > ey else "")
+        dash = '<a:prstDash val="sysDot"/>' if dash else ""
+        self.parts.append(
+            f"<p:cxnSp><p:nvCxnSpPr>{self._cNvPr('Connector')}<p:cNvCxnSpPr/><p:nvPr/></p:nvCxnSpPr>"
+            + "<p:spPr>" + self._xfrm(min(bx, ex), min(by, ey), abs(ex - bx), abs(ey - by), flip)
+            + f'<a:prstGeom prst="line"><a:avLst/></a:prstGeom><a:ln w="{width}">{solid(color)}{dash}</a:ln>'
+            + "</p:spPr>" + CXN_STYLE + "</p:cxnSp>")
+
+    def table(self, geom, groups, year):
+        """The build_full_table grid; month cells are built once per zebra fill."""
+        widths = ([Inches(geom["type_w_in"]), Inches(geom["work_w_in"])]
+                  + [Inches(geom["month_w_in"])] * 12)
+        heights = [Inches(geom["header_h"])] + [Inches(geom["row_h"])] * (geom["rows"] - 1)
+
+        def tc(p, fill):
+            return (f'<a:tc><a:txBody><a:bodyPr anchor="ctr"/><a:lstStyle/>{p}</a:txBody>'
+                    f"<a:tcPr>{solid(fill)}</a:tcPr></a:tc>")
+        hdr_rPr = f'<a:rPr sz="1800">{solid(WHITE)}</a:rPr>'
+        hdr = ["Type", "Workstream"] + [date(year, m, 1).strftime("%b %y") for m in range(1, 13)]
+        body_pPr = f'<a:pPr algn="ctr"><a:defRPr sz="1500">{solid(TEXT_DARK)}</a:defRPr></a:pPr>'
+        months = {fill: tc(f"<a:p>{body_pPr}</a:p>", fill) * 12 for fill in (MONTH_ODD, MONTH_EVEN)}
+
+        rows = [f'<a:tr h="{heights[0]}">'
+                + "".join(tc(f'<a:p><a:pPr algn="ctr"/><a:r>{hdr_rPr}<a:t>{xml_text(h)}</a:t></a:r></a:p>',
+                             BLUE_HDR) for h in hdr)
+                + "</a:tr>"]
+        for r, grp in enumerate(groups, start=1):
+            fill = MONTH_ODD if (r % 2 == 1) else MONTH_EVEN
+            t, w = grp.split("\n", 1)
+            rows.append(f'<a:tr h="{heights[r]}">' + tc(paragraphs_xml(t), fill)
+                        + tc(paragraphs_xml(w), fill) + months[fill] + "</a:tr>")
+
+        self.parts.append(
+            f'<p:graphicFrame><p:nvGraphicFramePr>{self._cNvPr("Table")}'
+            '<p:cNvGraphicFramePr><a:graphicFrameLocks noGrp="1"/></p:cNvGraphicFramePr><p:nvPr/>'
+            "</p:nvGraphicFramePr>"
+            f'<p:xfrm><a:off x="{Inches(geom["left_in"])}" y="{Inches(geom["top_in"])}"/>'
+            f'<a:ext cx="{sum(widths)}" cy="{sum(heights)}"/></p:xfrm>'
+            '<a:graphic><a:graphicData uri="http://schemas.openxmlformats.org/drawingml/2006/table">'
+            f'<a:tbl><a:tblPr firstRow="1" bandRow="1"><a:tableStyleId>{TABLE_STYLE_ID}</a:tableStyleId>'
+            "</a:tblPr><a:tblGrid>" + "".join(f'<a:gridCol w="{w}"/>' for w in widths) + "</a:tblGrid>"
+            + "".join(rows) + "</a:tbl></a:graphicData></a:graphic></p:graphicFrame>")
+
+    def xml(self):
+        return "".join(self.parts)
+
+def next_shape_id(slide):
+    """Id python-pptx gives the next shape added to slide."""
+    return max(int(v) for v in slide.shapes.element.xpath("//@id") if v.isdigit()) + 1
+
+def insert_shapes(slide, xml):
+    """Append SlideXml output to the slide's shape tree in one parse."""
+    tree = parse_xml(f"<p:spTree {nsdecls('a', 'p', 'r')}>{xml}</p:spTree>")
+    slide.shapes.element.extend(list(tree))
+
+def page_xml(df_page, year, groups, first_id=2):
+    """The shapes build_slide draws for one page, as XML (SlideXml)."""
+    sx = SlideXml(first_id)
+
+    # compact legend
+    items = legend_items()
+    for lbl, shp_kind, col, cx, cy in items:
+        sx.shape(shp_kind, cx - 0.12, cy - 0.12, 0.24, 0.24, col)
+        sx.textbox(cx - 0.12 + 0.3, cy - 0.14, 1.2, 0.28, '<a:pPr><a:defRPr sz="1200"/></a:pPr>', lbl)
+
+    # full editable table + geometry
+    geom = table_geometry(len(groups))
+    sx.table(geom, groups, year)
+
+    # navy center lines, "today" only if same year
+    for y_in in geom["y_centers_in"][:len(groups)]:
+        sx.connector(geom["left_months_in"], y_in, geom["right_months_in"], y_in, NAVY, Pt(0.5))
+    xpos_in = today_x_in(year, geom)
+    if xpos_in is not None:
+        sx.connector(xpos_in, geom["top_in"],
+                     xpos_in, geom["top_in"] + geom["row_h"]*len(geom["y_centers_in"]),
+                     GREEN_TOD, Pt(2), dash=True)
+
+    # milestones, then their labels
+    marks, requests = milestone_marks(df_page, groups, geom)
+    for m in marks:
+        half = m["size"]/2.0
+        sx.shape(m["kind"], m["x"] - half, m["y"] - half, m["size"], m["size"], m["fill"],
+                 line=RGBColor(0,0,0))
+    label_rPr = f'<a:defRPr sz="{LABEL_FONT_PT*100}">{solid(TEXT_DARK)}</a:defRPr>'
+    for req, cand in zip(requests, layout_labels(marks, requests, geom, legend_rects(items))):
+        if cand is None:
+            continue
+        x1, y1, x2, y2 = cand["rect"]
+        algn = "l" if cand["side"] == "right" else "r"
+        sx.textbox(x1, y1, x2 - x1, y2 - y1, f'<a:pPr algn="{algn}">{label_rPr}</a:pPr>',
+                   cand["text"], anchor=' anchor="ctr"')
+        if cand["leader"]:
+            sx.connector(*leader_line(req, cand), LEADER_GREY, Pt(0.75))
+    return sx.xml()
+
+def build_slide_xml(prs, df_page, year, groups, page_no, total_pages):
+    """build_slide through page_xml: same shapes, same order, one XML insert."""
+    slide = prs.slides.add_slide(prs.slide_layouts[6])  # blank
+    insert_shapes(slide, page_xml(df_page, year, groups, next_shape_id(slide)))
+
+# columns of a page's rows the slide depends on (milestone_marks)
+PAGE_COLUMNS = ["group", "Milestone Date", "Milestone Type", "Milestone Status", "Milestone Title"]
+# config that only picks files or the code path, not what a slide looks like
+NON_LAYOUT_CONFIG = ("IN_XLSX", "OUT_PPTX", "RENDERER", "RENDER_WORKERS", "CACHE_DIR", "CACHE_TTL",
+                     "NON_LAYOUT_CONFIG")
+
+def layout_digest():
+    """sha256 of this script's source and its layout config (the upper-case globals)."""
+    config = {k: v for k, v in globals().items() if k.isupper() and k not in NON_LAYOUT_CONFIG}
+    h = hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode("utf-8"))
+    with open(__file__, "rb") as f:
+        h.update(f.read())
+    return h.hexdigest()
+
+def page_fingerprint(layout, df_page, year, groups, first_id):
+    """Cache key of one page: everything page_xml reads, plus layout_digest()."""
+    h = hashlib.sha256(json.dumps([layout, year, list(groups), first_id]).encode("utf-8"))
+    if year == date.today().year:
+        h.update(date.today().isoformat().encode("ascii"))
+    cols = [c for c in PAGE_COLUMNS if c in df_page]
+    h.update(json.dumps(cols).encode("utf-8"))
+    h.update(pd.util.hash_pandas_object(df_page[cols], index=False).values.tobytes())
+    return h.hexdigest()
+
+def cache_get(key):
+    """Cached page XML for key, or None (and refresh its age on a hit)."""
+    path = os.path.join(CACHE_DIR, f"{key}.xml")
+    if not os.path.exists(path):
+        return None
+    os.utime(path)
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+def cache_put(key, xml):
+    path = os.path.join(CACHE_DIR, f"{key}.xml")
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        f.write(xml)
+    os.replace(f"{path}.tmp", path)   # a concurrent run never reads half a file
+
+def prune_cache():
+    now = time.time()
+    for name in os.listdir(CACHE_DIR):
+        path = os.path.join(CACHE_DIR, name)
+        if now - os.path.getmtime(path) > CACHE_TTL:
+            os.remove(path)
+
+def render_pages(prs, pages, workers=RENDER_WORKERS):
+    """
+    Add one slide per (df_page, year, groups, page_no, total_pages) in
+    `pages`, in order. With the xml renderer, pages found in CACHE_DIR are
+    reused and the rest go through page_xml, on a process pool when
+    workers > 0; the slides are created up front and filled in `pages`
+    order, so the deck is the same as a serial, uncached run.
+    """
+    if RENDERER != "xml":
+        for page in pages:
+            build_slide(prs, *page)
+        return
+    slides = [prs.slides.add_slide(prs.slide_layouts[6]) for _ in pages]  # blank
+    jobs = [(df_page, year, groups, next_shape_id(slide))
+            for slide, (df_page, year, groups, _, _) in zip(slides, pages)]
+
+    keys, xmls = [None] * len(jobs), [None] * len(jobs)
+    if CACHE_DIR:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        prune_cache()
+        layout = layout_digest()
+        keys = [page_fingerprint(layout, *job) for job in jobs]
+        xmls = [cache_get(k) for k in keys]
+    todo = [i for i, xml in enumerate(xmls) if xml is None]
+
+    if workers and len(todo) > 1:
+        with ProcessPoolExecutor(min(workers, len(todo))) as procs:
+            fresh = list(procs.map(page_xml, *zip(*[jobs[i] for i in todo])))
+    else:
+        fresh = [page_xml(*jobs[i]) for i in todo]
+    for i, xml in zip(todo, fresh):
+        xmls[i] = xml
+        if CACHE_DIR:
+            cache_put(keys[i], xml)
+
+    for slide, xml in zip(slides, xmls):
+        insert_shapes(slide, xml)
+    if CACHE_DIR:
+        print(f"Slides: {len(pages) - len(todo)} reused from cache, {len(todo)} rendered")
 
 # ------------------------------------------------------------
-# 6) Slide builder (per year per page)
+# 7) Slide builder (per year per page)
 # ------------------------------------------------------------
 def build_slide(prs, df_page, year, groups, page_no, total_pages):
+    if RENDERER == "xml":
+        return build_slide_xml(prs, df_page, year, groups, page_no, total_pages)
     slide = prs.slides.add_slide(prs.slide_layouts[6])  # blank
 
-    add_legend(slide)  # compact legend
+    legend = add_legend(slide)  # compact legend
 
     # full editable table + geometry
     tbl_shape, tbl, geom = build_full_table(slide, groups, year)
@@ -403,10 +866,10 @@ def build_slide(prs, df_page, year, groups, page_no, total_pages):
     add_today_line_if_same_year(slide, year, geom)
 
     # plot milestones for this page only
-    plot_milestones(slide, df_page, groups, geom, year)
+    plot_milestones(slide, df_page, groups, geom, year, obstacles=legend)
 
 # ------------------------------------------------------------
-# 7) MAIN
+# 8) MAIN
 # ------------------------------------------------------------
 def main():
     df = pd.read_excel(IN_XLSX)
@@ -426,30 +889,35 @@ def main():
         by=["Type_bucket", "Type_key", "Work_key", "Milestone Date"],
         kind="stable"
     )
+    # "Type\nWorkstream" row label, computed once for every row
+    df_sorted["group"] = group_key(df_sorted)
 
     prs = Presentation()
     prs.slide_width  = Inches(SLIDE_W_IN)
     prs.slide_height = Inches(SLIDE_H_IN)
 
-    years = sorted(df_sorted["year"].unique().tolist())
-    for year in years:
-        df_year = df_sorted[df_sorted["year"] == year].copy()
+    # one pass over the rows per year: groupby keeps the sorted order within each;
+    # pages are collected in deck order and rendered together (render_pages)
+    deck = []
+    for year, df_year in df_sorted.groupby("year", sort=True):
+        year = int(year)
 
         # ordered groups for this year, following sorted order
         groups = build_groups_for_year(df_year)
 
-        # paginate by groups (20 per slide)
+        # paginate by groups (20 per slide): map each row to its page once
         pages = list(slice_pages(groups, MAX_ROWS_PER_SLIDE))
         total_pages = len(pages)
+        page_of_row = df_year["group"].map(page_numbers(groups, MAX_ROWS_PER_SLIDE))
+        df_pages = dict(iter(df_year.groupby(page_of_row, sort=False)))
 
         for page_no, grp_slice in pages:
             # rows for this page only, keep order
-            df_page = df_year[df_year.apply(
-                lambda r: f"{r['Type']}\n{r['Workstream']}" in set(grp_slice), axis=1
-            )].copy()
+            df_page = df_pages[page_no]
+
+            deck.append((df_page, year, grp_slice, page_no, total_pages))
 
-            # build the slide
-            build_slide(prs, df_page, year, grp_slice, page_no, total_pages)
+    render_pages(prs, deck, RENDER_WORKERS)
 
     prs.save(OUT_PPTX)
     print("Saved:", OUT_PPTX)
@@ -0,0 +1,614 @@
+"""
+Tests for Tu2.py's fetch and compare paths against SQLite stand-ins for the
+Oracle connections (same `with conn.cursor() as cur` protocol as oracledb).
+
+    python -m pytest -q
+"""
+import contextlib
+import datetime as dt
+import functools
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Tu2
+from Tu2 import (ReportWriter, build_concat, build_concat_chunks, compare_mismatches, compile_sheet,
+                 external_blocks, fetch_keyed, find_duplicates, iter_fetch_pairs, key_diff, key_diff_counts,
+                 open_master, prepare_sheet, read_sheet_filtered, query_to_chunks, query_to_df, reconcile, run_sheets, run_sheets_external, run_sheets_parallel,
+                 server_side_compare, SheetIndex, sheet_index)
+
+ROWS = [(1, 1.5, "A", 3.0), (2, None, "BB", 4.0), (3, 2.25, None, 5.0), (4, 7.0, "C", None),
+        (5, 0.1, "DD", 6.0), (6, None, "", 7.0), (7, 8.5, "E", 8.0)]
+
+class SQLiteConn:
+    """sqlite3 connection usable from the fetch threads, with the oracledb cursor protocol."""
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+
+    @contextlib.contextmanager
+    def cursor(self):
+        cur = self.conn.cursor()
+        try:
+            yield cur
+        finally:
+            cur.close()
+
+    def close(self):
+        self.conn.close()
+
+class DelayedConn(SQLiteConn):
+    """SQLiteConn whose queries take `delay` seconds, counting how many run at once."""
+    def __init__(self, path, delay, gauge):
+        super().__init__(path)
+        self.delay, self.gauge = delay, gauge
+
+    @contextlib.contextmanager
+    def cursor(self):
+        with super().cursor() as cur:
+            yield DelayedCursor(cur, self.delay, self.gauge)
+
+class DelayedCursor:
+    def __init__(self, cur, delay, gauge):
+        self.__dict__.update(_cur=cur, _delay=delay, _gauge=gauge)
+
+    def __getattr__(self, name):
+        return getattr(self._cur, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._cur, name, value)
+
+    def execute(self, sql):
+        with self._gauge.running(sql):
+            time.sleep(self._delay)
+            return self._cur.execute(sql)
+
+class Gauge:
+    """Peak number of threads inside running() at the same time, and what they started."""
+    def __init__(self):
+        self.lock, self.now, self.peak, self.started = threading.Lock(), 0, 0, []
+        self.changed = threading.Condition(self.lock)
+
+    @contextlib.contextmanager
+    def running(self, what=None):
+        with self.lock:
+            self.now += 1
+            self.peak = max(self.peak, self.now)
+            self.started.append(what)
+            self.changed.notify_all()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.now -= 1
+
+    def wait_started(self, what, times=1, timeout=10):
+        # block until `what` has started `times` times; timeout only guards against a hang
+        with self.changed:
+            return self.changed.wait_for(lambda: self.started.count(what) >= times, timeout)
+
+def rows(df):
+    # DataFrame rows as tuples with NULL / NaN as None
+    return [tuple(None if pd.isna(v) else v for v in r) for r in df.itertuples(index=False)]
+
+@pytest.fixture
+def db(tmp_path):
+    path = str(tmp_path / "t.sqlite")
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE t (id INTEGER, amt REAL, code TEXT, qty REAL)")
+        conn.executemany("INSERT INTO t VALUES (?, ?, ?, ?)", ROWS)
+    return path
+
+@pytest.fixture
+def conn(db):
+    c = SQLiteConn(db)
+    yield c
+    c.close()
+
+# ─── query_to_chunks / build_concat_chunks ───
+
+@pytest.mark.parametrize("arraysize", [1, 3, len(ROWS), 100])
+def test_chunks_match_query_to_df(conn, arraysize):
+    sql = "SELECT * FROM t ORDER BY id"
+    chunks = list(query_to_chunks(conn, sql, arraysize=arraysize))
+    assert len(chunks) == -(-len(ROWS) // arraysize)
+    assert all(len(c) <= arraysize for c in chunks)
+    # a chunk of only NULLs is object dtype (None, not NaN) on its own, so compare values
+    got, want = pd.concat(chunks, ignore_index=True), query_to_df(conn, sql)
+    assert list(got.columns) == list(want.columns)
+    assert rows(got) == rows(want) == ROWS
+
+@pytest.mark.parametrize("cols", [None, ["code", "id"], lambda df: ["qty", "amt"]])
+def test_build_concat_chunks_matches_build_concat(conn, cols):
+    sql = "SELECT * FROM t ORDER BY id"
+    want = build_concat(query_to_df(conn, sql), cols(pd.DataFrame()) if callable(cols) else cols)
+    got = build_concat_chunks(query_to_chunks(conn, sql, arraysize=1), cols)
+    pd.testing.assert_frame_equal(got, want)
+    if cols is None:
+        assert got["Concatenated"].tolist()[:3] == ["11.5A3", "2BB4", "32.255"]
+
+def test_empty_result_keeps_columns(conn):
+    sql = "SELECT * FROM t WHERE id < 0"
+    chunks = list(query_to_chunks(conn, sql, arraysize=2))
+    assert len(chunks) == 1 and chunks[0].empty
+    assert list(chunks[0].columns) == ["id", "amt", "code", "qty"]
+    got = build_concat_chunks(query_to_chunks(conn, sql), ["code", "id"])
+    assert got.empty
+    assert list(got.columns) == list(build_concat(query_to_df(conn, sql), ["code", "id"]).columns)
+
+def test_fetch_lobs_applied_per_statement(db, monkeypatch):
+    import oracledb
+    assert oracledb.defaults.fetch_lobs is True         # importing Tu2 leaves it alone
+    seen = []
+
+    class OracleCursor:                                 # stands in for oracledb.Cursor
+        def __init__(self, cur):
+            self.cur, self.arraysize, self.description = cur, 1, None
+
+        def execute(self, sql, fetch_lobs=None):
+            seen.append(fetch_lobs)
+            self.cur.execute(sql)
+            self.description = self.cur.description
+
+        def fetchall(self):
+            return self.cur.fetchall()
+
+    class OracleConn(SQLiteConn):
+        @contextlib.contextmanager
+        def cursor(self):
+            with super().cursor() as cur:
+                yield OracleCursor(cur)
+
+    monkeypatch.setattr(Tu2.oracledb, "Cursor", OracleCursor)
+    monkeypatch.setattr(Tu2, "FETCH_LOBS", True)         # set after import, still used
+    c = OracleConn(db)
+    assert len(query_to_df(c, "SELECT * FROM t")) == len(ROWS)
+    c.close()
+    assert seen == [True]
+
+# ─── snapshot cache ───
+
+def test_snapshot_replays_same_keys(conn, tmp_path, monkeypatch):
+    pa = pytest.importorskip("pyarrow")
+    sql = "SELECT * FROM t ORDER BY id"
+    monkeypatch.setattr(Tu2, "SNAPSHOT_DIR", str(tmp_path / "snap"))
+    monkeypatch.setattr(Tu2, "SNAPSHOT_PROBES", {sql: "SELECT COUNT(*) FROM t"})
+    executed = []
+    real = Tu2.query_to_chunks
+    monkeypatch.setattr(Tu2, "query_to_chunks",
+                        lambda c, q: executed.append(q) or real(c, q, arraysize=3))
+    first = [build_concat(c) for c in Tu2.fetch_chunks(conn, sql, "dev")]
+    again = [build_concat(c) for c in Tu2.fetch_chunks(conn, sql, "dev")]
+    assert executed == [sql]                          # the second read is a replay
+    assert len(first) == len(again) == 3
+    for a, b in zip(first, again):
+        pd.testing.assert_frame_equal(a, b, check_dtype=False)
+    (snap,) = [n for n in os.listdir(tmp_path / "snap") if n.endswith(".arrow")]
+    with pa.ipc.open_stream(str(tmp_path / "snap" / snap)) as reader:
+        assert set(map(str, reader.schema.types)) == {"large_string"}
+
+# ─── iter_fetch_pairs ───
+
+def test_iter_fetch_pairs_fetches_both_sides_at_once(db):
+    delay, gauge = 0.2, Gauge()
+    conn1, conn2 = DelayedConn(db, delay, gauge), DelayedConn(db, delay, gauge)
+    jobs = [(f"job{i}", f"SELECT * FROM t WHERE id > {i}", f"SELECT * FROM t WHERE id <= {i}",
+             ["id", "code"]) for i in range(3)]
+    out = list(iter_fetch_pairs(conn1, conn2, jobs))
+    assert [name for name, _, _ in out] == ["job0", "job1", "job2"]
+    for (name, df1, df2), (_, sql1, sql2, cols) in zip(out, jobs):
+        plain = SQLiteConn(db)
+        pd.testing.assert_frame_equal(df1, build_concat(query_to_df(plain, sql1), cols))
+        pd.testing.assert_frame_equal(df2, build_concat(query_to_df(plain, sql2), cols))
+        plain.close()
+    assert gauge.peak == 2                                 # the two sides' queries overlapped
+
+def test_iter_fetch_pairs_prefetches_next_pair(db):
+    gauge = Gauge()
+    conn1, conn2 = DelayedConn(db, 0, gauge), DelayedConn(db, 0, gauge)
+    jobs = [(i, f"SELECT * FROM t WHERE id > {i}", f"SELECT * FROM t WHERE id > {i}", None)
+            for i in range(3)]
+    for i, _, _ in iter_fetch_pairs(conn1, conn2, jobs):
+        if i + 1 < len(jobs):
+            # still inside the caller's compare of pair i: pair i + 1's queries start anyway
+            assert gauge.wait_started(jobs[i + 1][1], times=2)
+    assert len(gauge.started) == 2 * len(jobs)
+
+def test_iter_fetch_pairs_no_jobs(conn):
+    assert list(iter_fetch_pairs(conn, conn, [])) == []
+
+# ─── server_side_compare ───
+
+@pytest.fixture
+def two_tables(conn):
+    a = [(1, "x"), (2, "y"), (2, "y"), (3, "z"), (5, "q"), (5, "q")]
+    b = [(1, "x"), (2, "y"), (4, "w"), (5, "q"), (5, "q"), (6, None)]
+    for name, data in (("a", a), ("b", b)):
+        conn.conn.execute(f"CREATE TABLE {name} (id INTEGER, code TEXT)")
+        conn.conn.executemany(f"INSERT INTO {name} VALUES (?, ?)", data)
+    conn.conn.commit()
+    return conn, "SELECT * FROM a", "SELECT * FROM b"
+
+def test_server_side_compare_except(two_tables):
+    conn, sql1, sql2 = two_tables
+    only_2, only_1, dup1, dup2, counts = server_side_compare(conn, sql1, sql2, ("A", "B"), op="EXCEPT")
+    assert sorted(only_1) == ["3z"]
+    assert sorted(only_2) == ["4w", "6"]
+    assert sorted(dup1["Concatenated"]) == ["2y", "2y", "5q", "5q"]
+    assert sorted(dup2["Concatenated"]) == ["5q", "5q"]
+    assert counts.to_dict("records") == [{"Concatenated": "2y", "A_Count": 2, "B_Count": 1}]
+
+def test_server_side_compare_matches_reconcile(two_tables):
+    conn, sql1, sql2 = two_tables
+    only_2, only_1, dup1, dup2, counts = server_side_compare(conn, sql1, sql2, ("A", "B"), op="EXCEPT")
+    rec = reconcile(fetch_keyed(conn, sql1), fetch_keyed(conn, sql2), ("A", "B"))
+    assert sorted(only_1) == sorted(rec["only_left"])
+    assert sorted(only_2) == sorted(rec["only_right"])
+    assert sorted(dup1["Concatenated"]) == sorted(rec["left_dupes"]["Concatenated"])
+    assert sorted(dup2["Concatenated"]) == sorted(rec["right_dupes"]["Concatenated"])
+    pd.testing.assert_frame_equal(counts.sort_values("Concatenated", ignore_index=True),
+                                  rec["count_mismatch"].sort_values("Concatenated", ignore_index=True),
+                                  check_dtype=False)
+
+# ─── SheetIndex / sidecar ───
+
+def test_sheet_index_lookups():
+    keys = pd.Series(["b", "a", None, "c", "a", "d", "b"], dtype=object)
+    df = pd.DataFrame({"Concatenated": keys, "n": range(len(keys))})
+    idx = SheetIndex.build(df["Concatenated"])
+    assert idx.contains(["a", "x", "d", ""]).tolist() == [True, False, True, False]
+    want = df[df["Concatenated"].isin(["a", "b", "zz"])]
+    pd.testing.assert_frame_equal(idx.rows(df, ["a", "b", "zz"]), want)
+    assert idx.rows(df, []).empty
+
+@pytest.fixture
+def workbook(tmp_path):
+    path = str(tmp_path / "book.xlsx")
+    df = pd.DataFrame({"id": ["1", "2", "2", "3"], "code": ["x", "y", "y", "z"]})
+    df["Concatenated"] = df["id"] + df["code"]
+    df.to_excel(path, sheet_name="S", index=False)
+    return path
+
+def test_sheet_index_sidecar(workbook, tmp_path, monkeypatch):
+    monkeypatch.setattr(Tu2, "INDEX_DIR", str(tmp_path / "index"))
+    xls = open_master(workbook)
+    try:
+        df1, idx1 = sheet_index(xls, "S")
+        df2, idx2 = sheet_index(xls, "S")                  # from the sidecar
+    finally:
+        xls.close()
+    pd.testing.assert_frame_equal(df1, df2)
+    assert np.array_equal(idx1.fps, idx2.fps) and np.array_equal(idx1.pos, idx2.pos)
+    [version] = os.listdir(tmp_path / "index")
+    assert version.endswith(Tu2.code_digest()[:16])
+    assert idx2.rows(df2, ["2y"])["id"].tolist() == ["2", "2"]
+
+# ─── reconcile ───
+
+def random_keyed(seed):
+    rng = np.random.default_rng(seed)
+    left = [f"k{i}" for i in rng.integers(0, 40, 60)] + [None, None]
+    right = [f"k{i}" for i in rng.integers(10, 50, 55)] + [None]
+    return keyed(left), keyed(right)
+
+@pytest.mark.parametrize("bits", [None, 64, 128])
+def test_reconcile_matches_compare_mismatches(bits):
+    left, right = random_keyed(bits or 0)
+    rec = reconcile(left, right, ("L", "R"), fingerprint_bits=bits)
+    only_right, only_left = compare_mismatches(left, right, fingerprint_bits=bits)
+    order = sorted if bits is None else list               # the string merge returns keys sorted
+    assert order(rec["only_left"]) == only_left and order(rec["only_right"]) == only_right
+    assert set(left[rec["left_only"]]["Concatenated"]) == set(only_left)
+    pd.testing.assert_frame_equal(rec["left_dupes"], find_duplicates(left))
+    pd.testing.assert_frame_equal(rec["right_dupes"], find_duplicates(right))
+    nl, nr = left["Concatenated"].value_counts(), right["Concatenated"].value_counts()
+    both = nl.index.intersection(nr.index)
+    differ = sorted(k for k in both if nl[k] != nr[k])
+    cm = rec["count_mismatch"].sort_values("Concatenated")
+    assert cm["Concatenated"].tolist() == differ
+    assert cm["L_Count"].tolist() == [nl[k] for k in differ]
+    assert cm["R_Count"].tolist() == [nr[k] for k in differ]
+
+# ─── incremental_reconcile ───
+
+def assert_same_reconcile(got, want):
+    for k, v in want.items():
+        if isinstance(v, pd.DataFrame):
+            pd.testing.assert_frame_equal(got[k].reset_index(drop=True), v.reset_index(drop=True),
+                                          check_dtype=False)
+        elif isinstance(v, np.ndarray):
+            assert got[k].tolist() == v.tolist(), k
+        else:
+            assert got[k] == v, k
+
+def keyed(keys):
+    # keyed frame layout: other columns first, 'Concatenated' last
+    return pd.DataFrame({"n": range(len(keys)), "Concatenated": pd.Series(keys, dtype=object)})
+
+@pytest.mark.parametrize("bits", [64, 128])
+def test_incremental_reconcile_matches_reconcile(tmp_path, monkeypatch, bits):
+    monkeypatch.setattr(Tu2, "INCREMENTAL_CHUNK", 4)
+    state = str(tmp_path / "state.npz")
+    rng = np.random.default_rng(1)
+    left = [f"k{i}" for i in rng.integers(0, 30, 40)] + [None]
+    right = [f"k{i}" for i in rng.integers(0, 30, 37)]
+    runs = [(left, right), (left, right),                                 # unchanged
+            (left, right[:10] + ["new"] + right[11:]),                    # one row changed
+            (left[::-1], right),                                          # reordered
+            (left[:20] + ["ins", "ins"] + left[20:], right),              # rows inserted
+            (left[8:], right[:-5]),                                       # rows removed
+            ([], right), (right, right)]
+    for l, r in runs:
+        want = reconcile(keyed(l), keyed(r), ("S", "D"), fingerprint_bits=bits)
+        got = reconcile(keyed(l), keyed(r), ("S", "D"), fingerprint_bits=bits, state=state)
+        assert_same_reconcile(got, want)
+
+def test_incremental_reconcile_skips_unchanged_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(Tu2, "INCREMENTAL_CHUNK", 4)
+    state = str(tmp_path / "state.npz")
+    keys = [f"k{i}" for i in range(20)]
+    reconcile(keyed(keys), keyed(keys), state=state)
+    hashed = []
+    real = Tu2.fingerprint
+    monkeypatch.setattr(Tu2, "fingerprint", lambda k, bits=64: hashed.append(len(k)) or real(k, bits))
+    reconcile(keyed(keys), keyed(keys[:6] + ["x"] + keys[7:]), state=state)
+    assert hashed == [4]                                   # only the changed chunk of the right side
+
+def test_incremental_reconcile_needs_fingerprints(tmp_path):
+    with pytest.raises(ValueError):
+        reconcile(keyed(["a"]), keyed(["a"]), fingerprint_bits=None, state=str(tmp_path / "s.npz"))
+
+# ─── key_diff ───
+
+def test_key_diff():
+    old = pd.DataFrame({"id": ["1", "2", "3", "4", "4"], "a": ["x", "y", "z", "w", "w2"],
+                        "b": ["1", "2", "3", "4", "5"]})
+    new = pd.DataFrame({"id": ["1", "2", "4", "5"], "a": ["x", "Y", "w", "v"],
+                        "b": ["1", "20", "4", None]})
+    for df in (old, new):
+        df["Concatenated"] = df["id"] + df["a"]
+    diff = key_diff(old, new, ["id"])
+    assert diff.columns.tolist() == ["Change", "id", "Column", "Old", "New"]
+    assert [tuple(r) for r in diff.itertuples(index=False)] == [
+        ("Duplicate key", "4", "", "repeated", ""),
+        ("Removed", "3", "", "3z", ""),
+        ("Added", "5", "", "", "5v"),
+        ("Changed", "2", "a", "y", "Y"),
+        ("Changed", "2", "b", "2", "20"),
+    ]
+    assert key_diff_counts(diff) == {"New": 1, "Old": 1, "Changed": 1}
+    assert key_diff(old, old, ["id"])["Change"].tolist() == ["Duplicate key", "Duplicate key"]
+    with pytest.raises(KeyError):
+        key_diff(old, new, ["missing"])
+
+# ─── external_blocks ───
+
+def test_external_blocks_match_reconcile(tmp_path, monkeypatch):
+    # small runs and blocks, so the k-way merge and the block flushes are exercised
+    monkeypatch.setattr(Tu2, "SPILL_DIR", str(tmp_path))
+    monkeypatch.setattr(Tu2, "spill_sorted_runs", functools.partial(Tu2.spill_sorted_runs, rows_per_run=7))
+    left, right = random_keyed(3)
+    rec = reconcile(left, right, ("L", "R"))
+    counts, tabs = {}, {}
+    blocks = external_blocks(Tu2.frame_chunks(left, 5), Tu2.frame_chunks(right, 5), ("L", "R"),
+                             ("L_Concatenation", "R_Concatenation"),
+                             {"details": "Details", "left_dupes": "LDupes", "right_dupes": "RDupes",
+                              "count_mismatch": "Counts"}, counts)
+    for tab, df in blocks:
+        tabs.setdefault(tab, []).append(df)
+    tabs = {tab: pd.concat(dfs, ignore_index=True) for tab, dfs in tabs.items()}
+    details = tabs["Details"]
+    assert sorted(details.loc[details["MismatchType"] == "L only", "L_Concatenation"]) == \
+        sorted(left[rec["left_only"]]["Concatenated"])
+    assert sorted(details.loc[details["MismatchType"] == "R only", "R_Concatenation"]) == \
+        sorted(right[rec["right_only"]]["Concatenated"])
+    assert sorted(rows(tabs["LDupes"])) == sorted(rows(rec["left_dupes"]))
+    assert sorted(rows(tabs["RDupes"])) == sorted(rows(rec["right_dupes"]))
+    assert sorted(rows(tabs["Counts"])) == sorted(rows(rec["count_mismatch"]))
+    assert counts == {"L": len(rec["only_left"]), "R": len(rec["only_right"]),
+                      "Count": len(rec["count_mismatch"])}
+
+# ─── run_sheets_parallel ───
+
+class SQLitePool:
+    """Session pool stand-in handing out one SQLiteConn per acquire(), counting them."""
+    def __init__(self, path):
+        self.path, self.acquired, self.lock = path, 0, threading.Lock()
+
+    @contextlib.contextmanager
+    def acquire(self):
+        with self.lock:
+            self.acquired += 1
+        conn = SQLiteConn(self.path)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+@pytest.fixture
+def sheets_book(db, tmp_path):
+    # sheet S<i> holds the rows with id > i keyed on id + code, plus one row of its own
+    path = str(tmp_path / "sheets.xlsx")
+    sheets, queries = [f"S{i}" for i in range(5)], {}
+    with pd.ExcelWriter(path) as xw:
+        for i, sheet in enumerate(sheets):
+            keys = [f"{r[0]}{r[2] or ''}" for r in ROWS if r[0] > i] + [f"sheet{i}"]
+            pd.DataFrame({"Concatenated": keys}).to_excel(xw, sheet_name=sheet, index=False)
+            queries[sheet] = f"SELECT id, code FROM t WHERE id > {i}"
+    return path, sheets, queries, {sheet: ["id", "code"] for sheet in sheets}
+
+@pytest.mark.parametrize("compare_workers", [0, 2])
+def test_run_sheets_parallel_matches_sequential(db, sheets_book, compare_workers):
+    path, sheets, queries, concat_map = sheets_book
+    xls, conn = open_master(path), SQLiteConn(db)
+    try:
+        want = [(s, [(t, df) for t, df in tabs], counts)
+                for s, tabs, counts in run_sheets(conn, xls, sheets, queries, concat_map)]
+        got = [(s, [(t, df) for t, df in tabs], counts)
+               for s, tabs, counts in run_sheets_parallel(SQLitePool(db), xls, sheets, queries,
+                                                          concat_map, fetch_workers=2,
+                                                          compare_workers=compare_workers)]
+    finally:
+        xls.close()
+        conn.close()
+    assert [s for s, _, _ in got] == sheets
+    for (s, tabs, counts), (_, want_tabs, want_counts) in zip(got, want):
+        assert counts == want_counts == {"DB": 0, "Sheet": 1, "Count": 0}
+        assert [t for t, _ in tabs] == [t for t, _ in want_tabs]
+        for (_, df), (_, want_df) in zip(tabs, want_tabs):
+            pd.testing.assert_frame_equal(df, want_df)
+
+def test_run_sheets_parallel_caps_sheets_in_flight(db, sheets_book):
+    path, sheets, queries, concat_map = sheets_book
+    pool, started = SQLitePool(db), []
+    xls = open_master(path)
+    try:
+        for i, _ in enumerate(run_sheets_parallel(pool, xls, sheets, queries, concat_map,
+                                                  fetch_workers=4, compare_workers=0, in_flight=2)):
+            started.append(pool.acquired)
+            time.sleep(0.05)                               # give the fetch threads time to run ahead
+    finally:
+        xls.close()
+    assert all(n <= i + 2 for i, n in enumerate(started)), started
+    assert pool.acquired == len(sheets)
+
+# ─── run_sheets_external ───
+
+@pytest.fixture
+def dup_book(conn, tmp_path):
+    # 2y is twice in the DB and once in the sheet; 3z is DB-only, 4w sheet-only
+    conn.conn.execute("CREATE TABLE d (id INTEGER, code TEXT)")
+    conn.conn.executemany("INSERT INTO d VALUES (?, ?)", [(1, "x"), (2, "y"), (2, "y"), (3, "z")])
+    conn.conn.commit()
+    path = str(tmp_path / "dup.xlsx")
+    pd.DataFrame({"id": ["1", "2", "4"], "code": ["x", "y", "w"],
+                  "Concatenated": ["1x", "2y", "4w"]}).to_excel(path, sheet_name="D", index=False)
+    return conn, path, {"D": "SELECT id, code FROM d"}, {"D": ["id", "code"]}
+
+def test_run_sheets_external_reports_count_mismatch(dup_book):
+    conn, path, queries, concat_map = dup_book
+    xls = open_master(path)
+    try:
+        [(_, tabs, counts)] = run_sheets(conn, xls, ["D"], queries, concat_map)
+        [(_, blocks, ext_counts)] = run_sheets_external(conn, xls, ["D"], queries, concat_map)
+        ext_tabs = {}
+        for tab, df in blocks:
+            ext_tabs[tab] = pd.concat([ext_tabs[tab], df]) if tab in ext_tabs else df
+    finally:
+        xls.close()
+    assert counts == {"DB": 1, "Sheet": 1, "Count": 1}
+    assert ext_counts == {"DB": 1, "Sheet": 1, "Count": 1}
+    assert Tu2.has_mismatches(ext_counts)
+    assert ext_tabs["D_CountMismatch"].to_dict("records") == [
+        {"Concatenated": "2y", "DB_Count": 2, "Sheet_Count": 1}]
+    assert ext_tabs["D_DBDupes"]["Concatenated"].tolist() == ["2y", "2y"]
+    assert sorted(ext_tabs["D_MismatchDetails"]["MismatchType"]) == ["DB only", "Sheet only"]
+
+# ─── RunStats ───
+
+def test_run_stats_records_per_stage_rss(tmp_path):
+    if Tu2.rss_mb() is None:
+        pytest.skip("no RSS reading on this platform")
+    stats, kept = Tu2.RunStats(), []
+    with stats.stage("grow"):
+        kept.append(np.ones(8 * 2**20))               # 64 MB, touched so it is resident
+    with stats.stage("idle"):
+        pass
+    grow, idle = stats.frame().set_index("stage")["rss_delta_mb"]
+    assert grow > 48 and abs(idle) < 16
+    stats.write_log(str(tmp_path / "runs.jsonl"))
+    assert "process_peak_rss_mb" in (tmp_path / "runs.jsonl").read_text()
+
+# ─── compare config ───
+
+@pytest.mark.parametrize("bad, message", [
+    ({"normalize": "strip"}, "'normalize' must be a table"),
+    ({"normalize": {"code": 5}}, "'normalize.code' must be a list of normalizer names"),
+    ({"normalize": {"code": ["trim"]}}, "unknown normalizer 'trim'"),
+    ({"where": 5}, "'where' must be a string"),
+    ({"start_at": ["code"]}, "'start_at' must be a string"),
+    ({"drop": {"column": "code", "equals": "A"}}, "'drop' must be a list"),
+    ({"skip_columns": -1}, "'skip_columns' must be a non-negative integer"),
+    ({"colums": ["code"]}, "unknown setting 'colums'"),
+])
+def test_compile_sheet_rejects_bad_settings(bad, message):
+    spec = {"sql": "SELECT * FROM t", "columns": ["code"], **bad}
+    if "skip_columns" in bad:
+        del spec["columns"]
+    with pytest.raises(ValueError, match=message):
+        compile_sheet("S", spec)
+
+def test_compiled_sheet_keys_like_its_query(conn):
+    plan = compile_sheet("S", {
+        "sql": "SELECT * FROM t", "columns": ["code", "amt"], "keys": ["id"],
+        "normalize": {"code": ["strip", "upper"]}, "where": "id IN (1, 2, 5)",
+        "start_at": "id", "drop": [{"column": "code", "endswith": "-deleted"}]})
+    assert plan["sql"] == ('SELECT UPPER(TRIM(q."code")) AS "code", q."amt" AS "amt", q."id" AS "id" '
+                           "FROM (SELECT * FROM t) q WHERE id IN (1, 2, 5)")
+    assert plan["usecols"] == ["Concatenated", "id", "code", "amt", "code", "id"]
+    df_sheet = pd.DataFrame({"note": ["n1", "n2", "n3", "n4"], "id": ["1", "2", "5", "2"],
+                             "code": [" a", "bb ", "Dd", "bb-deleted"],
+                             "amt": ["1.5", None, "0.1", "9"], "Concatenated": "stale"})
+    prepared = prepare_sheet(df_sheet, plan["rules"])
+    assert prepared.columns.tolist() == ["id", "code", "amt", "Concatenated"]
+    assert prepared["code"].tolist() == ["A", "BB", "DD"]
+    db = build_concat(query_to_df(conn, plan["sql"]), plan["concat"])
+    assert prepared["Concatenated"].tolist() == db["Concatenated"].tolist() == ["A1.5", "BB", "DD0.1"]
+
+# ─── read_sheet_filtered ───
+
+def test_read_sheet_filtered_matches_read_excel(tmp_path):
+    path = str(tmp_path / "filtered.xlsx")
+    pd.DataFrame({"note": ["n1", None, "n3", "n4", "n5"],
+                  "id": [1, 2, 3, 4, 5],
+                  "amt": [1.5, None, 2.0, 1e20, 0.1],
+                  "code": ["A", "B-deleted", None, "C-deleted", " d "],
+                  "when": [dt.datetime(2024, 1, 2), dt.datetime(2024, 1, 2, 3, 4, 5), None,
+                           dt.datetime(2024, 3, 1), dt.datetime(2024, 3, 1, 0, 0, 1)]}
+                 ).to_excel(path, index=False)
+    drop = [{"column": "code", "endswith": "-deleted"}, {"column": "note", "equals": "n5"}]
+    xls = open_master(path)
+    try:
+        for usecols, start_at in ((None, None), (["id", "code", "when"], None), (None, "id")):
+            got = read_sheet_filtered(xls, "Sheet1", usecols, drop, start_at)
+            want = pd.read_excel(xls, sheet_name="Sheet1", dtype=str)
+            hit = want["code"].str.endswith("-deleted", na=False)
+            if start_at is None:
+                hit |= want["note"].eq("n5")
+            want = want[~hit].reset_index(drop=True)
+            if usecols:
+                want = want[usecols]
+            pd.testing.assert_frame_equal(got, want)
+    finally:
+        xls.close()
+
+# ─── ReportWriter ───
+
+@pytest.fixture(params=["xlsxwriter", "openpyxl"])
+def writer_backend(request, monkeypatch):
+    if request.param == "openpyxl":
+        real = Tu2.importlib.util.find_spec
+        monkeypatch.setattr(Tu2.importlib.util, "find_spec",
+                            lambda name, *a: None if name == "xlsxwriter" else real(name, *a))
+    return request.param
+
+def test_report_writer_rollover_and_names(tmp_path, writer_backend):
+    path = str(tmp_path / "report.xlsx")
+    long = "A" * 30
+    with ReportWriter(path, max_rows=3) as w:
+        w.append("Tab", pd.DataFrame({"a": [1, 2], "b": ["x", None]}))
+        w.append("Tab", pd.DataFrame({"a": [3, 4, 5], "b": ["y", "z", "w"]}))
+        w.append(f"{long}_SheetDupes", pd.DataFrame({"a": [1]}))
+        w.append(f"{long}_DBDupes", pd.DataFrame({"a": [2]}))
+        w.append("tab_2", pd.DataFrame({"a": [6]}))
+    book = pd.read_excel(path, sheet_name=None)
+    assert list(book) == ["Tab", "Tab_2", "Tab_3", f"{long}_", f"{long[:29]}~2", "tab_2~2"]
+    assert [book[t]["a"].tolist() for t in book] == [[1, 2], [3, 4], [5], [1], [2], [6]]
+    assert book["Tab"]["b"].isna().tolist() == [False, True]
@@ -1,66 +1,53 @@
+# Each selected sheet is parsed from the already-open workbook (xls) by sheet_index;
+# '…-deleted' versions are skipped while the rows stream in, and 'ABC' keeps columns
+# from 'Concatenated' onward
+sheet_rules = {sheet: {"drop": [{"column": "Version", "endswith": "-deleted"}],
+                       "start_at": "Concatenated" if sheet == "ABC" else None}
+               for sheet in sheets}
+# with its SheetIndex, so the sheet-side mismatch rows are binary-search lookups
+sheet_usecols_map = sheet_usecols(sheets, concat_map)
+
 for sheet in sheets:
     print(f"\n▶ Comparing DB → Sheet '{sheet}'")
 
-    # 1) Load the Excel sheet
-    df_sheet = pd.read_excel(
-        master_xl,
-        sheet_name=sheet,
-        engine="openpyxl",
-        dtype=str
-    )
-
-    # 2) If this is your special 'ABC' sheet, drop columns A–C and keep from 'Concatenated' onward
-    if sheet == "ABC":
-        start = df_sheet.columns.get_loc("Concatenated")
-        df_sheet = df_sheet.iloc[:, start:].copy()
-
-    # 3) Remove any '…-deleted' versions before comparing
-    if "Version" in df_sheet.columns:
-        df_sheet = df_sheet[~df_sheet["Version"].str.endswith("-deleted", na=False)]
+    # 1) Take the parsed Excel sheet and its key index
+    df_sheet, sheet_idx = sheet_index(xls, sheet, sheet_usecols_map, sheet_rules)
 
-    # 4) Sanity check
+    # 2) Sanity check
     if "Concatenated" not in df_sheet.columns:
         raise KeyError(f"'{sheet}' missing required 'Concatenated' column.")
 
-    # 5) Fetch DB data and build its concatenated key
-    sql = SQL_QUERIES[sheet]
-    df_db = query_to_df(conn, sql)
+    # 3) Stream DB data and build its concatenated key chunk by chunk
+    #    (per‐sheet cols from concat_map, None => all cols; only those are selected)
+    sql, rule = push_projection(conn, SQL_QUERIES[sheet], concat_map.get(sheet))
+    df_db = build_concat_chunks(query_to_chunks(conn, sql), rule)
 
-    # 5a) pick per‐sheet cols (None => all cols)
-    cols = concat_map.get(sheet, None)
-    cols = cols(df_db) if callable(cols) else cols
+    # 4) Reconcile on the 'Concatenated' key: one pass gives the one-sided rows,
+    #    the duplicates and the keys whose counts differ
+    rec = reconcile(df_sheet, df_db, ("Sheet", "DB"))
 
-    df_db = build_concat(df_db, cols)
-
-    # 6) Determine mismatches on the 'Concatenated' key
-    only_db, only_sheet = compare_mismatches(df_sheet, df_db)
-
-    # 7) Export full‐row mismatch details
+    # 5) Export full‐row mismatch details
     #    – use the same columns you concatenated
-    used_cols = cols or [c for c in df_db.columns if c != "Concatenated"]
+    used_cols = [c for c in df_db.columns if c != "Concatenated"]
 
-    db_rows    = df_db.loc[df_db["Concatenated"].isin(only_db), used_cols].copy()
-    sheet_rows = df_sheet.loc[df_sheet["Concatenated"].isin(only_sheet), used_cols].copy()
+    db_rows    = df_db.loc[rec["right_only"], used_cols].copy()
+    sheet_rows = sheet_idx.rows(df_sheet, rec["only_left"])[used_cols].copy()
 
     db_rows.insert(0, "MismatchType", "DB only")
     sheet_rows.insert(0, "MismatchType", "Sheet only")
 
     details = pd.concat([db_rows, sheet_rows], ignore_index=True)
-    details.to_excel(
-        writer,
-        sheet_name=f"{sheet}_MismatchDetails",
-        index=False
-    )
+    writer.append(f"{sheet}_MismatchDetails", details)
 
-    # 8) Write duplicate‐row sheets as before
-    dup_s = find_duplicates(df_sheet)
+    # 6) Write duplicate‐row sheets as before
+    dup_s = rec["left_dupes"]
     if not dup_s.empty:
-        dup_s.to_excel(writer,
-                       sheet_name=f"{sheet}_SheetDupes",
-                       index=False)
+        writer.append(f"{sheet}_SheetDupes", dup_s)
 
-    dup_d = find_duplicates(df_db)
+    dup_d = rec["right_dupes"]
     if not dup_d.empty:
-        dup_d.to_excel(writer,
-                       sheet_name=f"{sheet}_DBDupes",
-                       index=False)
\ No newline at end of file
+        writer.append(f"{sheet}_DBDupes", dup_d)
+
+    # 7) Keys on both sides with a different number of rows (e.g. 2× in DB, 1× in Sheet)
+    if not rec["count_mismatch"].empty:
+        writer.append(f"{sheet}_CountMismatch", rec["count_mismatch"])
\ No newline at end of file
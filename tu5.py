@@ -6,7 +6,7 @@ export_dir  = input("Enter folder to save the comparison report: ").strip()
 base_name   = input("Enter base filename (without .xlsx): ").strip()
 os.makedirs(export_dir, exist_ok=True)
 out_xl      = os.path.join(export_dir, f"{base_name}.xlsx")
-writer      = pd.ExcelWriter(out_xl, engine="openpyxl")
+writer      = ReportWriter(out_xl)
 
 # ─── Then open your two connections as cfg1/cfg2, usr1/..., pw2/..., sql1/sql2 ─────────
 
@@ -18,37 +18,29 @@ label2 = cfg2["label"]
 
 # ─── Loop through sheets_set exactly as before but using label1/label2 ─────────
 
-for sheet in sheets_set:
-    print(f"\n▶ Comparing {label1} → {label2} on sheet '{sheet}'")
-
-    # 1) fetch & concat from first DB
-    df1 = query_to_df(conn1, queries[sheet])
-    cols1 = concat_map.get(sheet)
-    cols1 = cols1(df1) if callable(cols1) else cols1
-    df1 = build_concat(df1, cols1)
+# 1–2) both DBs are fetched & concatenated concurrently; the next sheet's pair
+#      is already being fetched while this one is compared and written
+jobs = [(sheet, queries[sheet], queries[sheet], concat_map.get(sheet)) for sheet in sheets_set]
 
-    # 2) fetch & concat from second DB
-    df2 = query_to_df(conn2, queries[sheet])
-    cols2 = concat_map.get(sheet)
-    cols2 = cols2(df2) if callable(cols2) else cols2
-    df2 = build_concat(df2, cols2)
+for sheet, df1, df2 in iter_fetch_pairs(conn1, conn2, jobs, (label1, label2)):
+    print(f"\n▶ Comparing {label1} → {label2} on sheet '{sheet}'")
 
-    # 3) compare
-    only_2, only_1 = compare_mismatches(df1, df2)
+    # 3) reconcile: one-sided rows, duplicates and count mismatches in one pass
+    rec = reconcile(df1, df2, (label1, label2))
 
     # 4) prepare full-row details
-    use1 = cols1 or [c for c in df1.columns if c!="Concatenated"]
-    use2 = cols2 or [c for c in df2.columns if c!="Concatenated"]
+    use1 = [c for c in df1.columns if c!="Concatenated"]
+    use2 = [c for c in df2.columns if c!="Concatenated"]
 
     # 4a) rows only in second DB
-    m2 = df2["Concatenated"].isin(only_2)
+    m2 = rec["right_only"]
     df2_only = df2.loc[m2, use2].copy()
     df2_only.insert(0, "MismatchType", f"{label2} only")
     df2_only["DB1_Concat"] = ""
     df2_only["DB2_Concat"] = df2.loc[m2, "Concatenated"].values
 
     # 4b) rows only in first DB
-    m1 = df1["Concatenated"].isin(only_1)
+    m1 = rec["left_only"]
     df1_only = df1.loc[m1, use1].copy()
     df1_only.insert(0, "MismatchType", f"{label1} only")
     df1_only["DB2_Concat"] = ""
@@ -56,28 +48,24 @@ for sheet in sheets_set:
 
     # 4c) combine & write detailed mismatches
     detail = pd.concat([df2_only, df1_only], ignore_index=True)
-    detail.to_excel(
-        writer,
-        sheet_name=f"{sheet}_MismatchDetails",
-        index=False
-    )
+    writer.append(f"{sheet}_MismatchDetails", detail)
 
     # 5) duplicates in each DB
-    dup1 = find_duplicates(df1)
+    dup1 = rec["left_dupes"]
     if not dup1.empty:
-        dup1.to_excel(writer,
-                      sheet_name=f"{sheet}_{label1}_Dupes",
-                      index=False)
+        writer.append(f"{sheet}_{label1}_Dupes", dup1)
 
-    dup2 = find_duplicates(df2)
+    dup2 = rec["right_dupes"]
     if not dup2.empty:
-        dup2.to_excel(writer,
-                      sheet_name=f"{sheet}_{label2}_Dupes",
-                      index=False)
+        writer.append(f"{sheet}_{label2}_Dupes", dup2)
+
+    # 6) keys in both DBs with a different number of rows
+    if not rec["count_mismatch"].empty:
+        writer.append(f"{sheet}_CountMismatch", rec["count_mismatch"])
 
 # ─── Finalize ───────────────────────────────────────────────────────────────────
 
-writer.save()
+writer.close()
 conn1.close()
 conn2.close()
 print(f"\n✅ DB-vs-DB report written to:\n   {out_xl}")
\ No newline at end of file